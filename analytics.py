@@ -0,0 +1,51 @@
+import threading
+
+FLUSH_INTERVAL = 2  # seconds between flushes
+FLUSH_BATCH = 500  # flush early once this many answers are pending
+
+
+class StatsAggregator:
+    """
+    Collects answers in memory and writes their counters to the database in
+    batches from a background thread, so submit_answer does not pay for
+    extra UPDATEs.
+
+    `flush_func(answers)` receives (shard, answer_id, question_id, option_id,
+    is_correct) tuples and must add the ones not yet included in the stored
+    totals; the answer ids let it skip answers a recompute already counted.
+    """
+    def __init__(self, flush_func, interval=FLUSH_INTERVAL, batch=FLUSH_BATCH):
+        self.flush_func = flush_func
+        self.interval = interval
+        self.batch = batch
+        self.flushed = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def record(self, shard: int, answer_id: int, question_id: int, option_id: int | None, is_correct: bool) -> None:
+        with self._lock:
+            self._pending.append((shard, answer_id, question_id, option_id, is_correct))
+            if len(self._pending) >= self.batch:
+                self._wake.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            answers, self._pending = self._pending, []
+        try:
+            self.flush_func(answers)
+            self.flushed += len(answers)
+        except Exception as e:
+            print("[ANALYTICS] flush failed:", e)
+            # keep the answers for the next flush
+            with self._lock:
+                self._pending[:0] = answers
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,120 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+BACKUP_PAGES = 256  # pages copied per backup step
+BACKUP_SLEEP = 0.005  # seconds between steps, so the step's lock never starves writers
+BACKUP_KEEP = 7  # snapshots kept; older ones are deleted after a successful run
+MANIFEST = "manifest.json"
+
+
+def snapshot_file(src_path: str, dest_path: str, pages: int = BACKUP_PAGES, sleep: float = BACKUP_SLEEP) -> dict:
+    """
+    Online copy of one database file to dest_path (gzip-compressed), checked
+    with PRAGMA integrity_check before it is compressed.
+
+    The source is read through a read-only connection that holds one read
+    transaction for the whole copy: in WAL mode writers carry on, and the
+    copy is the consistent state at its start instead of restarting each
+    time another connection commits.
+    """
+    started = time.perf_counter()
+    raw_path = dest_path + ".partial"
+    src = sqlite3.connect(f"file:{quote(os.path.abspath(src_path))}?mode=ro", uri=True, timeout=5)
+    dst = sqlite3.connect(raw_path)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        steps = 0
+        def progress(status, remaining, total):
+            nonlocal steps
+            steps += 1
+        src.backup(dst, pages=pages, sleep=sleep, progress=progress)
+        src.execute("COMMIT")
+        copied = time.perf_counter()
+        # a standalone file: no WAL beside it once restored
+        dst.execute("PRAGMA journal_mode=DELETE")
+        integrity = [row[0] for row in dst.execute("PRAGMA integrity_check").fetchall()]
+        page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        src.close()
+        dst.close()
+    if integrity != ["ok"]:
+        os.remove(raw_path)
+        raise ValueError(f"backup of '{src_path}' failed integrity_check: {integrity[:5]}")
+
+    checked = time.perf_counter()
+    with open(raw_path, "rb") as raw, gzip.open(dest_path + ".gz.partial", "wb", compresslevel=6) as out:
+        shutil.copyfileobj(raw, out, 1024 * 1024)
+    size = os.path.getsize(raw_path)
+    os.remove(raw_path)
+    os.replace(dest_path + ".gz.partial", dest_path + ".gz")
+    return {
+        "file": os.path.basename(dest_path) + ".gz",
+        "pages": page_count,
+        "steps": steps,
+        "bytes": size,
+        "compressed_bytes": os.path.getsize(dest_path + ".gz"),
+        "copy_ms": round((copied - started) * 1000, 1),
+        "check_ms": round((checked - copied) * 1000, 1),
+        "compress_ms": round((time.perf_counter() - checked) * 1000, 1),
+    }
+
+
+def run_backup(sources: list[tuple[str, str]], backup_dir: str, keep: int = BACKUP_KEEP) -> dict:
+    """
+    Snapshots every (label, path) source into backup_dir/<UTC timestamp>/
+    with a manifest, then deletes all but the `keep` newest snapshots.
+    Each file is consistent on its own; files are copied one after another.
+    """
+    started_at = datetime.now(timezone.utc)
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = started_at.strftime("%Y%m%dT%H%M%SZ")
+    name, n = stamp, 1
+    while True:
+        target = os.path.join(backup_dir, name)
+        try:
+            os.mkdir(target)  # fails if another run (or worker) took this name in the same second
+            break
+        except FileExistsError:
+            name, n = f"{stamp}-{n}", n + 1
+    manifest = {"snapshot": name, "started_at": started_at.timestamp(), "files": {}}
+    try:
+        for label, path in sources:
+            manifest["files"][label] = snapshot_file(path, os.path.join(target, f"{label}.db"))
+    except Exception:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+    manifest["seconds"] = round(datetime.now(timezone.utc).timestamp() - manifest["started_at"], 3)
+    with open(os.path.join(target, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    manifest["deleted"] = prune(backup_dir, keep)
+    return manifest
+
+
+def list_snapshots(backup_dir: str) -> list[dict]:
+    """Manifests of the complete snapshots, newest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    snapshots = []
+    for name in sorted(os.listdir(backup_dir), reverse=True):
+        try:
+            with open(os.path.join(backup_dir, name, MANIFEST)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # not a snapshot, or one that did not finish
+    return snapshots
+
+
+def prune(backup_dir: str, keep: int) -> list[str]:
+    """Deletes complete snapshots beyond the `keep` newest; returns their names."""
+    deleted = []
+    for manifest in list_snapshots(backup_dir)[keep:]:
+        shutil.rmtree(os.path.join(backup_dir, manifest["snapshot"]), ignore_errors=True)
+        deleted.append(manifest["snapshot"])
+    return deleted
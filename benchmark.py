@@ -0,0 +1,326 @@
+"""
+Benchmarks for the Quizer backend.
+
+    python benchmark.py db --backend executor driver --concurrency 200 --requests 5000
+    python benchmark.py db --backend driver --shards 1 2 4 --submit-ratio 1
+    python benchmark.py live --clients 2000
+    python benchmark.py search --questions 200000
+
+The `db` benchmark builds a throwaway database, then drives the
+DatabaseManager calls behind the hot endpoints (/home-data, /quiz/{id},
+/submit-answer) from many concurrent coroutines and reports throughput and
+latency percentiles for each backend and user shard count.
+
+The `live` load test starts the server with uvicorn in a subprocess on a
+throwaway database, opens one live room, connects many player sockets
+(needs the `websockets` package from uvicorn[standard]) and measures how
+long each question broadcast takes to reach every player.
+
+The `search` benchmark fills a question bank with generated text and times
+/admin/search queries (plain words, prefixes, deep pages) against it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+from database_manager import DatabaseManager, ACTIVE
+
+
+def build_database(path, subjects=5, quizzes=4, questions=10, options=4, users=200):
+    DatabaseManager(path)  # creates the schema
+    with sqlite3.connect(path) as conn:
+        cur = conn.cursor()
+        quiz_ids = []
+        for s in range(subjects):
+            cur.execute("INSERT INTO subjects (title) VALUES (?)", (f"Subject {s}",))
+            subject_id = cur.lastrowid
+            for q in range(quizzes):
+                cur.execute(
+                    "INSERT INTO quizzes (subject_id, title, gems_reward) VALUES (?, ?, 2)",
+                    (subject_id, f"Quiz {s}.{q}")
+                )
+                quiz_id = cur.lastrowid
+                quiz_ids.append(quiz_id)
+                for n in range(questions):
+                    cur.execute(
+                        "INSERT INTO questions (quiz_id, question_text, question_type, stars_reward) "
+                        "VALUES (?, ?, 'mcq', 1)",
+                        (quiz_id, f"Question {n} of quiz {quiz_id}?")
+                    )
+                    question_id = cur.lastrowid
+                    option_ids = []
+                    for o in range(options):
+                        cur.execute(
+                            "INSERT INTO question_options (question_id, option_text) VALUES (?, ?)",
+                            (question_id, f"Option {o}")
+                        )
+                        option_ids.append(cur.lastrowid)
+                    cur.execute(
+                        "UPDATE questions SET correct_option_id=? WHERE id=?",
+                        (option_ids[0], question_id)
+                    )
+        cur.executemany(
+            "INSERT INTO users (email, username, password, account_status, stars) VALUES (?, ?, 'pw', ?, 1000000)",
+            [(f"user{u}@bench", f"user{u}", ACTIVE) for u in range(users)]
+        )
+        cur.execute("SELECT id FROM users")
+        user_ids = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT id, quiz_id, correct_option_id FROM questions")
+        question_rows = cur.fetchall()
+        conn.commit()
+    return user_ids, quiz_ids, question_rows
+
+
+async def run_db_workload(db, user_ids, quiz_ids, question_rows, concurrency, requests, submit_ratio):
+    latencies = {"home": [], "quiz": [], "submit": []}
+    remaining = [requests]
+
+    async def worker(seed):
+        rnd = random.Random(seed)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            user_id = rnd.choice(user_ids)
+            pick = rnd.random()
+            start = time.perf_counter()
+            if pick < submit_ratio:
+                kind = "submit"
+                question_id, quiz_id, correct = rnd.choice(question_rows)
+                await db.submit_answer(user_id, quiz_id, question_id, correct)
+            elif pick < submit_ratio + (1 - submit_ratio) / 2:
+                kind = "home"
+                await db.get_subject_payload(user_id)
+            else:
+                kind = "quiz"
+                await db.get_quiz_payload(rnd.choice(quiz_ids), user_id)
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench_db(args):
+    print(f"concurrency={args.concurrency} requests={args.requests} submit_ratio={args.submit_ratio}")
+    for backend in args.backend:
+        for shards in args.shards:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "bench.db")
+                user_ids, quiz_ids, question_rows = build_database(path, users=args.users)
+                # with shards > 1 the users built above are migrated into the shard files
+                db = DatabaseManager(path, backend=backend, user_shards=shards)
+                elapsed, latencies = asyncio.run(run_db_workload(
+                    db, user_ids, quiz_ids, question_rows,
+                    args.concurrency, args.requests, args.submit_ratio
+                ))
+                # write pending answer counters before the directory goes away
+                db.question_stats.flush()
+            total = sum(len(v) for v in latencies.values())
+            print(f"\n[{backend}, shards={shards}] {total / elapsed:8.0f} req/s  ({elapsed:.2f}s)")
+            for kind, values in latencies.items():
+                print(
+                    f"  {kind:<7} n={len(values):<6} "
+                    f"p50={percentile(values, 0.50) * 1000:7.2f}ms "
+                    f"p95={percentile(values, 0.95) * 1000:7.2f}ms "
+                    f"p99={percentile(values, 0.99) * 1000:7.2f}ms"
+                )
+
+
+def random_word(rnd):
+    return "".join(rnd.choice("bcdfghklmnprstvz") + rnd.choice("aeiou") for _ in range(rnd.randint(2, 4)))
+
+
+def bench_search(args):
+    rnd = random.Random(1)
+    vocabulary = [random_word(rnd) for _ in range(args.vocabulary)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = DatabaseManager(path)
+        start = time.perf_counter()
+        with sqlite3.connect(path) as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO subjects (title) VALUES ('Search')")
+            cur.execute("INSERT INTO quizzes (subject_id, title) VALUES (?, 'Bank')", (cur.lastrowid,))
+            quiz_id = cur.lastrowid
+            for _ in range(args.questions):
+                text = " ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(6, 14))) + "?"
+                cur.execute(
+                    "INSERT INTO questions (quiz_id, question_text, question_type) VALUES (?, ?, 'mcq')",
+                    (quiz_id, text)
+                )
+                question_id = cur.lastrowid
+                cur.executemany(
+                    "INSERT INTO question_options (question_id, option_text) VALUES (?, ?)",
+                    [(question_id, " ".join(rnd.choice(vocabulary) for _ in range(2))) for _ in range(4)]
+                )
+            conn.commit()
+        print(f"indexed {args.questions} questions in {time.perf_counter() - start:.1f}s")
+
+        queries = {
+            "word": lambda: rnd.choice(vocabulary),
+            "two words": lambda: f"{rnd.choice(vocabulary)} {rnd.choice(vocabulary)}",
+            "prefix": lambda: rnd.choice(vocabulary)[:3] + "*",
+            "page 10": lambda: rnd.choice(vocabulary),
+        }
+
+        async def run():
+            for name, make in queries.items():
+                page = 10 if name == "page 10" else 1
+                latencies, hits = [], 0
+                for _ in range(args.queries):
+                    t = time.perf_counter()
+                    result = await db.search_questions(make(), page)
+                    latencies.append(time.perf_counter() - t)
+                    hits += result["total"]
+                print(
+                    f"  {name:<10} avg hits={hits // args.queries:<6} "
+                    f"p50={percentile(latencies, 0.50) * 1000:7.2f}ms "
+                    f"p99={percentile(latencies, 0.99) * 1000:7.2f}ms"
+                )
+        asyncio.run(run())
+        db.question_stats.flush()
+
+
+def make_token(secret, user_id, username):
+    import jwt
+    payload = {"sub": str(user_id), "username": username, "exp": datetime.now(timezone.utc) + timedelta(hours=1)}
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+async def run_live_load(port, tokens, host_token, quiz_id, rounds):
+    import websockets
+
+    url = f"http://127.0.0.1:{port}/live/rooms"
+    request = urllib.request.Request(
+        url, data=urllib.parse.urlencode({"quiz_id": quiz_id}).encode(),
+        headers={"Authorization": f"Bearer {host_token}"}
+    )
+    code = json.loads(urllib.request.urlopen(request).read())["code"]
+    ws_url = f"ws://127.0.0.1:{port}/live/{code}?token="
+
+    received = {}  # question index -> receive times
+    answered = [0]
+
+    async def player(token, ready):
+        async with websockets.connect(ws_url + token, max_queue=None) as ws:
+            ready.set_result(None)
+            async for raw in ws:
+                message = json.loads(raw)
+                if message["type"] == "question":
+                    received.setdefault(message["index"], []).append(time.perf_counter())
+                    option_id = next(iter(message["question"]["answers"]))
+                    await ws.send(json.dumps({
+                        "type": "answer",
+                        "question_id": message["question"]["id"],
+                        "option_id": int(option_id),
+                    }))
+                elif message["type"] == "answer_result":
+                    answered[0] += 1
+                elif message["type"] == "finished":
+                    return
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    readies = [loop.create_future() for _ in tokens]
+    players = []
+    for i, (token, ready) in enumerate(zip(tokens, readies)):
+        players.append(asyncio.create_task(player(token, ready)))
+        if i % 200 == 199:
+            await asyncio.gather(*readies[i - 199:i + 1])
+    await asyncio.gather(*readies)
+    print(f"{len(tokens)} players connected in {time.perf_counter() - start:.2f}s")
+
+    async with websockets.connect(ws_url + host_token) as host:
+        for index in range(rounds):
+            sent = time.perf_counter()
+            await host.send(json.dumps({"type": "next"}))
+            while len(received.get(index, [])) < len(tokens):
+                await asyncio.sleep(0.01)
+            times = [t - sent for t in received[index]]
+            print(
+                f"question {index}: fan-out to {len(times)} players "
+                f"p50={percentile(times, 0.50) * 1000:.1f}ms "
+                f"p99={percentile(times, 0.99) * 1000:.1f}ms "
+                f"max={max(times) * 1000:.1f}ms"
+            )
+            deadline = time.perf_counter() + 30
+            while answered[0] < len(tokens) * (index + 1) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.01)
+            print(f"  {len(tokens)} answers recorded in {time.perf_counter() - sent:.2f}s")
+        await host.send(json.dumps({"type": "end"}))
+        await asyncio.wait_for(asyncio.gather(*players), 120)
+
+
+def bench_live(args):
+    secret = "benchmark-secret"
+    port = args.port
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "server_data.db")
+        user_ids, quiz_ids, _ = build_database(path, users=args.clients + 1, questions=args.rounds)
+        env = dict(os.environ, SECRET_KEY=secret, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+            cwd=tmp, env=env
+        )
+        try:
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/docs")
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            host_token = make_token(secret, user_ids[0], "user0")
+            tokens = [make_token(secret, uid, f"user{i + 1}") for i, uid in enumerate(user_ids[1:])]
+            asyncio.run(run_live_load(port, tokens, host_token, quiz_ids[0], args.rounds))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quizer benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    db = sub.add_parser("db", help="compare database backends on the hot endpoints")
+    db.add_argument("--backend", nargs="+", default=["executor", "driver"])
+    db.add_argument("--concurrency", type=int, default=200)
+    db.add_argument("--requests", type=int, default=5000)
+    db.add_argument("--users", type=int, default=200)
+    db.add_argument("--shards", nargs="+", type=int, default=[1])
+    db.add_argument("--submit-ratio", type=float, default=0.2)
+    db.set_defaults(func=bench_db)
+
+    live = sub.add_parser("live", help="load test a live room over WebSockets")
+    live.add_argument("--clients", type=int, default=2000)
+    live.add_argument("--rounds", type=int, default=5)
+    live.add_argument("--port", type=int, default=8765)
+    live.set_defaults(func=bench_live)
+
+    search = sub.add_parser("search", help="time full-text search over a large question bank")
+    search.add_argument("--questions", type=int, default=200_000)
+    search.add_argument("--vocabulary", type=int, default=20_000)
+    search.add_argument("--queries", type=int, default=200)
+    search.set_defaults(func=bench_search)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
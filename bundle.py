@@ -0,0 +1,208 @@
+import struct
+
+FORMAT_VERSION = 1
+MEDIA_TYPE = "application/msgpack"
+MAX_DEPTH = 32  # arrays/maps nested deeper than this are rejected by unpackb
+
+
+def packb(obj) -> bytes:
+    """
+    MessagePack encoding of None, bools, ints, floats, str, bytes, lists,
+    tuples and dicts, readable by any MessagePack library.
+    """
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj, out: bytearray) -> None:
+    if obj is None:
+        out.append(0xC0)
+    elif obj is True:
+        out.append(0xC3)
+    elif obj is False:
+        out.append(0xC2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -0x20 <= obj < 0:
+            out.append(obj & 0xFF)
+        elif obj >= 0:
+            for limit, code, fmt in ((0xFF, 0xCC, ">B"), (0xFFFF, 0xCD, ">H"), (0xFFFFFFFF, 0xCE, ">I")):
+                if obj <= limit:
+                    out.append(code)
+                    out += struct.pack(fmt, obj)
+                    return
+            out.append(0xCF)
+            out += struct.pack(">Q", obj)
+        else:
+            for limit, code, fmt in ((0x80, 0xD0, ">b"), (0x8000, 0xD1, ">h"), (0x80000000, 0xD2, ">i")):
+                if obj >= -limit:
+                    out.append(code)
+                    out += struct.pack(fmt, obj)
+                    return
+            out.append(0xD3)
+            out += struct.pack(">q", obj)
+    elif isinstance(obj, float):
+        out.append(0xCB)
+        out += struct.pack(">d", obj)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        _header(len(data), out, 0xA0, 32, (0xD9, 0xDA, 0xDB))
+        out += data
+    elif isinstance(obj, (bytes, bytearray)):
+        _header(len(obj), out, None, 0, (0xC4, 0xC5, 0xC6))
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _header(len(obj), out, 0x90, 16, (None, 0xDC, 0xDD))
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _header(len(obj), out, 0x80, 16, (None, 0xDE, 0xDF))
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"cannot pack {type(obj).__name__}")
+
+
+def _header(n: int, out: bytearray, fix, fix_limit: int, codes) -> None:
+    # fix form, then the 8-, 16- and 32-bit length forms that exist for the type
+    if fix is not None and n < fix_limit:
+        out.append(fix | n)
+    elif codes[0] is not None and n <= 0xFF:
+        out += bytes((codes[0], n))
+    elif n <= 0xFFFF:
+        out.append(codes[1])
+        out += struct.pack(">H", n)
+    else:
+        out.append(codes[2])
+        out += struct.pack(">I", n)
+
+
+def unpackb(data: bytes, max_depth: int = MAX_DEPTH):
+    """
+    Decodes one MessagePack value (the types packb writes), with arrays and
+    maps nested at most max_depth deep. Raises ValueError.
+    """
+    try:
+        obj, end = _unpack(memoryview(data), 0, max_depth)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid MessagePack: {e}")
+    if end != len(data):
+        raise ValueError("invalid MessagePack: trailing bytes")
+    return obj
+
+
+_FIXED = {
+    0xCC: ">B", 0xCD: ">H", 0xCE: ">I", 0xCF: ">Q",
+    0xD0: ">b", 0xD1: ">h", 0xD2: ">i", 0xD3: ">q",
+    0xCA: ">f", 0xCB: ">d",
+}
+_LENGTHS = {0xD9: ">B", 0xDA: ">H", 0xDB: ">I", 0xC4: ">B", 0xC5: ">H", 0xC6: ">I",
+            0xDC: ">H", 0xDD: ">I", 0xDE: ">H", 0xDF: ">I"}
+
+
+def _unpack(data: memoryview, pos: int, depth: int):
+    code = data[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xE0:
+        return code - 0x100, pos
+    if code == 0xC0:
+        return None, pos
+    if code in (0xC2, 0xC3):
+        return code == 0xC3, pos
+    if code in _FIXED:
+        fmt = _FIXED[code]
+        return struct.unpack_from(fmt, data, pos)[0], pos + struct.calcsize(fmt)
+    if 0xA0 <= code <= 0xBF:
+        kind, n = "str", code & 0x1F
+    elif 0x90 <= code <= 0x9F:
+        kind, n = "array", code & 0x0F
+    elif 0x80 <= code <= 0x8F:
+        kind, n = "map", code & 0x0F
+    elif code in _LENGTHS:
+        fmt = _LENGTHS[code]
+        n = struct.unpack_from(fmt, data, pos)[0]
+        pos += struct.calcsize(fmt)
+        kind = "str" if code in (0xD9, 0xDA, 0xDB) else "bin" if code in (0xC4, 0xC5, 0xC6) else \
+            "array" if code in (0xDC, 0xDD) else "map"
+    else:
+        raise ValueError(f"unsupported type byte 0x{code:02x}")
+    if kind in ("str", "bin"):
+        if pos + n > len(data):
+            raise IndexError("truncated")
+        raw = bytes(data[pos:pos + n])
+        return (raw.decode("utf-8") if kind == "str" else raw), pos + n
+    if depth <= 0:
+        raise ValueError("invalid MessagePack: nested too deep")
+    if kind == "array":
+        items = []
+        for _ in range(n):
+            item, pos = _unpack(data, pos, depth - 1)
+            items.append(item)
+        return items, pos
+    result = {}
+    for _ in range(n):
+        key, pos = _unpack(data, pos, depth - 1)
+        value, pos = _unpack(data, pos, depth - 1)
+        result[key] = value
+    return result, pos
+
+
+def encode_bundle(quiz: dict, questions: list, graded: bool) -> bytes:
+    """
+    Packs one quiz as [FORMAT_VERSION, strings, quiz, questions]:
+        strings:   every distinct text once; the text fields below are indexes into it
+        quiz:      [quiz_id, version, subject, title, gems_reward, sample_size]
+        questions: [[question_id, type, text, stars_reward,
+                     [[option_id, text], ...], correct_option_id], ...]
+    correct_option_id is None unless graded.
+
+    questions are (id, type, text, stars_reward, [(option_id, text), ...],
+    correct_option_id) tuples in the order to show them.
+    """
+    strings = {}
+
+    def ref(text):
+        text = text or ""
+        index = strings.get(text)
+        if index is None:
+            index = strings[text] = len(strings)
+        return index
+
+    header = [quiz["id"], quiz["version"], ref(quiz["subject"]), ref(quiz["title"]),
+              quiz["gems_reward"], quiz["sample_size"]]
+    body = [
+        [qid, ref(qtype), ref(text), stars, [[oid, ref(otext)] for oid, otext in options],
+         correct if graded else None]
+        for qid, qtype, text, stars, options, correct in questions
+    ]
+    return packb([FORMAT_VERSION, list(strings), header, body])
+
+
+class QuizBundle:
+    """
+    One version of a quiz's catalog rows, with its encodings built on first
+    use. `key` is what the rows were read at (quiz version and content file).
+    """
+    __slots__ = ("key", "quiz", "questions", "by_id", "_encoded")
+
+    def __init__(self, key, quiz: dict, questions: list):
+        self.key = key
+        self.quiz = quiz
+        self.questions = questions
+        self.by_id = {q[0]: q for q in questions}
+        self._encoded = {}
+
+    def encode(self, drawn: list[int] | None, graded: bool) -> bytes:
+        """The whole quiz (drawn None), or the drawn questions in that order."""
+        if drawn is None:
+            data = self._encoded.get(graded)
+            if data is None:
+                data = self._encoded[graded] = encode_bundle(self.quiz, self.questions, graded)
+            return data
+        picked = [self.by_id[qid] for qid in drawn if qid in self.by_id]
+        return encode_bundle(self.quiz, picked, graded)
@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+from bisect import bisect_left
+
+COHERENCE_INTERVAL = 0.5  # seconds between checks for changes committed by other workers
+COHERENCE_BATCH = 1000  # changes read per check; past this every cache family is dropped instead
+CHANGE_LOG_KEEP = 10_000  # newest cache_changes rows kept per file when the log is pruned
+
+
+class WriterConnection(sqlite3.Connection):
+    """
+    Writer connection that calls `before_commit` (when set) right before an
+    explicit commit(), while the transaction's rows are still its own.
+    """
+    before_commit = None
+
+    def commit(self):
+        if self.before_commit is not None and self.in_transaction:
+            self.before_commit()
+        super().commit()
+
+
+class ChangeFeed:
+    """
+    The cache_changes log of one database file as seen by this worker.
+
+    Triggers on the cached tables append (seq, family, key) for every
+    change, whoever makes it; seq is the rowid, so it only grows. poll()
+    returns the changes since the previous poll, leaving out the seq ranges
+    this worker's own write transactions produced (recorded by track(); its
+    caches were already updated write-through). PRAGMA data_version tells
+    whether the file changed at all, so an idle poll reads no rows. When the
+    log was pruned past the last seq seen, poll() reports an overflow.
+
+    poll() runs on one thread with its own connection; track() on writers.
+    """
+    def __init__(self, name: str, target=None, schema: str = ""):
+        self.name = name
+        self.target = target  # connection target that polls it (None is db_path)
+        self.schema = schema  # "" or "content." on that connection
+        self.data_version = None
+        self.seq = None
+        self.own = []  # (first, last] seq ranges of this worker's transactions, in order
+        self.polls = 0
+        self.changes = 0
+        self.skipped = 0
+        self.overflows = 0
+        self._lock = threading.Lock()
+
+    def last_seq(self, cur) -> int:
+        cur.execute(f"SELECT COALESCE(MAX(seq), 0) FROM {self.schema}cache_changes")
+        return cur.fetchone()[0]
+
+    def track(self, conn):
+        """
+        Returns a before_commit hook for a write transaction on conn, started
+        with BEGIN IMMEDIATE: the seqs written up to its commit are this
+        worker's. Writes after that commit are no longer exclusive and count
+        as anybody's.
+        """
+        first = self.last_seq(conn.cursor())
+        def before_commit():
+            nonlocal first
+            if first is None:
+                return
+            last = self.last_seq(conn.cursor())
+            if last > first:
+                with self._lock:
+                    self.own.append((first, last))
+            first = None
+        return before_commit
+
+    def reset(self) -> None:
+        # the file was replaced: take the next poll as the new starting point
+        self.data_version = None
+        self.seq = None
+
+    def poll(self, cur) -> list | None:
+        """
+        (family, key) pairs changed by others since the last poll, [] when
+        nothing changed, None when more than COHERENCE_BATCH did.
+        """
+        self.polls += 1
+        cur.execute(f"PRAGMA {self.schema}data_version")
+        version = cur.fetchone()[0]
+        if version == self.data_version:
+            return []
+        self.data_version = version
+        if self.seq is None:
+            self.seq = self.last_seq(cur)
+            return []
+        cur.execute(
+            f"SELECT family, key, seq FROM {self.schema}cache_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+            (self.seq, COHERENCE_BATCH + 1)
+        )
+        rows = cur.fetchall()
+        if len(rows) > COHERENCE_BATCH or (rows and rows[0][2] != self.seq + 1):
+            self.overflows += 1
+            self.seq = self.last_seq(cur)
+            with self._lock:
+                self.own = [r for r in self.own if r[1] > self.seq]
+            return None
+        if not rows:
+            return []
+        changes = []
+        with self._lock:
+            own = self.own
+            for family, key, seq in rows:
+                i = bisect_left(own, (seq,)) - 1
+                if i >= 0 and seq <= own[i][1]:
+                    self.skipped += 1
+                else:
+                    changes.append((family, key))
+            self.seq = rows[-1][2]
+            self.own = [r for r in own if r[1] > self.seq]
+        self.changes += len(changes)
+        return changes
+
+    def metrics(self) -> dict:
+        return {
+            "polls": self.polls,
+            "changes": self.changes,
+            "own_skipped": self.skipped,
+            "overflows": self.overflows,
+            "seq": self.seq,
+        }
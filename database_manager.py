@@ -1,58 +1,622 @@
+import json
+import os
 import sqlite3
 from datetime import datetime, timedelta, timezone
 import tools
 import threading
 import asyncio
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from sqlite_driver import DriverPool
+from leaderboard import Leaderboards, GLOBAL
+from analytics import StatsAggregator
+from events import EventBus
+from sampling import QuestionPool, new_seed, pack_ids, unpack_ids
+from locks import LockManager
+from progress import Progress, ProgressCache, QuizProgress
+from bundle import QuizBundle, packb
+from singleflight import SingleFlight
+from coherence import ChangeFeed, WriterConnection, COHERENCE_INTERVAL, CHANGE_LOG_KEEP
+import dedup
+import backup
 
 PENDING = "pending"
 ACTIVE = "active"
 REFILL_TARGET = 6  
+BACKENDS = ("executor", "driver")
+DRIVER_THREADS = 4
+READ_THREADS = 8
+CONTENT_MMAP_SIZE = 256 * 1024 * 1024
+CATALOG_TABLES = ("subjects", "quizzes", "questions", "question_options")
+USER_TABLES = ("users", "user_answers", "user_quizzes", "wallet_ledger", "wallet_snapshots")
+EMAIL_SHARD_CACHE_SIZE = 100_000
+LEADERBOARD_SIZE = 10
+SEARCH_PAGE_SIZE = 20
+DUPLICATE_POLICIES = ("flag", "reject", "allow")
+EXPORT_BATCH_SIZE = 1000  # rows per read transaction of an export
+# exportable user tables: columns, and the timestamp column since/until filter on
+EXPORT_USER_TABLES = {
+    "user_answers": (
+        ("id", "user_id", "quiz_id", "question_id", "selected_option_id", "is_correct", "answered_at"),
+        "answered_at",
+    ),
+    "user_quizzes": (
+        ("id", "user_id", "quiz_id", "completed", "score", "score_percent", "gems_awarded",
+         "completed_at", "seed", "drawn"),
+        "completed_at",
+    ),
+}
+EXPORT_TABLES = ("questions",) + tuple(EXPORT_USER_TABLES)
+GC_BATCH_SIZE = 500  # rows examined per orphan-collection transaction
+GC_TIME_BUDGET = 2.0  # seconds of work per collect_orphans run; the next run resumes there
+# orphan checks of collect_orphans, in order: (table, where the rows live, condition on `t`)
+GC_CHECKS = (
+    ("user_answers", "user",
+     "NOT EXISTS (SELECT 1 FROM questions q WHERE q.id = t.question_id) "
+     "OR NOT EXISTS (SELECT 1 FROM quizzes z WHERE z.id = t.quiz_id)"),
+    ("user_quizzes", "user", "NOT EXISTS (SELECT 1 FROM quizzes z WHERE z.id = t.quiz_id)"),
+    # answers that picked an option deleted since keep the answer, not the reference
+    ("user_answers.selected_option_id", "user",
+     "t.selected_option_id IS NOT NULL "
+     "AND NOT EXISTS (SELECT 1 FROM question_options o WHERE o.id = t.selected_option_id)"),
+    ("quizzes", "catalog", "NOT EXISTS (SELECT 1 FROM subjects s WHERE s.id = t.subject_id)"),
+    ("questions", "catalog", "NOT EXISTS (SELECT 1 FROM quizzes z WHERE z.id = t.quiz_id)"),
+    ("question_options", "catalog", "NOT EXISTS (SELECT 1 FROM questions q WHERE q.id = t.question_id)"),
+    ("question_signatures", "catalog", "NOT EXISTS (SELECT 1 FROM questions q WHERE q.id = t.question_id)"),
+    ("question_stats", "main", "NOT EXISTS (SELECT 1 FROM questions q WHERE q.id = t.question_id)"),
+    ("option_stats", "main", "NOT EXISTS (SELECT 1 FROM question_options o WHERE o.id = t.option_id)"),
+)
+# bump whenever _init_db changes the schema; files stamped with it skip the DDL at startup
+SCHEMA_VERSION = 5
+WALLET_KEEP_DAYS = 30  # ledger rows younger than this stay itemized; older ones are folded into snapshots
+WALLET_COMPACT_BATCH = 5000  # ledger rows folded per transaction
+WALLET_PAGE_SIZE = 50
+SYNC_MAX_ANSWERS = 500  # answers accepted by one sync_answers call
+# tables read once at startup so their pages are in the OS cache before the first request
+WARM_TABLES = {
+    "catalog": ("SELECT SUM(LENGTH(title)) FROM subjects",
+                "SELECT SUM(LENGTH(title)) FROM quizzes",
+                "SELECT SUM(LENGTH(question_text)), SUM(correct_option_id) FROM questions",
+                "SELECT SUM(LENGTH(option_text)), SUM(question_id) FROM question_options"),
+    "user": ("SELECT SUM(stars), SUM(gems) FROM users",
+             "SELECT COUNT(*) FROM user_quizzes WHERE user_id >= 0"),
+}
+ANALYSIS_LIMIT = 1000  # rows ANALYZE samples per index, keeps it fast on big tables
+WAL_TRUNCATE_BYTES = 64 * 1024 * 1024  # WAL size above which maintenance truncates it
+VACUUM_MIN_FREE_PAGES = 256  # free pages worth an incremental_vacuum
+VACUUM_MAX_PAGES = 10_000  # pages released per run, bounds how long the write lock is held
+# question_search (FTS5) mirrors questions and their options through these triggers,
+# so every writer (admin routes, bulk imports, offline catalog builds) keeps it in sync
+SEARCH_TRIGGERS = {
+    "question_search_ai": """
+        AFTER INSERT ON questions BEGIN
+            INSERT INTO question_search (rowid, question_text, options_text)
+            VALUES (new.id, new.question_text, '');
+        END""",
+    "question_search_au": """
+        AFTER UPDATE OF question_text ON questions BEGIN
+            UPDATE question_search SET question_text = new.question_text WHERE rowid = new.id;
+        END""",
+    "question_search_ad": """
+        AFTER DELETE ON questions BEGIN
+            DELETE FROM question_search WHERE rowid = old.id;
+        END""",
+    "question_search_oi": """
+        AFTER INSERT ON question_options BEGIN
+            UPDATE question_search SET options_text = (
+                SELECT group_concat(option_text, ' ') FROM question_options WHERE question_id = new.question_id
+            ) WHERE rowid = new.question_id;
+        END""",
+    "question_search_ou": """
+        AFTER UPDATE OF option_text ON question_options BEGIN
+            UPDATE question_search SET options_text = (
+                SELECT group_concat(option_text, ' ') FROM question_options WHERE question_id = new.question_id
+            ) WHERE rowid = new.question_id;
+        END""",
+    "question_search_od": """
+        AFTER DELETE ON question_options BEGIN
+            UPDATE question_search SET options_text = COALESCE((
+                SELECT group_concat(option_text, ' ') FROM question_options WHERE question_id = old.question_id
+            ), '') WHERE rowid = old.question_id;
+        END""",
+}
+
+# quizzes.version is bumped by every change to what a quiz shows (its row, its
+# subject's title, its questions and their options), whoever makes it; cached
+# quiz bundles are keyed by it
+VERSION_TRIGGERS = {
+    "quiz_version_zu": """
+        AFTER UPDATE OF subject_id, title, gems_reward, sample_size ON quizzes BEGIN
+            UPDATE quizzes SET version = version + 1 WHERE id = new.id;
+        END""",
+    "quiz_version_su": """
+        AFTER UPDATE OF title ON subjects BEGIN
+            UPDATE quizzes SET version = version + 1 WHERE subject_id = new.id;
+        END""",
+    "quiz_version_qi": """
+        AFTER INSERT ON questions BEGIN
+            UPDATE quizzes SET version = version + 1 WHERE id = new.quiz_id;
+        END""",
+    "quiz_version_qu": """
+        AFTER UPDATE ON questions BEGIN
+            UPDATE quizzes SET version = version + 1 WHERE id IN (old.quiz_id, new.quiz_id);
+        END""",
+    "quiz_version_qd": """
+        AFTER DELETE ON questions BEGIN
+            UPDATE quizzes SET version = version + 1 WHERE id = old.quiz_id;
+        END""",
+    "quiz_version_oi": """
+        AFTER INSERT ON question_options BEGIN
+            UPDATE quizzes SET version = version + 1
+            WHERE id = (SELECT quiz_id FROM questions WHERE id = new.question_id);
+        END""",
+    "quiz_version_ou": """
+        AFTER UPDATE ON question_options BEGIN
+            UPDATE quizzes SET version = version + 1
+            WHERE id IN (SELECT quiz_id FROM questions WHERE id IN (old.question_id, new.question_id));
+        END""",
+    "quiz_version_od": """
+        AFTER DELETE ON question_options BEGIN
+            UPDATE quizzes SET version = version + 1
+            WHERE id = (SELECT quiz_id FROM questions WHERE id = old.question_id);
+        END""",
+}
+
+# cache_changes: every change to a table a worker caches appends (family,
+# key), so the other workers can drop exactly what changed (see
+# coherence.ChangeFeed). name -> (event, family, key)
+USER_CHANGE_TRIGGERS = {
+    "cache_users_au": ("AFTER UPDATE OF username, stars, gems ON users", "progress", "new.id"),
+    "cache_users_ad": ("AFTER DELETE ON users", "progress", "old.id"),
+    "cache_user_quizzes_ai": ("AFTER INSERT ON user_quizzes", "progress", "new.user_id"),
+    "cache_user_quizzes_au": ("AFTER UPDATE ON user_quizzes", "progress", "new.user_id"),
+    "cache_user_quizzes_ad": ("AFTER DELETE ON user_quizzes", "progress", "old.user_id"),
+    "cache_leaderboard_ai": ("AFTER INSERT ON leaderboard", "leaderboard", "new.user_id"),
+    "cache_leaderboard_au": ("AFTER UPDATE ON leaderboard", "leaderboard", "new.user_id"),
+    "cache_leaderboard_ad": ("AFTER DELETE ON leaderboard", "leaderboard", "old.user_id"),
+}
+# quizzes.version already follows every catalog change that matters (VERSION_TRIGGERS)
+CATALOG_CHANGE_TRIGGERS = {
+    "cache_quizzes_ai": ("AFTER INSERT ON quizzes", "catalog", "new.id"),
+    "cache_quizzes_av": ("AFTER UPDATE OF version ON quizzes", "catalog", "new.id"),
+    "cache_quizzes_ad": ("AFTER DELETE ON quizzes", "catalog", "old.id"),
+}
+
+# statements a read-only connection may prepare; anything else is denied by
+# the authorizer before it runs
+READ_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+    sqlite3.SQLITE_TRANSACTION,
+    sqlite3.SQLITE_PRAGMA,
+}
+
+
+def _read_only_authorizer(action, arg1, arg2, db_name, trigger):
+    if action in READ_ACTIONS:
+        return sqlite3.SQLITE_OK
+    # FTS5 tables declare their schema on open, which is authorized as an
+    # update of sqlite_master; plain SQL can never write sqlite_master
+    if action == sqlite3.SQLITE_UPDATE and arg1 == "sqlite_master":
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def _fts_query(text: str) -> str:
+    """
+    Turns free text into an FTS5 query: every word must match, a trailing *
+    makes a word a prefix. Words are quoted, so FTS5 operators and
+    punctuation in the input are taken literally.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+
+def _sqlite_uri(path, mode, immutable=False):
+    uri = f"file:{quote(os.path.abspath(path))}?mode={mode}"
+    return uri + "&immutable=1" if immutable else uri
 
 
 class DatabaseManager:
-    def __init__(self, db_path="server_data.db"):
+    def __init__(self, db_path="server_data.db", backend="executor", driver_threads=DRIVER_THREADS,
+                 content_db_path=None, content_immutable=False, user_shards=1):
+        """
+        backend:
+            "executor" - every query is a closure shipped to the default thread
+                         pool with run_in_executor and opens its own connection.
+            "driver"   - queries are queued to a few dedicated driver threads
+                         that keep their connection open and run queued
+                         closures back to back (aiosqlite-style).
+
+        Pure reads run on a separate pool of read-only connections in both
+        backends (see _run(readonly=True)).
+
+        content_db_path:
+            When set, the catalog tables (subjects, quizzes, questions,
+            question_options) live in this file and every connection attaches
+            it as `content`; db_path keeps the user-state tables. Unqualified
+            table names resolve across both, so joins work unchanged.
+        content_immutable:
+            Open the content file read-only with immutable=1 (no locking, no
+            change detection by SQLite). Admin catalog writes then fail; the
+            catalog is rebuilt offline and installed with swap_content_db().
+        user_shards:
+            With N > 1, users, user_answers and user_quizzes are spread over N
+            files (<db>.shard<i>.db) by user_id % N, each with its own writer
+            lock and driver threads. db_path keeps the catalog (unless it is
+            split out) and the server tables; shard connections attach the
+            catalog as `content`.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown database backend '{backend}'")
+        if content_immutable and not content_db_path:
+            raise ValueError("content_immutable requires content_db_path")
+        if user_shards < 1:
+            raise ValueError("user_shards must be at least 1")
         self.DBpath = db_path
-        self.db_lock = threading.Lock()
-        self._init_db()
+        self.content_path = content_db_path
+        self.content_immutable = content_immutable
+        self.user_shards = user_shards
+        self.locks = LockManager()
+        self.backend = backend
+        self._local = threading.local()
+        self._email_shards = {}
+        self.leaderboards = Leaderboards()
+        self._leaderboard_lock = asyncio.Lock()
+        self.question_stats = StatsAggregator(self.apply_question_stats)
+        self.events = EventBus()
+        self.question_pools = {}
+        self._pool_generation = 0
+        self.bundles = {}  # quiz id -> QuizBundle
+        self.flights = SingleFlight()  # identical catalog reads in flight
+        self.invalidations = {"catalog": 0, "progress": 0, "leaderboard": 0, "all": 0}
+        self.progress = ProgressCache()
+        # foreign keys can only be enforced when every table is in one file
+        # (SQLite does not follow them into attached databases)
+        self.foreign_keys = user_shards == 1 and not content_db_path
+        self._gc_step = 0  # position of collect_orphans in GC_CHECKS x shards
+        self._gc_after = 0  # last rowid examined in that step
+        self._maintenance_lock = threading.Lock()
+        self._maintenance_runs = 0
+        self._backup_lock = threading.Lock()
+        self.last_backup = None  # manifest or {"error": ...} of this worker's last backup
+        self.ready = False  # set by warm_up
+
+        # connection targets: None is db_path, 0..N-1 are the user shards
+        # (with a single shard, user state lives in db_path itself)
+        if user_shards == 1:
+            self._paths = {None: db_path}
+        else:
+            stem, ext = os.path.splitext(db_path)
+            self._paths = {None: db_path}
+            self._paths.update({i: f"{stem}.shard{i}{ext or '.db'}" for i in range(user_shards)})
+
+        # cache_changes of each file with cached tables, named like its file
+        # lock; the content file is polled through db_path's connection
+        self.feeds = {}
+        if user_shards == 1 or not content_db_path:
+            self.feeds["main"] = ChangeFeed("main")
+        if content_db_path and not content_immutable:
+            self.feeds["content"] = ChangeFeed("content", schema="content.")
+        if user_shards > 1:
+            self.feeds.update({f"shard{i}": ChangeFeed(f"shard{i}", target=i) for i in range(user_shards)})
+        self._watch_executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite-watch")
+        self._watch_conns = {}  # target -> read-only connection, used by the watch thread only
+        self._watch_signature = None
+
+        if backend == "driver":
+            self._drivers = {target: DriverPool(driver_threads, name=f"sqlite-driver-{target}")
+                             for target in self._paths}
+            self._readers = DriverPool(READ_THREADS, name="sqlite-reader")
+        else:
+            self._drivers = None
+            self._read_executor = ThreadPoolExecutor(READ_THREADS, thread_name_prefix="sqlite-reader")
+
+        started = time.perf_counter()
+        if self._schema_current():
+            self.startup = {"schema": "current"}
+        else:
+            self._init_db()
+            self._stamp_schema()
+            self.startup = {"schema": "updated"}
+        self.startup["init_db_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _target(self, shard):
+        # with a single shard, shard 0 is db_path
+        return None if self.user_shards == 1 else shard
+
+    def _user_shard(self, user_id: int) -> int:
+        return user_id % self.user_shards
+
+    def _home_shard(self, email: str) -> int:
+        # shard a new account is created on
+        return zlib.crc32(email.lower().encode()) % self.user_shards
+
+    def _file_lock(self, shard=None):
+        """In-process lock of db_path (shard None) or a user shard's file."""
+        target = self._target(shard)
+        return self.locks.file("main" if target is None else f"shard{target}")
+
+    @contextmanager
+    def _write(self, shard=None):
+        """
+        Write transaction on db_path or a user shard: `with self._write(shard) as conn:`.
+        Holds the file's lock for its duration and starts with BEGIN
+        IMMEDIATE, so the reads and writes inside see one state of the file
+        and no writer of another process commits in between. Committed on
+        exit, rolled back on an exception. The file's ChangeFeed learns which
+        cache_changes rows are this worker's.
+        """
+        target = self._target(shard)
+        name = "main" if target is None else f"shard{target}"
+        feed = self.feeds.get(name)
+        with self._file_lock(shard), self._connect(shard=shard) as conn:
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            self.locks.sqlite_wait(name, time.perf_counter() - started)
+            conn.before_commit = feed.track(conn) if feed else None
+            try:
+                yield conn
+                if conn.before_commit is not None and conn.in_transaction:
+                    # the with block commits without going through commit()
+                    conn.before_commit()
+            finally:
+                conn.before_commit = None
+
+    def _connect(self, readonly=False, shard=None) -> sqlite3.Connection:
+        """
+        Connection for the current query. Use it as `with self._connect() as conn:`
+        so the transaction is committed or rolled back on exit.
+        Driver threads (and the scheduler thread) reuse one connection per thread.
 
-    def _init_db(self):
-        with sqlite3.connect(self.DBpath, timeout=5) as conn:
+        shard=None connects to db_path, shard=i to user shard i.
+        readonly=True returns this thread's read-only connection. Only use it
+        inside closures run with _run(query, readonly=True).
+        """
+        target = self._target(shard)
+        if not readonly and self._drivers is None:
+            return self._open(target)
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        key = (target, readonly)
+        cached = conns.get(key)
+        if cached is not None and cached[1] == self._content_signature():
+            return cached[0]
+        if cached is not None:
+            # the content file was swapped underneath this connection
+            cached[0].close()
+        conn = self._open(target, readonly)
+        conns[key] = (conn, self._content_signature())
+        return conn
+
+    def _open(self, target=None, readonly=False) -> sqlite3.Connection:
+        """
+        Opens a connection to db_path or a user shard, with the catalog
+        attached as `content` when it lives in another file.
+
+        Read-only connections are opened with mode=ro, PRAGMA query_only and
+        an authorizer that rejects any write at prepare time. In WAL mode
+        these read in parallel with the writers and never wait for them.
+        """
+        conn = sqlite3.connect(
+            _sqlite_uri(self._paths[target], "ro" if readonly else "rwc"),
+            uri=True, timeout=5, check_same_thread=not readonly,
+            factory=sqlite3.Connection if readonly else WriterConnection
+        )
+        catalog_path = self.content_path
+        if target is not None and not catalog_path:
+            catalog_path = self.DBpath
+        if catalog_path:
+            immutable = self.content_immutable and catalog_path == self.content_path
+            mode = "ro" if readonly or immutable else "rwc"
+            conn.execute(
+                "ATTACH DATABASE ? AS content",
+                (_sqlite_uri(catalog_path, mode, immutable),)
+            )
+            conn.execute(f"PRAGMA content.mmap_size={CONTENT_MMAP_SIZE}")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+            conn.set_authorizer(_read_only_authorizer)
+        elif self.foreign_keys:
+            conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _content_signature(self):
+        # identity of the content file; changes when a new file is swapped in
+        if not self.content_path:
+            return None
+        try:
+            st = os.stat(self.content_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    async def _run(self, query, readonly=False, shard=None):
+        """
+        Runs a synchronous query closure on the configured backend.
+        readonly=True sends it to the read pool, whose closures must only use
+        self._connect(readonly=True). On the driver backend, writes go to the
+        driver threads of the target file (db_path or the given shard).
+        """
+        if readonly:
+            if self._drivers is None:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._read_executor, query)
+            return await self._readers.submit(query)
+        if self._drivers is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, query)
+        return await self._drivers[self._target(shard)].submit(query)
+
+    async def _fan_out(self, make_query, readonly=True):
+        """
+        Runs make_query(shard) on every user shard concurrently and returns
+        the per-shard results in shard order, for the caller to merge.
+        """
+        return await asyncio.gather(*(
+            self._run(make_query(shard), readonly=readonly, shard=shard)
+            for shard in range(self.user_shards)
+        ))
+
+    async def _email_shard(self, email: str) -> int:
+        """
+        Shard holding the account for `email`. New accounts go to the email's
+        home shard; accounts migrated from a single file sit on
+        user_id % N, so the other shards are searched too. Results are cached,
+        accounts never move.
+        """
+        if self.user_shards == 1:
+            return 0
+        shard = self._email_shards.get(email)
+        if shard is not None:
+            return shard
+        home = self._home_shard(email)
+
+        def query():
+            for shard in [home] + [i for i in range(self.user_shards) if i != home]:
+                with self._connect(readonly=True, shard=shard) as conn:
+                    cur = conn.cursor()
+                    cur.execute("SELECT 1 FROM users WHERE email=? LIMIT 1", (email,))
+                    if cur.fetchone():
+                        return shard
+            return None
+
+        shard = await self._run(query, readonly=True)
+        if shard is None:
+            return home
+        if len(self._email_shards) >= EMAIL_SHARD_CACHE_SIZE:
+            self._email_shards.clear()
+        self._email_shards[email] = shard
+        return shard
+
+    def _schema_layout(self) -> str:
+        # a layout change (content file, shards) needs the DDL and its migrations again
+        return f"content={bool(self.content_path)} immutable={self.content_immutable} shards={self.user_shards}"
+
+    def _schema_current(self) -> bool:
+        """
+        True when every file was stamped with SCHEMA_VERSION by a startup with
+        the same layout, so _init_db has nothing to do: one PRAGMA per file
+        instead of the DDL statements and migration checks.
+        """
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                versions = [cur.execute("PRAGMA user_version").fetchone()[0]]
+                if self.content_path and not self.content_immutable:
+                    versions.append(cur.execute("PRAGMA content.user_version").fetchone()[0])
+                cur.execute("SELECT layout FROM schema_layout WHERE id = 1")
+                row = cur.fetchone()
+            if self.user_shards > 1:
+                for shard in range(self.user_shards):
+                    with self._connect(shard=shard) as conn:
+                        versions.append(conn.execute("PRAGMA user_version").fetchone()[0])
+            return row is not None and row[0] == self._schema_layout() and set(versions) == {SCHEMA_VERSION}
+        except sqlite3.Error:
+            return False
+
+    def _stamp_schema(self):
+        with self._connect() as conn:
             cur = conn.cursor()
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    email TEXT NOT NULL UNIQUE,
-                    username TEXT NOT NULL UNIQUE,
-                    password TEXT NOT NULL,
-                    account_status TEXT DEFAULT 'pending',
-                    is_admin INTEGER DEFAULT 0,
-                    code_verify TEXT,
-                    expires_code INTEGER,
-                    stars INTEGER DEFAULT 10,
-                    gems INTEGER DEFAULT 5,
-                    last_star_refill INTEGER DEFAULT 0
+                CREATE TABLE IF NOT EXISTS schema_layout (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    layout TEXT NOT NULL
                 );
             """)
+            cur.execute("INSERT OR REPLACE INTO schema_layout (id, layout) VALUES (1, ?)", (self._schema_layout(),))
+            cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            if self.content_path and not self.content_immutable:
+                cur.execute(f"PRAGMA content.user_version={SCHEMA_VERSION}")
+            conn.commit()
+        if self.user_shards > 1:
+            for shard in range(self.user_shards):
+                with self._connect(shard=shard) as conn:
+                    conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    async def warm_up(self) -> dict:
+        """
+        Startup phase before the worker reports ready: opens a read
+        connection on each reader thread, reads the catalog and user tables
+        of WARM_TABLES once (pages into the OS cache), and loads the
+        per-worker caches the first requests would otherwise fill: question
+        pools and leaderboards. Returns the duration of each step in ms.
+        """
+        timings = {}
+
+        async def step(name, coro):
+            started = time.perf_counter()
+            await coro
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+        def read(statements, shard=None):
+            def query():
+                with self._connect(readonly=True, shard=shard) as conn:
+                    for sql in statements:
+                        conn.execute(sql).fetchall()
+            return query
+
+        await step("connections", asyncio.gather(*(
+            self._run(read(["SELECT 1 FROM quizzes LIMIT 1"]), readonly=True) for _ in range(READ_THREADS)
+        )))
+        await step("pages", asyncio.gather(
+            self._run(read(WARM_TABLES["catalog"]), readonly=True),
+            *(self._run(read(WARM_TABLES["user"], shard), readonly=True) for shard in range(self.user_shards))
+        ))
+        def quiz_ids():
+            with self._connect(readonly=True) as conn:
+                return [row[0] for row in conn.execute("SELECT id FROM quizzes")]
+        quizzes = await self._run(quiz_ids, readonly=True)
+        await step("question_pools", asyncio.gather(*(self._question_pool(quiz_id) for quiz_id in quizzes)))
+        await step("leaderboards", self._load_leaderboards())
+        self.ready = True
+        return timings
+
+    def _init_db(self):
+        with self._connect() as conn:
+            cur = conn.cursor()
+            # takes effect on a new file only; existing ones are converted by run_maintenance
+            cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets the read-only connections run alongside the writer
+            cur.execute("PRAGMA journal_mode=WAL")
+            # catalog tables go to the attached content file when it is split out
+            catalog = "content." if self.content_path else ""
+            if self.content_path and not self.content_immutable:
+                cur.execute("PRAGMA content.auto_vacuum=INCREMENTAL")
+                cur.execute("PRAGMA content.journal_mode=WAL")
             # subjects
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS subjects (
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {catalog}subjects (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     title TEXT NOT NULL
                 );
             """)
             # quizzes
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS quizzes (
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {catalog}quizzes (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     subject_id INTEGER NOT NULL,
                     title TEXT NOT NULL,
                     gems_reward INTEGER DEFAULT 0,
+                    sample_size INTEGER DEFAULT 0,
                     FOREIGN KEY(subject_id) REFERENCES subjects(id)
                 );
             """)
             # questions
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS questions (
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {catalog}questions (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     quiz_id INTEGER NOT NULL,
                     question_text TEXT NOT NULL,
@@ -63,70 +627,464 @@ class DatabaseManager:
                 );
             """)
             # options
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS question_options (
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {catalog}question_options (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     question_id INTEGER NOT NULL,
                     option_text TEXT NOT NULL,
                     FOREIGN KEY(question_id) REFERENCES questions(id)
                 );
             """)
-            # user_answers
+            if self.content_path and not self.content_immutable:
+                self._move_catalog_to_content(cur)
+            if not self.content_immutable:
+                # questions drawn per attempt (0 = all), added after the first release
+                self._add_column(cur, catalog, "quizzes", "sample_size", "INTEGER DEFAULT 0")
+                # bumped by VERSION_TRIGGERS, keys the cached quiz bundles
+                self._add_column(cur, catalog, "quizzes", "version", "INTEGER DEFAULT 0")
+                for name, body in VERSION_TRIGGERS.items():
+                    cur.execute(f"CREATE TRIGGER IF NOT EXISTS {catalog}{name} {body}")
+                self._create_change_feed(cur, catalog, CATALOG_CHANGE_TRIGGERS)
+                # stable ids from bulk imports, so re-uploading a file updates instead of duplicating
+                for table in ("subjects", "quizzes", "questions"):
+                    self._add_column(cur, catalog, table, "external_id", "TEXT")
+                    cur.execute(f"""
+                        CREATE UNIQUE INDEX IF NOT EXISTS {catalog}idx_{table}_external
+                        ON {table}(external_id) WHERE external_id IS NOT NULL
+                    """)
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {catalog}idx_questions_quiz ON questions(quiz_id)")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {catalog}idx_options_question ON question_options(question_id)")
+                self._create_search_index(cur, catalog)
+                self._create_signature_index(cur, catalog)
+            if self.user_shards == 1:
+                self._create_user_tables(cur)
+                self._seed_wallet_snapshots(cur)
+            # scheduler leader lease
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_answers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    quiz_id INTEGER NOT NULL,
+                CREATE TABLE IF NOT EXISTS scheduler_leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+            """)
+            # scheduler last-run metrics
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS scheduler_jobs (
+                    name TEXT PRIMARY KEY,
+                    last_started_at REAL,
+                    last_duration_ms INTEGER,
+                    last_status TEXT,
+                    last_error TEXT,
+                    runs INTEGER DEFAULT 0,
+                    failures INTEGER DEFAULT 0
+                );
+            """)
+            # per-question answer counters, written in batches by question_stats
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS question_stats (
+                    question_id INTEGER PRIMARY KEY,
+                    attempts INTEGER DEFAULT 0,
+                    correct INTEGER DEFAULT 0
+                );
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS option_stats (
+                    option_id INTEGER PRIMARY KEY,
                     question_id INTEGER NOT NULL,
-                    selected_option_id INTEGER,
-                    is_correct INTEGER,
-                    answered_at INTEGER DEFAULT (strftime('%s','now')),
-                    FOREIGN KEY(user_id) REFERENCES users(id),
-                    FOREIGN KEY(quiz_id) REFERENCES quizzes(id),
-                    FOREIGN KEY(question_id) REFERENCES questions(id),
-                    FOREIGN KEY(selected_option_id) REFERENCES question_options(id)
+                    selections INTEGER DEFAULT 0
                 );
             """)
-            # user_quizzes
+            # per shard, the last user_answers id the last recompute counted
+            # (answer ids only grow: AUTOINCREMENT); `shards` is the layout it was taken in
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_quizzes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    quiz_id INTEGER NOT NULL,
-                    completed INTEGER DEFAULT 0,
-                    score INTEGER DEFAULT 0,
-                    score_percent INTEGER DEFAULT 0,
-                    gems_awarded INTEGER DEFAULT 0,
-                    completed_at INTEGER,
-                    UNIQUE(user_id, quiz_id)
+                CREATE TABLE IF NOT EXISTS stats_marks (
+                    shard INTEGER PRIMARY KEY,
+                    answer_id INTEGER NOT NULL,
+                    shards INTEGER NOT NULL
                 );
             """)
+            # report of the last run_maintenance, readable from any worker
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS maintenance_runs (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    started_at REAL,
+                    report TEXT
+                );
+            """)
+            conn.commit()
+
+        if self.user_shards > 1:
+            for shard in range(self.user_shards):
+                with self._connect(shard=shard) as conn:
+                    cur = conn.cursor()
+                    cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    cur.execute("PRAGMA journal_mode=WAL")
+                    self._create_user_tables(cur)
+                    self._move_users_to_shard(cur, shard)
+                    self._seed_wallet_snapshots(cur)
+                    conn.commit()
+            self._drop_unsharded_user_tables()
+
+    def _create_user_tables(self, cur):
+        # users
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL UNIQUE,
+                username TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL,
+                account_status TEXT DEFAULT 'pending',
+                is_admin INTEGER DEFAULT 0,
+                code_verify TEXT,
+                expires_code INTEGER,
+                stars INTEGER DEFAULT 10,
+                gems INTEGER DEFAULT 5,
+                last_star_refill INTEGER DEFAULT 0
+            );
+        """)
+        # user_answers
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                quiz_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                selected_option_id INTEGER,
+                is_correct INTEGER,
+                answered_at INTEGER DEFAULT (strftime('%s','now')),
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(quiz_id) REFERENCES quizzes(id),
+                FOREIGN KEY(question_id) REFERENCES questions(id),
+                FOREIGN KEY(selected_option_id) REFERENCES question_options(id)
+            );
+        """)
+        # user_quizzes
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_quizzes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                quiz_id INTEGER NOT NULL,
+                completed INTEGER DEFAULT 0,
+                score INTEGER DEFAULT 0,
+                score_percent INTEGER DEFAULT 0,
+                gems_awarded INTEGER DEFAULT 0,
+                completed_at INTEGER,
+                seed INTEGER,
+                drawn TEXT,
+                UNIQUE(user_id, quiz_id)
+            );
+        """)
+        # seed of the current attempt, picks the sampled questions
+        self._add_column(cur, "main.", "user_quizzes", "seed", "INTEGER")
+        # the question ids it picked, kept so later catalog edits do not change the attempt
+        self._add_column(cur, "main.", "user_quizzes", "drawn", "TEXT")
+        # export filters: quiz and/or time range, walked in (time, id) order
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_answers_quiz_time ON user_answers(quiz_id, answered_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_answers_time ON user_answers(answered_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_quizzes_quiz_time ON user_quizzes(quiz_id, completed_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_quizzes_time ON user_quizzes(completed_at)")
+        # leaderboard: score per user and subject (subject_id 0 is the global
+        # board), updated by finish_quiz
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS leaderboard (
+                user_id INTEGER NOT NULL,
+                subject_id INTEGER NOT NULL,
+                score INTEGER DEFAULT 0,
+                updated_at INTEGER,
+                PRIMARY KEY(user_id, subject_id)
+            );
+        """)
+        # wallet: every stars/gems change, appended by _wallet_change; the
+        # cached balance in users always equals snapshot + ledger rows
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS wallet_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                stars INTEGER NOT NULL DEFAULT 0,
+                gems INTEGER NOT NULL DEFAULT 0,
+                reason TEXT NOT NULL,
+                ref TEXT,
+                created_at INTEGER NOT NULL
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_wallet_ledger_user ON wallet_ledger(user_id, id)")
+        # opening balance plus the ledger rows folded in by compact_wallets
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS wallet_snapshots (
+                user_id INTEGER PRIMARY KEY,
+                stars INTEGER NOT NULL,
+                gems INTEGER NOT NULL,
+                ledger_id INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER NOT NULL
+            );
+        """)
+        self._create_change_feed(cur, "", USER_CHANGE_TRIGGERS)
+
+    def _seed_wallet_snapshots(self, cur):
+        # users without a snapshot (created before the ledger existed) open
+        # with whatever their balance is not explained by ledger rows
+        cur.execute("""
+            INSERT INTO wallet_snapshots (user_id, stars, gems, ledger_id, updated_at)
+            SELECT u.id,
+                   u.stars - COALESCE((SELECT SUM(l.stars) FROM wallet_ledger l WHERE l.user_id = u.id), 0),
+                   u.gems - COALESCE((SELECT SUM(l.gems) FROM wallet_ledger l WHERE l.user_id = u.id), 0),
+                   0, ?
+            FROM users u
+            WHERE NOT EXISTS (SELECT 1 FROM wallet_snapshots s WHERE s.user_id = u.id)
+        """, (int(time.time()),))
+        if cur.rowcount > 0:
+            print(f"[DB] opened {cur.rowcount} wallet snapshots")
+
+    def _move_users_to_shard(self, cur, shard):
+        """
+        One-time migration when switching to N shards: copy this shard's part
+        (user_id % N == shard) of the user tables that still sit in db_path.
+        Ids are kept, so user_id % N keeps routing every user to their rows.
+        """
+        cur.execute("ATTACH DATABASE ? AS legacy", (_sqlite_uri(self.DBpath, "rwc"),))
+        try:
+            cur.execute("SELECT 1 FROM legacy.sqlite_master WHERE type='table' AND name='users'")
+            legacy = cur.fetchone() is not None
+            cur.execute("SELECT 1 FROM main.users LIMIT 1")
+            if legacy and not cur.fetchone():
+                n = self.user_shards
+                moved = self._copy_table(cur, "legacy", "main", "users", "id % ? = ?", (n, shard))
+                for table in USER_TABLES[1:]:
+                    cur.execute("SELECT 1 FROM legacy.sqlite_master WHERE type='table' AND name=?", (table,))
+                    if cur.fetchone():
+                        self._copy_table(cur, "legacy", "main", table, "user_id % ? = ?", (n, shard))
+                if moved:
+                    print(f"[DB] moved {moved} users to {self._paths[shard]}")
+            cur.connection.commit()
+        finally:
+            cur.execute("DETACH DATABASE legacy")
+
+    def _drop_unsharded_user_tables(self):
+        # after every shard copied its part, the single-file user tables go
+        with self._connect() as conn:
+            cur = conn.cursor()
+            for table in USER_TABLES:
+                cur.execute(f"DROP TABLE IF EXISTS main.{table}")
             conn.commit()
+
+    def _create_change_feed(self, cur, schema, triggers):
+        # schema is "" or a "name." prefix; several trigger sets can share one table.
+        # seq is the rowid: prune_cache_changes only removes the oldest rows, so it never goes back
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}cache_changes (
+                seq INTEGER PRIMARY KEY,
+                family TEXT NOT NULL,
+                key INTEGER NOT NULL
+            );
+        """)
+        for name, (event, family, key) in triggers.items():
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {schema}{name} {event} BEGIN
+                    INSERT INTO cache_changes (family, key) VALUES ('{family}', {key});
+                END
+            """)
+
+    def _create_search_index(self, cur, catalog):
+        """
+        FTS5 index over question and option text (rowid = question id),
+        filled from the existing questions the first time it is created.
+        """
+        cur.execute(f"SELECT 1 FROM {catalog}sqlite_master WHERE type='table' AND name='question_search'")
+        exists = cur.fetchone() is not None
+        try:
+            cur.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {catalog}question_search USING fts5(
+                    question_text, options_text,
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            print("[DB] full-text search disabled:", e)
+            return
+        for name, body in SEARCH_TRIGGERS.items():
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {catalog}{name} {body}")
+        if not exists:
+            cur.execute(f"""
+                INSERT INTO {catalog}question_search (rowid, question_text, options_text)
+                SELECT q.id, q.question_text, COALESCE((
+                    SELECT group_concat(o.option_text, ' ') FROM {catalog}question_options o WHERE o.question_id = q.id
+                ), '')
+                FROM {catalog}questions q
+            """)
+
+    def _create_signature_index(self, cur, catalog):
+        """
+        MinHash signature and LSH band buckets of every question, used to find
+        near-duplicates without comparing against the whole bank. Filled from
+        the existing questions the first time it is created.
+        """
+        cur.execute(f"SELECT 1 FROM {catalog}sqlite_master WHERE type='table' AND name='question_signatures'")
+        exists = cur.fetchone() is not None
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {catalog}question_signatures (
+                question_id INTEGER PRIMARY KEY,
+                signature BLOB NOT NULL
+            );
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {catalog}question_lsh (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                PRIMARY KEY(band, bucket, question_id)
+            ) WITHOUT ROWID;
+        """)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {catalog}idx_question_lsh_question ON question_lsh(question_id)")
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {catalog}question_signatures_ad
+            AFTER DELETE ON questions BEGIN
+                DELETE FROM question_signatures WHERE question_id = old.id;
+                DELETE FROM question_lsh WHERE question_id = old.id;
+            END
+        """)
+        if not exists:
+            cur.execute(f"SELECT id, question_text FROM {catalog}questions")
+            questions = cur.fetchall()
+            for question_id, text in questions:
+                cur.execute(f"SELECT option_text FROM {catalog}question_options WHERE question_id=?", (question_id,))
+                options = [r[0] for r in cur.fetchall()]
+                self._index_question(cur, question_id, dedup.signature(text, options), catalog)
+
+    def _index_question(self, cur, question_id, sig, catalog=""):
+        cur.execute(
+            f"INSERT OR REPLACE INTO {catalog}question_signatures (question_id, signature) VALUES (?, ?)",
+            (question_id, dedup.to_blob(sig))
+        )
+        cur.execute(f"DELETE FROM {catalog}question_lsh WHERE question_id=?", (question_id,))
+        cur.executemany(
+            f"INSERT INTO {catalog}question_lsh (band, bucket, question_id) VALUES (?, ?, ?)",
+            [(band, bucket, question_id) for band, bucket in dedup.bands(sig)]
+        )
+
+    def _question_duplicates(self, cur, sig, exclude=None) -> list[tuple[int, float]]:
+        """
+        (question_id, similarity) of indexed questions at least
+        DUPLICATE_THRESHOLD similar to `sig`, most similar first. Only questions
+        sharing an LSH bucket are compared.
+        """
+        keys = dedup.bands(sig)
+        cur.execute(f"""
+            SELECT DISTINCT l.question_id, s.signature
+            FROM question_lsh l
+            JOIN question_signatures s ON s.question_id = l.question_id
+            WHERE (l.band, l.bucket) IN (VALUES {",".join("(?, ?)" for _ in keys)})
+        """, [v for key in keys for v in key])
+        found = []
+        for question_id, blob in cur.fetchall():
+            if question_id == exclude:
+                continue
+            score = dedup.similarity(sig, dedup.from_blob(blob))
+            if score >= dedup.DUPLICATE_THRESHOLD:
+                found.append((question_id, score))
+        found.sort(key=lambda f: -f[1])
+        return found
+
+    def _describe_questions(self, cur, ids) -> dict:
+        if not ids:
+            return {}
+        cur.execute(
+            f"SELECT id, quiz_id, question_text FROM questions WHERE id IN ({','.join('?' * len(ids))})",
+            list(ids)
+        )
+        return {qid: {"id": qid, "quiz_id": quiz_id, "text": text} for qid, quiz_id, text in cur.fetchall()}
+
+    def _add_column(self, cur, schema, table, column, decl):
+        # schema is "" or a "name." prefix, as used for the table itself
+        cur.execute(f"PRAGMA {schema}table_info({table})")
+        if column not in (row[1] for row in cur.fetchall()):
+            cur.execute(f"ALTER TABLE {schema}{table} ADD COLUMN {column} {decl}")
+
+    def _copy_table(self, cur, src, dst, table, where="1", params=()) -> int:
+        # by column name, so a source created before a column was added still copies
+        cur.execute(f"PRAGMA {src}.table_info({table})")
+        columns = ", ".join(row[1] for row in cur.fetchall())
+        cur.execute(f"INSERT INTO {dst}.{table} ({columns}) SELECT {columns} FROM {src}.{table} WHERE {where}", params)
+        return cur.rowcount
+
+    def _move_catalog_to_content(self, cur):
+        """
+        One-time migration when switching an existing single-file database to
+        a split layout: copy the catalog tables into the content file and drop
+        them from db_path, where they would otherwise shadow the attached ones.
+        """
+        for table in CATALOG_TABLES:
+            cur.execute("SELECT 1 FROM main.sqlite_master WHERE type='table' AND name=?", (table,))
+            if not cur.fetchone():
+                continue
+            cur.execute(f"SELECT 1 FROM content.{table} LIMIT 1")
+            if not cur.fetchone():
+                self._copy_table(cur, "main", "content", table)
+            cur.execute(f"DROP TABLE main.{table}")
+            print(f"[DB] moved '{table}' to {self.content_path}")
+
     #User Tools
     async def add_pending_user(self, email: str, password: str, username: str) -> bool:
-        loop = asyncio.get_running_loop()
-        def query():
-            try:
-                with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
-                    cur = conn.cursor()
+        shard = self._home_shard(email)
+        def insert():
+            with self._write(shard) as conn:
+                cur = conn.cursor()
+                if self.user_shards > 1 and any(
+                    self._account_exists(i, email, username) for i in range(self.user_shards)
+                ):
+                    return False
+                if self.user_shards == 1:
                     cur.execute(
                         "INSERT INTO users (email, password, username) VALUES (?, ?, ?)",
                         (email, password, username)
                     )
-                    conn.commit()
-                    return True
+                else:
+                    # ids on shard i are kept congruent to i (mod N) so
+                    # user_id % N routes back here
+                    cur.execute(
+                        "INSERT INTO users (id, email, password, username) VALUES (?, ?, ?, ?)",
+                        (self._next_user_id(cur, shard), email, password, username)
+                    )
+                # the starting balance is the wallet's opening snapshot
+                cur.execute(
+                    "INSERT INTO wallet_snapshots (user_id, stars, gems, updated_at) "
+                    "SELECT id, stars, gems, ? FROM users WHERE id=?",
+                    (int(time.time()), cur.lastrowid)
+                )
+                conn.commit()
+                return True
+        def query():
+            # the UNIQUE constraints of users only hold within one shard, so
+            # registrations take one write lock in turn (across processes
+            # too) and insert() re-checks every shard under it. Shards attach
+            # the catalog file, so their BEGIN IMMEDIATE already holds its
+            # write lock; an immutable catalog takes no locks, then db_path's
+            # lock is taken around the insert instead.
+            guarded = self.user_shards > 1 and self.content_immutable
+            try:
+                with self._write() if guarded else nullcontext():
+                    return insert()
             except sqlite3.IntegrityError as e:
                 print("DB ERROR:", e)
                 return False
             except Exception as e:
                 print("DB ERROR:", e)
                 return False
-        return await loop.run_in_executor(None, query)
+        async with self.locks.user(email):
+            return await self._run(query, shard=shard)
+
+    def _next_user_id(self, cur, shard: int) -> int:
+        n = self.user_shards
+        cur.execute("SELECT MAX(id) FROM users")
+        last = cur.fetchone()[0]
+        if last is None:
+            last = shard
+        return last + ((shard - last) % n or n)
     
     async def is_admin(self, user_id: int) -> bool:
-        loop = asyncio.get_running_loop()
+        shard = self._user_shard(user_id)
         def query():
-            with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True, shard=shard) as conn:
                 cur = conn.cursor()
                 cur.execute(
                     "SELECT is_admin FROM users WHERE id=?",
@@ -136,19 +1094,20 @@ class DatabaseManager:
                 if not row:
                     return False
                 return row[0] == 1
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
 
     async def set_admin(self, email: int) -> bool:
-            loop = asyncio.get_running_loop()
+            shard = await self._email_shard(email)
             def query():
-                with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
+                with self._write(shard) as conn:
                     cur = conn.cursor()
                     cur.execute(
                         "UPDATE users SET is_admin=? WHERE email=?",
                         (1, email,)
                     )
                     return True
-            return await loop.run_in_executor(None, query)
+            async with self.locks.user(email):
+                return await self._run(query, shard=shard)
     
     async def is_account_not_active(self, email: str) -> bool:
         """
@@ -158,10 +1117,10 @@ class DatabaseManager:
             bool: True if the account exists and is pending.
                 False if the account does not exist or is already active.
         """
-        loop = asyncio.get_running_loop()
+        shard = await self._email_shard(email)
         def query():
             try:
-                with sqlite3.connect(self.DBpath, timeout=5) as conn:
+                with self._connect(readonly=True, shard=shard) as conn:
                     cur = conn.cursor()
                     cur.execute(
                         "SELECT account_status FROM users WHERE email=? LIMIT 1", (email,)
@@ -174,21 +1133,26 @@ class DatabaseManager:
             except Exception as e:
                 print("DB ERROR:", e)
                 return False
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
     
     async def can_add_user(self, email: str, username: str) -> bool:
-        loop = asyncio.get_running_loop()
-        def query():
-            try:
-                with sqlite3.connect(self.DBpath, timeout=5) as conn:
-                    cur = conn.cursor()
-                    cur.execute("SELECT 1 FROM users WHERE email=? OR username=? LIMIT 1", (email, username))
-                    row = cur.fetchone()
-                    return row is None
-            except Exception as e:
-                print("DB ERROR:", e)
-                return False 
-        return await loop.run_in_executor(None, query)
+        # usernames are unique across shards, so every shard is asked;
+        # add_pending_user asks again under a lock
+        def make_query(shard):
+            def query():
+                try:
+                    return not self._account_exists(shard, email, username)
+                except Exception as e:
+                    print("DB ERROR:", e)
+                    return False 
+            return query
+        return all(await self._fan_out(make_query))
+
+    def _account_exists(self, shard: int, email: str, username: str) -> bool:
+        with self._connect(readonly=True, shard=shard) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1 FROM users WHERE email=? OR username=? LIMIT 1", (email, username))
+            return cur.fetchone() is not None
     
     async def set_verify_code(self, email: str) -> bool:
         try:
@@ -196,9 +1160,10 @@ class DatabaseManager:
 
             expires_ts = int((datetime.now(timezone.utc) + timedelta(minutes=tools.CODE_EXPIRE_MINUTES)).timestamp())
 
+            shard = await self._email_shard(email)
             def query():
                 try:
-                    with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
+                    with self._write(shard) as conn:
                         cur = conn.cursor()
                         cur.execute(
                             "UPDATE users SET code_verify=?, expires_code=? WHERE email=? AND account_status=?",
@@ -210,8 +1175,8 @@ class DatabaseManager:
                     print("DB ERROR:", e)
                     return False
 
-            loop = asyncio.get_running_loop()
-            return await loop.run_in_executor(None, query)
+            async with self.locks.user(email):
+                return await self._run(query, shard=shard)
 
         except Exception as e:
             print("ERROR in set_verify_code:", e)
@@ -220,10 +1185,10 @@ class DatabaseManager:
 
 
     async def check_verify_code(self, email: str, code: str):
-        loop = asyncio.get_running_loop()
+        shard = await self._email_shard(email)
         def query():
             try:
-                with sqlite3.connect(self.DBpath, timeout=5) as conn:
+                with self._connect(readonly=True, shard=shard) as conn:
                     cur = conn.cursor()
                     cur.execute(
                         "SELECT code_verify, expires_code FROM users WHERE email=? AND account_status=?",
@@ -241,13 +1206,13 @@ class DatabaseManager:
             except Exception as e:
                 print("DB ERROR:", e)
                 return [False, "error"]
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
         
     async def activate_user(self, email: str) -> int | None:
-        loop = asyncio.get_running_loop()
+        shard = await self._email_shard(email)
         def query():
             try:
-                with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
+                with self._write(shard) as conn:
                     cur = conn.cursor()
 
                     cur.execute(
@@ -266,13 +1231,14 @@ class DatabaseManager:
             except Exception as e:
                 print("DB ERROR:", e)
                 return None
-        return await loop.run_in_executor(None, query)
+        async with self.locks.user(email):
+            return await self._run(query, shard=shard)
 
     async def login(self, email: str, password: str) -> bool:
-        loop = asyncio.get_running_loop()
+        shard = await self._email_shard(email)
         def query():
             try:
-                with sqlite3.connect(self.DBpath, timeout=5) as conn:
+                with self._connect(readonly=True, shard=shard) as conn:
                     cur = conn.cursor()
                     cur.execute(
                         "SELECT id FROM users WHERE account_status=? AND email=? AND password=? LIMIT 1",
@@ -283,47 +1249,57 @@ class DatabaseManager:
             except Exception as e:
                 print("DB ERROR:", e)
                 return False
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
     # utility: get user by email or id
     async def get_username(self, email: str):
-        loop = asyncio.get_running_loop()
+        shard = await self._email_shard(email)
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True, shard=shard) as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT username FROM users WHERE email=? LIMIT 1", (email,))
                 row = cur.fetchone()
                 if not row:
                     raise ValueError("User not found")
                 return row[0]
-        return await loop.run_in_executor(None, query)   
+        return await self._run(query, readonly=True, shard=shard)   
     async def get_userid(self, email: str):
-        loop = asyncio.get_running_loop()
+        shard = await self._email_shard(email)
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True, shard=shard) as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT id FROM users WHERE email=? LIMIT 1", (email,))
                 row = cur.fetchone()
                 if not row:
                     raise ValueError("User not found")
                 return row[0]
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
     async def is_user_and_active(self, id: int):
-        loop = asyncio.get_running_loop()
+        shard = self._user_shard(id)
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True, shard=shard) as conn:
                 cur = conn.cursor()
                 cur.execute(f"SELECT id FROM users WHERE id=? AND account_status='{ACTIVE}' LIMIT 1", (id,))
                 row = cur.fetchone()
                 if not row:
                     return False
                 return True
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
     
-    async def is_user_and_active_by_email(self, email: str):
-        loop = asyncio.get_running_loop()
+    async def get_wallet(self, user_id: int) -> dict | None:
+        """Current stars and gems of a user, or None if the user does not exist."""
+        shard = self._user_shard(user_id)
+        def query():
+            with self._connect(readonly=True, shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT stars, gems FROM users WHERE id=?", (user_id,))
+                row = cur.fetchone()
+                return {"stars": row[0], "gems": row[1]} if row else None
+        return await self._run(query, readonly=True, shard=shard)
 
+    async def is_user_and_active_by_email(self, email: str):
+        shard = await self._email_shard(email)
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True, shard=shard) as conn:
                 cur = conn.cursor()
                 cur.execute(
                     "SELECT id FROM users WHERE email=? AND account_status=? LIMIT 1",
@@ -331,9 +1307,40 @@ class DatabaseManager:
                 )
                 return cur.fetchone() is not None
 
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
  
     
+    async def _progress(self, user_id: int) -> Progress | None:
+        """
+        The user's stars, gems and user_quizzes rows, from self.progress or
+        loaded into it. Loaded under the user's lock, so no write of this
+        worker lands between the read and the cache update.
+        None if the user does not exist.
+        """
+        progress = self.progress.get(user_id)
+        if progress is not None:
+            return progress
+        shard = self._user_shard(user_id)
+        def query():
+            loaded_at = time.monotonic()
+            with self._connect(readonly=True, shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT username, stars, gems FROM users WHERE id=?", (user_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                cur.execute(
+                    "SELECT quiz_id, completed, score, score_percent, seed, drawn FROM user_quizzes WHERE user_id=?",
+                    (user_id,)
+                )
+                quizzes = {r[0]: QuizProgress(*r[1:5], unpack_ids(r[5])) for r in cur.fetchall()}
+                return Progress(row[0], row[1], row[2], quizzes, loaded_at)
+        async with self.locks.user(user_id):
+            progress = await self._run(query, readonly=True, shard=shard)
+            if progress is not None:
+                self.progress.put(user_id, progress)
+        return progress
+
     async def get_subject_payload(self, user_id: int) -> dict:
         """
         Builds and returns the subject overview payload for a given user.
@@ -374,29 +1381,21 @@ class DatabaseManager:
 
             Returns None if a database error occurs or the user is not found.
         """
-        loop = asyncio.get_running_loop()
+        shard = self._user_shard(user_id)
+        progress = await self._progress(user_id)
         def query():
             payload = {}
             try:
-                with sqlite3.connect(self.DBpath, timeout=5) as conn:
-                    cur = conn.cursor()
-
-                    cur.execute("""
-                        SELECT username, gems, stars 
-                        FROM users 
-                        WHERE id=? 
-                        LIMIT 1
-                    """, (user_id,))
-                    user = cur.fetchone()
+                if progress is None:
+                    raise KeyError(f"User '{user_id}' not found")
 
-                    if not user:
-                        raise KeyError(f"User '{user_id}' not found")
+                payload["username"] = progress.username
+                payload["gems"] = progress.gems
+                payload["stars"] = progress.stars
 
-                    payload["username"] = user[0]
-                    payload["gems"] = user[1]
-                    payload["stars"] = user[2]
+                with self._connect(readonly=True, shard=shard) as conn:
+                    cur = conn.cursor()
 
-                    
                     cur.execute("SELECT id, title FROM subjects")
                     subjects = cur.fetchall()
 
@@ -421,18 +1420,11 @@ class DatabaseManager:
                         for quiz in quizzes:
                             quiz_id, quiz_title = quiz
 
-                            cur.execute("""
-                                SELECT completed, score_percent
-                                FROM user_quizzes 
-                                WHERE user_id=? AND quiz_id=? 
-                                LIMIT 1
-                            """, (user_id, quiz_id))
-
-                            row = cur.fetchone()
+                            row = progress.quizzes.get(quiz_id)
 
                             if row:
-                                completed = bool(row[0])
-                                score_percent = row[1]
+                                completed = bool(row.completed)
+                                score_percent = row.score_percent
                             else:
                                 completed = False
                                 score_percent = 0
@@ -452,7 +1444,7 @@ class DatabaseManager:
             except Exception as e:
                 print("DB ERROR:", e)
                 return None
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True, shard=shard)
 
     # get quiz payload (as requested)
     async def get_quiz_payload(self, quiz_id: int, user_id: int) -> dict:
@@ -508,86 +1500,173 @@ class DatabaseManager:
                 - selected_option_id = None
                 - is_correct = None
 
+            - For a quiz with a sample size, "questions" holds only the questions
+            drawn for the user's current attempt, in the drawn order.
+
         Raises:
             None explicitly. Returns a partially filled payload if data is missing.
         """
-        loop = asyncio.get_running_loop()
+        shard = self._user_shard(user_id)
+        pool = await self._question_pool(quiz_id)
+        progress = await self._progress(user_id)
+        uq = progress.quizzes.get(quiz_id) if progress is not None else None
+        drawn = pool.attempt(uq.seed, uq.drawn) if uq is not None else None
+        if pool.sampled and progress is not None and drawn is None:
+            # first look at a sampled quiz starts the attempt
+            _, drawn = await self._ensure_attempt_seed(user_id, quiz_id)
+            progress = await self._progress(user_id)
+            uq = progress.quizzes.get(quiz_id) if progress is not None else None
+
+        def answers_query():
+            # user's previous answers; the catalog part is shared by concurrent readers
+            with self._connect(readonly=True, shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT question_id, selected_option_id, is_correct FROM user_answers WHERE user_id=? AND quiz_id=?",
+                    (user_id, quiz_id)
+                )
+                answers = {}
+                for qid, selected, is_correct in cur.fetchall():
+                    answers.setdefault(qid, (selected, is_correct))
+                return answers
+        catalog, answers = await asyncio.gather(
+            self._quiz_catalog(quiz_id),
+            self._run(answers_query, readonly=True, shard=shard)
+        )
+
+        payload = {"subject": catalog.quiz["subject"], "completed": False, "score": 0, "score_percent": 0,
+                   "questions": {}, "current_stars": 0, "current_gems": 0}
+        # user's current stars, gems and attempt, from the progress cache
+        if progress is not None:
+            payload["current_stars"], payload["current_gems"] = progress.stars, progress.gems
+        if drawn is not None:
+            rows = [catalog.by_id[qid] for qid in drawn if qid in catalog.by_id]
+        elif pool.sampled:
+            rows = []  # no attempt: unknown user
+        else:
+            rows = catalog.questions
+        if not rows:
+            return payload
+
+        if uq and uq.completed == 1:
+            payload["completed"] = True
+            payload["score"] = uq.score
+            payload["score_percent"] = uq.score_percent
+
+        for qid, qtype, qtext, stars, options, correct_option_id in rows:
+            ua = answers.get(qid)
+            payload["questions"][str(qid)] = {
+                "type": qtype,
+                "text": qtext,
+                "answers": {str(opt_id): opt_text for opt_id, opt_text in options},
+                "stars": stars,
+                "user_answered": ua is not None,
+                "selected_option_id": ua[0] if ua else None,
+                "is_correct": ua[1] if ua else None,
+                "correct_option_id": correct_option_id
+            }
+        return payload
+
+    async def _quiz_catalog(self, quiz_id: int) -> QuizBundle:
+        """
+        Subject, questions and options of a quiz (a QuizBundle without a key),
+        read once for every get_quiz_payload asking for it at the same time.
+        """
         def query():
-            payload = {"subject": "","completed":False, "score":0, "score_percent":0, "questions": {}, "current_stars": 0, "current_gems": 0}
+            with self._connect(readonly=True) as conn:
+                return self._load_bundle(conn.cursor(), quiz_id, None)
+        return await self.flights.run(("quiz_payload", quiz_id), lambda: self._run(query, readonly=True))
 
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
-                cur = conn.cursor()
+    async def get_quiz_bundle(self, quiz_id: int, user_id: int) -> bytes | None:
+        """
+        The quiz for offline play as MessagePack bytes: a two-element array of
+        the quiz bundle (bundle.encode_bundle) and the user's part
 
-                # fetch user's current stars and gems
-                cur.execute("SELECT stars, gems FROM users WHERE id=?", (user_id,))
-                row = cur.fetchone()
-                if row:
-                    payload["current_stars"], payload["current_gems"] = row
-
-                # fetch quiz questions
-                cur.execute("""SELECT q.id, q.question_text, q.question_type, q.stars_reward,
-                                    qu.title, s.title
-                            FROM questions q
-                            JOIN quizzes qu ON q.quiz_id = qu.id
-                            JOIN subjects s ON qu.subject_id = s.id
-                            WHERE q.quiz_id=?""", (quiz_id,))
-                rows = cur.fetchall()
-
-                if not rows:
-                    # quiz exists? fetch title
-                    cur.execute("SELECT s.title FROM quizzes qu JOIN subjects s ON qu.subject_id = s.id WHERE qu.id = ?", (quiz_id,))
-                    sr = cur.fetchone()
-                    payload["subject"] = sr[0] if sr else ""
-                    return payload
-
-                payload["subject"] = rows[0][5]  # subject title
+            [stars, gems, completed, score, score_percent, drawn_ids,
+             [[question_id, selected_option_id, is_correct, correct_option_id], ...]]
 
-                cur.execute("""
-                    SELECT completed, score, score_percent
-                    FROM user_quizzes 
-                    WHERE user_id=? AND quiz_id=?
-                    """,(user_id, quiz_id))
-                uq = cur.fetchone()
-                if uq and uq[0] == 1:
-                    payload["completed"] = True
-                    payload["score"] = uq[1]  
-                    payload["score_percent"] = uq[2] 
-
-
-                for row in rows:
-                    qid, qtext, qtype, stars, quiz_title, subject_title = row
-                    # fetch options
-                    cur.execute("SELECT id, option_text FROM question_options WHERE question_id=?", (qid,))
-                    opts = cur.fetchall()
-                    answers = {str(opt_id): opt_text for opt_id, opt_text in opts}
-
-                    # fetch user previous answer (if any)
-                    cur.execute("SELECT selected_option_id, is_correct FROM user_answers WHERE user_id=? AND quiz_id=? AND question_id=?", (user_id, quiz_id, qid))
-                    ua = cur.fetchone()
-                    user_answered = False
-                    selected_option_id = None
-                    is_correct = None
-                    if ua:
-                        selected_option_id, is_correct = ua
-                        user_answered = True
-
-                    # find correct option
-                    cur.execute("SELECT correct_option_id FROM questions WHERE id=?", (qid,))
-                    correct_option_id = cur.fetchone()[0]
-
-                    payload["questions"][str(qid)] = {
-                        "type": qtype,
-                        "text": qtext,
-                        "answers": answers,
-                        "stars": stars,
-                        "user_answered": user_answered,
-                        "selected_option_id": selected_option_id,
-                        "is_correct": is_correct,
-                        "correct_option_id": correct_option_id
-                    }
+        drawn_ids is None unless the quiz has a sample size, in which case the
+        bundle holds only the attempt's questions, in the drawn order. The
+        bundle carries the correct option of every question once the user has
+        finished the quiz (score_percent > 0), otherwise only the user part
+        does, for answered questions.
 
-            return payload
-        return await loop.run_in_executor(None, query)
+        The catalog part is cached per quiz version (VERSION_TRIGGERS), so
+        repeated downloads of an unchanged quiz cost one indexed read of the
+        user's answers. None if the quiz or the user does not exist.
+        """
+        shard = self._user_shard(user_id)
+        pool = await self._question_pool(quiz_id)
+        progress = await self._progress(user_id)
+        if progress is None:
+            return None
+        uq = progress.quizzes.get(quiz_id)
+        drawn = pool.attempt(uq.seed, uq.drawn) if uq is not None else None
+        if pool.sampled and drawn is None:
+            # first look at a sampled quiz starts the attempt
+            _, drawn = await self._ensure_attempt_seed(user_id, quiz_id)
+            uq = progress.quizzes.get(quiz_id)
+        cached = self.bundles.get(quiz_id)
+        signature = self._content_signature()
+        def query():
+            with self._connect(readonly=True, shard=shard) as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute("SELECT version FROM quizzes WHERE id=?", (quiz_id,))
+                except sqlite3.OperationalError:
+                    # immutable catalog built before versions: the content file identifies it
+                    cur.execute("SELECT 0 FROM quizzes WHERE id=?", (quiz_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None, None
+                key = (row[0], signature)
+                bundle = cached
+                if bundle is None or bundle.key != key:
+                    bundle = self._load_bundle(cur, quiz_id, key)
+                cur.execute(
+                    "SELECT question_id, selected_option_id, is_correct FROM user_answers WHERE user_id=? AND quiz_id=?",
+                    (user_id, quiz_id)
+                )
+                return bundle, cur.fetchall()
+        bundle, answers = await self._run(query, readonly=True, shard=shard)
+        if bundle is None:
+            return None
+        self.bundles[quiz_id] = bundle
+        graded = uq is not None and uq.score_percent > 0
+        user_part = [
+            progress.stars, progress.gems,
+            bool(uq and uq.completed == 1), uq.score if uq else 0, uq.score_percent if uq else 0,
+            drawn,
+            [[qid, selected, bool(is_correct), bundle.by_id[qid][5] if qid in bundle.by_id else None]
+             for qid, selected, is_correct in answers],
+        ]
+        return b"\x92" + bundle.encode(drawn, graded) + packb(user_part)
+
+    def _load_bundle(self, cur, quiz_id: int, key) -> QuizBundle:
+        cur.execute("""
+            SELECT qu.title, qu.gems_reward, qu.sample_size, s.title
+            FROM quizzes qu JOIN subjects s ON qu.subject_id = s.id
+            WHERE qu.id=?
+        """, (quiz_id,))
+        title, gems_reward, sample_size, subject = cur.fetchone() or ("", 0, 0, "")
+        cur.execute(
+            "SELECT id, question_type, question_text, stars_reward, correct_option_id "
+            "FROM questions WHERE quiz_id=? ORDER BY id",
+            (quiz_id,)
+        )
+        questions = {qid: (qid, qtype, text, stars, [], correct) for qid, qtype, text, stars, correct in cur.fetchall()}
+        cur.execute("""
+            SELECT o.question_id, o.id, o.option_text
+            FROM question_options o
+            JOIN questions q ON q.id = o.question_id
+            WHERE q.quiz_id=?
+            ORDER BY o.id
+        """, (quiz_id,))
+        for qid, oid, text in cur.fetchall():
+            questions[qid][4].append((oid, text))
+        quiz = {"id": quiz_id, "version": key[0] if key else 0, "subject": subject, "title": title,
+                "gems_reward": gems_reward or 0, "sample_size": sample_size or 0}
+        return QuizBundle(key, quiz, list(questions.values()))
 
     # Answer submission (real-time): record answer, check correctness, adjust stars for wrong answers
     async def submit_answer(self, user_id, quiz_id, question_id, selected_option_id):
@@ -637,6 +1716,11 @@ class DatabaseManager:
                 "error": "question_not_found"
             }
 
+            {
+                "ok": False,
+                "error": "invalid_option"
+            }
+
             {
                 "ok": False,
                 "error": "not_ready",
@@ -652,102 +1736,214 @@ class DatabaseManager:
             - Each question can be answered only once.
             - Star deduction is blocked if the user has zero stars.
             - Star updates are applied immediately.
+            - For a quiz with a sample size, only questions drawn for the
+              current attempt are accepted ("question_not_in_attempt").
         """
-        loop = asyncio.get_running_loop()
+        shard = self._user_shard(user_id)
+        pool = await self._question_pool(quiz_id)
+        attempt = {}
         def query():
             try:
-                with sqlite3.connect(self.DBpath, timeout=5) as conn:
-                    cur = conn.cursor()
-                    cur.execute("""
-                        SELECT completed FROM user_quizzes
-                        WHERE user_id=? AND quiz_id=?
-                    """, (user_id, quiz_id))
+                with self._write(shard) as conn:
+                    return self._apply_answer(
+                        conn.cursor(), user_id, quiz_id, question_id, selected_option_id, pool, attempt
+                    )
+            except Exception as e:
+                print("DB ERROR submit_answer:", e)
+                return {"ok": False, "error": "db_error"}
+        async with self.locks.user(user_id):
+            result = await self._run(query, shard=shard)
+            if "seed" in attempt:
+                self.progress.quiz(user_id, quiz_id, seed=attempt["seed"], drawn=attempt["drawn"])
+            if result["ok"]:
+                self.progress.wallet(user_id, stars=result["current_stars"])
+        if result["ok"]:
+            self.question_stats.record(
+                shard, attempt["answer_ids"][question_id], question_id, selected_option_id, result["is_correct"]
+            )
+            self.events.publish(user_id, {
+                "type": "answer",
+                "quiz_id": quiz_id,
+                "question_id": question_id,
+                "is_correct": result["is_correct"],
+                "stars_delta": result["stars_delta"],
+                "stars": result["current_stars"],
+            })
+        return result
+
+    def _apply_answer(self, cur, user_id, quiz_id, question_id, selected_option_id, pool, attempt) -> dict:
+        """
+        submit_answer's rules for one answer, on a writer cursor inside the
+        caller's transaction. Returns submit_answer's result dict. For a
+        sampled attempt, attempt["seed"] and attempt["drawn"] are set to its
+        seed and question ids (read or created on the first call); the new
+        answer's id goes to attempt["answer_ids"][question_id].
+        """
+        cur.execute("""
+            SELECT completed, drawn FROM user_quizzes
+            WHERE user_id=? AND quiz_id=?
+        """, (user_id, quiz_id))
+
+        row = cur.fetchone()
+        if row and row[0] == 1:
+            return {"ok": False, "error": "quiz_already_completed"}
+
+        if pool.sampled or (row and row[1] is not None):
+            if "seed" not in attempt:
+                attempt["seed"], attempt["drawn"] = self._attempt_seed(cur, user_id, quiz_id, pool)
+            if attempt["drawn"] is not None and question_id not in attempt["drawn"]:
+                return {"ok": False, "error": "question_not_in_attempt"}
+
+
+        # user stars
+        cur.execute("SELECT stars FROM users WHERE id=?", (user_id,))
+        row = cur.fetchone()
+        if not row:
+            return {"ok": False, "error": "user_not_found"}
+        current_stars = row[0]
+
+        # already answered?
+        cur.execute("""
+            SELECT 1 FROM user_answers
+            WHERE user_id=? AND quiz_id=? AND question_id=?
+        """, (user_id, quiz_id, question_id))
+        if cur.fetchone():
+            cur.execute("SELECT correct_option_id FROM questions WHERE id=?", (question_id,))
+            return {
+                "ok": False,
+                "error": "already_answered",
+                "correct_option_id": cur.fetchone()[0]
+            }
 
-                    row = cur.fetchone()
-                    if row and row[0] == 1:
-                        return {"ok": False, "error": "quiz_already_completed"}
+        # question data
+        cur.execute("""
+            SELECT correct_option_id, stars_reward
+            FROM questions
+            WHERE id=? AND quiz_id=?
+        """, (question_id, quiz_id))
+        q = cur.fetchone()
+        if not q:
+            return {"ok": False, "error": "question_not_found"}
+
+        correct_option_id, stars_reward = q
+
+        # the option must belong to the question (client input, not a constraint error)
+        cur.execute(
+            "SELECT 1 FROM question_options WHERE id=? AND question_id=?",
+            (selected_option_id, question_id)
+        )
+        if not cur.fetchone():
+            return {"ok": False, "error": "invalid_option"}
+
+        is_correct = selected_option_id == correct_option_id
+
+        # calculate stars delta
+        if is_correct:
+            stars_delta = stars_reward
+        else:
+            if current_stars <= 0:
+                return {
+                    "ok": False,
+                    "error": "not_ready",
+                    "current_stars": current_stars
+                }
+            stars_delta = -1
+
+        # update stars (مرة واحدة فقط)
+        new_stars, _ = self._wallet_change(cur, user_id, "answer", f"question:{question_id}", stars=stars_delta)
+
+        # save answer
+        cur.execute("""
+            INSERT INTO user_answers
+            (user_id, quiz_id, question_id, selected_option_id, is_correct)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, quiz_id, question_id, selected_option_id, int(is_correct)))
+        attempt.setdefault("answer_ids", {})[question_id] = cur.lastrowid
+
+        return {
+            "ok": True,
+            "is_correct": is_correct,
+            "correct_option_id": correct_option_id,
+            "selected_option_id": selected_option_id,
+            "stars_delta": stars_delta,
+            "current_stars": new_stars
+        }
+
+    async def sync_answers(self, user_id: int, quiz_id: int, answers: list) -> dict:
+        """
+        Applies a whole answer set from an offline client (see get_quiz_bundle)
+        in one transaction, each answer under submit_answer's rules and in the
+        given order.
+
+        Args:
+            answers: (question_id, selected_option_id) pairs, at most SYNC_MAX_ANSWERS.
 
+        Returns:
+            {
+                "ok": True,
+                "results": [submit_answer's result plus "question_id", ...],
+                "current_stars": int
+            }
+            or {"ok": False, "error": "too_many_answers" | "user_not_found" | "db_error"}
 
-                    # user stars
+        A rejected answer (already answered, invalid option, not ready, ...)
+        does not stop the ones after it; a database error rolls back the
+        whole set.
+        """
+        if len(answers) > SYNC_MAX_ANSWERS:
+            return {"ok": False, "error": "too_many_answers", "limit": SYNC_MAX_ANSWERS}
+        shard = self._user_shard(user_id)
+        pool = await self._question_pool(quiz_id)
+        attempt = {}
+        def query():
+            try:
+                with self._write(shard) as conn:
+                    cur = conn.cursor()
+                    results = []
+                    for question_id, selected_option_id in answers:
+                        result = self._apply_answer(
+                            cur, user_id, quiz_id, question_id, selected_option_id, pool, attempt
+                        )
+                        result["question_id"] = question_id
+                        results.append(result)
                     cur.execute("SELECT stars FROM users WHERE id=?", (user_id,))
                     row = cur.fetchone()
                     if not row:
                         return {"ok": False, "error": "user_not_found"}
-                    current_stars = row[0]
+                    return {"ok": True, "results": results, "current_stars": row[0]}
+            except Exception as e:
+                print("DB ERROR sync_answers:", e)
+                return {"ok": False, "error": "db_error"}
+        async with self.locks.user(user_id):
+            result = await self._run(query, shard=shard)
+            if result["ok"]:
+                if "seed" in attempt:
+                    self.progress.quiz(user_id, quiz_id, seed=attempt["seed"], drawn=attempt["drawn"])
+                self.progress.wallet(user_id, stars=result["current_stars"])
+        if not result["ok"]:
+            return result
+        events = []
+        for answer in result["results"]:
+            if answer["ok"]:
+                self.question_stats.record(
+                    shard, attempt["answer_ids"][answer["question_id"]],
+                    answer["question_id"], answer["selected_option_id"], answer["is_correct"]
+                )
+                events.append((user_id, {
+                    "type": "answer",
+                    "quiz_id": quiz_id,
+                    "question_id": answer["question_id"],
+                    "is_correct": answer["is_correct"],
+                    "stars_delta": answer["stars_delta"],
+                    "stars": answer["current_stars"],
+                }))
+        self.events.publish_many(events)
+        return result
 
-                    # already answered?
-                    cur.execute("""
-                        SELECT 1 FROM user_answers
-                        WHERE user_id=? AND quiz_id=? AND question_id=?
-                    """, (user_id, quiz_id, question_id))
-                    if cur.fetchone():
-                        cur.execute("SELECT correct_option_id FROM questions WHERE id=?", (question_id,))
-                        return {
-                            "ok": False,
-                            "error": "already_answered",
-                            "correct_option_id": cur.fetchone()[0]
-                        }
-
-                    # question data
-                    cur.execute("""
-                        SELECT correct_option_id, stars_reward
-                        FROM questions
-                        WHERE id=? AND quiz_id=?
-                    """, (question_id, quiz_id))
-                    q = cur.fetchone()
-                    if not q:
-                        return {"ok": False, "error": "question_not_found"}
-
-                    correct_option_id, stars_reward = q
-                    is_correct = selected_option_id == correct_option_id
-
-                    # calculate stars delta
-                    if is_correct:
-                        stars_delta = stars_reward
-                    else:
-                        if current_stars <= 0:
-                            return {
-                                "ok": False,
-                                "error": "not_ready",
-                                "current_stars": current_stars
-                            }
-                        stars_delta = -1
-
-                    new_stars = max(0, current_stars + stars_delta)
-
-                    # update stars (مرة واحدة فقط)
-                    cur.execute(
-                        "UPDATE users SET stars=? WHERE id=?",
-                        (new_stars, user_id)
-                    )
-
-                    # save answer
-                    cur.execute("""
-                        INSERT INTO user_answers
-                        (user_id, quiz_id, question_id, selected_option_id, is_correct)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (user_id, quiz_id, question_id, selected_option_id, int(is_correct)))
-
-                    conn.commit()
-
-                    return {
-                        "ok": True,
-                        "is_correct": is_correct,
-                        "correct_option_id": correct_option_id,
-                        "selected_option_id": selected_option_id,
-                        "stars_delta": stars_delta,
-                        "current_stars": new_stars
-                    }
-
-            except Exception as e:
-                print("DB ERROR submit_answer:", e)
-                return {"ok": False, "error": "db_error"}
-        return await loop.run_in_executor(None, query)
-
-    # Finish quiz: calculate results, award stars for correct answers, award gems if configured
-    async def finish_quiz(self, user_id: int, quiz_id: int):
-        """
-        Finalizes a quiz attempt and calculates the final result.
+    # Finish quiz: calculate results, award stars for correct answers, award gems if configured
+    async def finish_quiz(self, user_id: int, quiz_id: int):
+        """
+        Finalizes a quiz attempt and calculates the final result.
 
         This function:
         - Computes the total score and percentage
@@ -790,15 +1986,20 @@ class DatabaseManager:
             - A failed attempt is stored with completed = 0.
             - A passed attempt is stored with completed = 1 and a completion timestamp.
             - Gems are awarded only once and only for passing attempts.
+            - For a quiz with a sample size, only answers to the questions drawn
+              for the current attempt count.
         """
-        loop = asyncio.get_running_loop()
+        shard = self._user_shard(user_id)
+        pool = await self._question_pool(quiz_id)
+        ranking = []
+        wallet = {}
         def query():
             try:
-                with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
+                with self._write(shard) as conn:
                     cur = conn.cursor()
 
                     cur.execute("""
-                        SELECT completed, score_percent, gems_awarded
+                        SELECT completed, score_percent, gems_awarded, seed, drawn
                         FROM user_quizzes
                         WHERE user_id=? AND quiz_id=?
                         LIMIT 1
@@ -814,13 +2015,19 @@ class DatabaseManager:
                         }
 
                     cur.execute("""
-                        SELECT ua.is_correct, q.stars_reward
+                        SELECT ua.is_correct, q.stars_reward, ua.question_id
                         FROM user_answers ua
                         JOIN questions q ON ua.question_id = q.id
                         WHERE ua.user_id=? AND ua.quiz_id=?
                     """, (user_id, quiz_id))
 
                     answers = cur.fetchall()
+                    drawn = pool.attempt(row[3], unpack_ids(row[4])) if row else None
+                    if drawn is None and pool.sampled:
+                        drawn = []  # sampled quiz without an attempt
+                    if drawn is not None:
+                        drawn = set(drawn)
+                        answers = [a for a in answers if a[2] in drawn]
                     if not answers:
                         return {"ok": False, "error": "no_answers"}
 
@@ -832,17 +2039,16 @@ class DatabaseManager:
                     passed = score_percent >= 50
 
                     gems = 0
+                    subject_id = None
                     if passed:
-                        cur.execute("SELECT gems_reward FROM quizzes WHERE id=?", (quiz_id,))
+                        cur.execute("SELECT gems_reward, subject_id FROM quizzes WHERE id=?", (quiz_id,))
                         row = cur.fetchone()
                         gems = row[0] if row else 0
+                        subject_id = row[1] if row else None
                     else:
                         gems = 0 
-                    cur.execute("SELECT gems FROM users WHERE id=?", (user_id,))
-                    row = cur.fetchone()
-                    current_gems = row[0] if row else 0
-                    new_gems = current_gems + gems
-                    cur.execute("UPDATE users SET gems=? WHERE id=?", (new_gems,user_id))#
+                    balance = self._wallet_change(cur, user_id, "quiz_passed", f"quiz:{quiz_id}", gems=gems)
+                    wallet["gems"] = balance[1] if balance else None
 
                     completed = 1 if passed else 0
                     completed_at = int(datetime.now(timezone.utc).timestamp()) if passed else None
@@ -868,7 +2074,8 @@ class DatabaseManager:
                         completed_at
                     ))
 
-
+                    if passed and subject_id is not None:
+                        ranking.extend(self._add_leaderboard_score(cur, user_id, subject_id, earned_stars, completed_at))
 
                     conn.commit()
 
@@ -884,7 +2091,27 @@ class DatabaseManager:
                 print("DB ERROR finish_quiz:", e)
                 return {"ok": False, "error": "db_error"}
 
-        return await loop.run_in_executor(None, query)
+        async with self.locks.user(user_id):
+            result = await self._run(query, shard=shard)
+            if result["ok"]:
+                self.progress.wallet(user_id, gems=wallet.get("gems"))
+                self.progress.quiz(
+                    user_id, quiz_id,
+                    completed=int(result["passed"]), score=result["score"], score_percent=result["score_percent"]
+                )
+                # only what was committed reaches the in-memory boards
+                for username, subject_id, score in ranking:
+                    self.leaderboards.set(user_id, username, subject_id, score)
+        if result["ok"]:
+            self.events.publish(user_id, {
+                "type": "quiz_finished",
+                "quiz_id": quiz_id,
+                "passed": result["passed"],
+                "score_percent": result["score_percent"],
+                "gems_delta": result["gems_awarded"],
+                "gems": wallet.get("gems"),
+            })
+        return result
 
     
     async def buy_star_package(self, user_id: int, package_name: str) -> dict:
@@ -905,38 +2132,47 @@ class DatabaseManager:
         if not pkg:
             return {"ok": False, "error": "Invalid package"}
 
-        loop = asyncio.get_running_loop()
-
+        shard = self._user_shard(user_id)
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._write(shard) as conn:
                 cur = conn.cursor()
 
-                cur.execute("SELECT stars, gems FROM users WHERE id=?", (user_id,))
-                user = cur.fetchone()
-                if not user:
-                    return {"ok": False, "error": "User not found"}
-
-                current_stars, current_gems = user
-                if current_gems < pkg["gems"]:
-                    return {"ok": False, "error": "Not enough gems", "stars": current_stars, "gems": current_gems}
+                balance = self._wallet_change(cur, user_id, "purchase", package_name, stars=pkg["stars"], gems=-pkg["gems"])
+                if balance is None:
+                    cur.execute("SELECT stars, gems FROM users WHERE id=?", (user_id,))
+                    user = cur.fetchone()
+                    if not user:
+                        return {"ok": False, "error": "User not found"}
+                    return {"ok": False, "error": "Not enough gems", "stars": user[0], "gems": user[1]}
 
-                new_stars = current_stars + pkg["stars"]
-                new_gems = current_gems - pkg["gems"]
-                cur.execute("UPDATE users SET stars=?, gems=? WHERE id=?", (new_stars, new_gems, user_id))
+                new_stars, new_gems = balance
                 conn.commit()
 
                 return {"ok": True, "stars": new_stars, "gems": new_gems, "purchased_package": package_name}
 
-        return await loop.run_in_executor(None, query)
+        async with self.locks.user(user_id):
+            result = await self._run(query, shard=shard)
+            if result["ok"]:
+                self.progress.wallet(user_id, stars=result["stars"], gems=result["gems"])
+        if result["ok"]:
+            self.events.publish(user_id, {
+                "type": "purchase",
+                "package": package_name,
+                "stars_delta": pkg["stars"],
+                "gems_delta": -pkg["gems"],
+                "stars": result["stars"],
+                "gems": result["gems"],
+            })
+        return result
 
 
     async def reset_failed_quiz_answers(self, user_id: int, quiz_id: int) -> dict:
-        loop = asyncio.get_running_loop()
-
+        shard = self._user_shard(user_id)
+        seed = new_seed()
+        attempt = {"seed": seed, "drawn": (await self._question_pool(quiz_id)).draw(seed)}
         def query():
             try:
-                with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
-                    conn.row_factory = sqlite3.Row
+                with self._write(shard) as conn:
                     cur = conn.cursor()
                     # Check if quiz is completed
                     cur.execute("""
@@ -961,16 +2197,18 @@ class DatabaseManager:
                     """, (user_id, quiz_id))
                     answers_reset = cur.rowcount
 
-                    # Reset quiz state
+                    # Reset quiz state; a new seed draws new questions for the next attempt
                     cur.execute("""
                         UPDATE user_quizzes
                         SET completed = 0,
                             score = 0,
                             score_percent = 0,
                             gems_awarded = 0,
-                            completed_at = NULL
+                            completed_at = NULL,
+                            seed = ?,
+                            drawn = ?
                         WHERE user_id = ? AND quiz_id = ?
-                    """, (user_id, quiz_id))
+                    """, (attempt["seed"], pack_ids(attempt["drawn"]), user_id, quiz_id))
                     quiz_reset = cur.rowcount
 
                     conn.commit()
@@ -988,9 +2226,840 @@ class DatabaseManager:
                     "error": "db_error"
                 }
 
-        return await loop.run_in_executor(None, query)
+        async with self.locks.user(user_id):
+            result = await self._run(query, shard=shard)
+            if result["ok"]:
+                self.progress.quiz(
+                    user_id, quiz_id, completed=0, score=0, score_percent=0,
+                    seed=attempt["seed"], drawn=attempt["drawn"]
+                )
+        if result["ok"]:
+            self.events.publish(user_id, {"type": "quiz_reset", "quiz_id": quiz_id})
+        return result
+
+    # ------------------------
+    # Wallet: append-only ledger behind the cached stars/gems balances
+    # ------------------------
+    def _wallet_change(self, cur, user_id: int, reason: str, ref: str | None = None, stars: int = 0, gems: int = 0):
+        """
+        Adds stars/gems (negative to spend) inside the caller's write
+        transaction: the cached balance in users is updated in SQL, never
+        below zero, and the change is appended to wallet_ledger.
+        Returns the new (stars, gems), or None when the user does not exist
+        or cannot afford the change.
+        """
+        if not stars and not gems:
+            cur.execute("SELECT stars, gems FROM users WHERE id=?", (user_id,))
+            return cur.fetchone()
+        cur.execute("""
+            UPDATE users SET stars = stars + ?, gems = gems + ?
+            WHERE id = ? AND stars + ? >= 0 AND gems + ? >= 0
+            RETURNING stars, gems
+        """, (stars, gems, user_id, stars, gems))
+        balance = cur.fetchone()
+        if balance is None:
+            return None
+        cur.execute(
+            "INSERT INTO wallet_ledger (user_id, stars, gems, reason, ref, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, stars, gems, reason, ref, int(time.time()))
+        )
+        return balance
+
+    async def get_wallet_history(self, user_id: int, before: int | None = None, limit: int = WALLET_PAGE_SIZE) -> dict:
+        """
+        Balance and ledger of a user, newest first. Pass the returned
+        next_before to read the page after this one. Rows older than
+        WALLET_KEEP_DAYS may already be folded into the snapshot.
+        """
+        shard = self._user_shard(user_id)
+        def query():
+            try:
+                with self._connect(readonly=True, shard=shard) as conn:
+                    cur = conn.cursor()
+                    cur.execute("""
+                        SELECT u.stars, u.gems, s.stars, s.gems, s.updated_at
+                        FROM users u LEFT JOIN wallet_snapshots s ON s.user_id = u.id
+                        WHERE u.id=?
+                    """, (user_id,))
+                    row = cur.fetchone()
+                    if not row:
+                        return {"ok": False, "error": "user_not_found"}
+                    cur.execute("""
+                        SELECT id, stars, gems, reason, ref, created_at FROM wallet_ledger
+                        WHERE user_id=? AND id < ?
+                        ORDER BY id DESC LIMIT ?
+                    """, (user_id, before if before is not None else 1 << 62, limit))
+                    entries = [
+                        {"id": r[0], "stars": r[1], "gems": r[2], "reason": r[3], "ref": r[4], "created_at": r[5]}
+                        for r in cur.fetchall()
+                    ]
+                    return {
+                        "ok": True,
+                        "stars": row[0],
+                        "gems": row[1],
+                        "snapshot": {"stars": row[2], "gems": row[3], "updated_at": row[4]},
+                        "entries": entries,
+                        "next_before": entries[-1]["id"] if len(entries) == limit else None,
+                    }
+            except Exception as e:
+                print("DB ERROR get_wallet_history:", e)
+                return {"ok": False, "error": "db_error"}
+        return await self._run(query, readonly=True, shard=shard)
+
+    def compact_wallets(self, keep_days: int = WALLET_KEEP_DAYS) -> dict:
+        """
+        Folds ledger rows older than keep_days into wallet_snapshots, in
+        write transactions of WALLET_COMPACT_BATCH rows, then checks every
+        cached balance against its snapshot plus the remaining ledger rows.
+        Maintenance job; returns the counts ("mismatched" should stay 0).
+        """
+        cutoff = int(time.time()) - keep_days * 86400
+        report = {"folded": 0, "mismatched": 0}
+        try:
+            for shard in range(self.user_shards):
+                while True:
+                    with self._write(shard) as conn:
+                        cur = conn.cursor()
+                        self._seed_wallet_snapshots(cur)
+                        cur.execute("""
+                            SELECT MAX(id) FROM (
+                                SELECT id FROM wallet_ledger WHERE created_at < ? ORDER BY id LIMIT ?
+                            )
+                        """, (cutoff, WALLET_COMPACT_BATCH))
+                        last = cur.fetchone()[0]
+                        if last is None:
+                            break
+                        cur.execute("""
+                            INSERT INTO wallet_snapshots (user_id, stars, gems, ledger_id, updated_at)
+                            SELECT user_id, SUM(stars), SUM(gems), MAX(id), ?
+                            FROM wallet_ledger WHERE id <= ? AND created_at < ?
+                            GROUP BY user_id
+                            ON CONFLICT(user_id) DO UPDATE SET
+                                stars = stars + excluded.stars,
+                                gems = gems + excluded.gems,
+                                ledger_id = excluded.ledger_id,
+                                updated_at = excluded.updated_at
+                        """, (int(time.time()), last, cutoff))
+                        cur.execute("DELETE FROM wallet_ledger WHERE id <= ? AND created_at < ?", (last, cutoff))
+                        report["folded"] += cur.rowcount
+                        conn.commit()
+                with self._connect(shard=shard) as conn:
+                    cur = conn.cursor()
+                    cur.execute("""
+                        SELECT COUNT(*) FROM users u
+                        LEFT JOIN wallet_snapshots s ON s.user_id = u.id
+                        LEFT JOIN (
+                            SELECT user_id, SUM(stars) AS stars, SUM(gems) AS gems
+                            FROM wallet_ledger GROUP BY user_id
+                        ) l ON l.user_id = u.id
+                        WHERE u.stars != COALESCE(s.stars, 0) + COALESCE(l.stars, 0)
+                           OR u.gems != COALESCE(s.gems, 0) + COALESCE(l.gems, 0)
+                    """)
+                    report["mismatched"] += cur.fetchone()[0]
+            if report["mismatched"]:
+                print("[WALLET] balances not matching their ledger:", report["mismatched"])
+            return report
+        except Exception as e:
+            print("DB ERROR compact_wallets:", e)
+            return False
+
+    # ------------------------
+    # Question sampling
+    # ------------------------
+    async def _question_pool(self, quiz_id: int) -> QuestionPool:
+        """
+        The quiz's question ids and sample size, cached per worker until the
+        quiz changes (here or, through watch_changes, in another worker).
+        """
+        pool = self.question_pools.get(quiz_id)
+        if pool is not None:
+            return pool
+        generation = self._pool_generation
+        def query():
+            with self._connect(readonly=True) as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT sample_size FROM quizzes WHERE id=?", (quiz_id,))
+                row = cur.fetchone()
+                sample_size = (row[0] or 0) if row else 0
+                ids = []
+                if sample_size:
+                    cur.execute("SELECT id FROM questions WHERE quiz_id=? ORDER BY id", (quiz_id,))
+                    ids = [r[0] for r in cur.fetchall()]
+                return QuestionPool(ids, sample_size, time.monotonic())
+        pool = await self._run(query, readonly=True)
+        if generation == self._pool_generation:
+            # not invalidated while it was read
+            self.question_pools[quiz_id] = pool
+        return pool
+
+    def _invalidate_question_pools(self, quiz_id: int | None = None) -> None:
+        self._pool_generation += 1
+        self.flights.forget()
+        if quiz_id is None:
+            self.question_pools.clear()
+        else:
+            self.question_pools.pop(quiz_id, None)
+
+    def _attempt_seed(self, cur, user_id: int, quiz_id: int, pool: QuestionPool) -> tuple:
+        """
+        (seed, drawn question ids) of the user's current attempt, created on
+        first use (writer cursor). An attempt stored before the drawn ids
+        were kept gets the pool's draw stored now, fixed from then on.
+        """
+        seed = new_seed()
+        cur.execute("""
+            INSERT INTO user_quizzes (user_id, quiz_id, seed, drawn) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, quiz_id) DO UPDATE SET seed=excluded.seed, drawn=excluded.drawn WHERE seed IS NULL
+        """, (user_id, quiz_id, seed, pack_ids(pool.draw(seed))))
+        cur.execute("SELECT seed, drawn FROM user_quizzes WHERE user_id=? AND quiz_id=?", (user_id, quiz_id))
+        seed, drawn = cur.fetchone()
+        if drawn is None and pool.sampled:
+            drawn = pack_ids(pool.draw(seed))
+            cur.execute("UPDATE user_quizzes SET drawn=? WHERE user_id=? AND quiz_id=?", (drawn, user_id, quiz_id))
+        return seed, unpack_ids(drawn)
+
+    async def _ensure_attempt_seed(self, user_id: int, quiz_id: int) -> tuple:
+        shard = self._user_shard(user_id)
+        pool = await self._question_pool(quiz_id)
+        def query():
+            with self._write(shard) as conn:
+                return self._attempt_seed(conn.cursor(), user_id, quiz_id, pool)
+        async with self.locks.user(user_id):
+            seed, drawn = await self._run(query, shard=shard)
+            self.progress.quiz(user_id, quiz_id, seed=seed, drawn=drawn)
+        return seed, drawn
+
+    # ------------------------
+    # Cache coherence across workers
+    # ------------------------
+    async def watch_changes(self, interval: float = COHERENCE_INTERVAL):
+        """
+        Keeps this worker's caches coherent with writes made by other worker
+        processes: every `interval` seconds, reads the cache_changes rows
+        they committed (see coherence.ChangeFeed) and drops or refreshes
+        just those entries. An idle check is one PRAGMA per file. Runs until
+        cancelled; started by the server for each worker.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # the first poll, right away, is where the logs are followed from
+            try:
+                changes = await loop.run_in_executor(self._watch_executor, self._poll_changes)
+                await self._apply_changes(changes)
+            except Exception as e:
+                print("DB ERROR watch_changes:", e)
+            await asyncio.sleep(interval)
+
+    def _poll_changes(self) -> list | None:
+        """
+        Runs on the watch thread, with its own connections. (family, key)
+        pairs changed by others since the last call, or None when every
+        cache should be dropped (too many changes, or a new content file).
+        """
+        signature = self._content_signature()
+        if signature != self._watch_signature:
+            swapped = bool(self._watch_conns)
+            for conn in self._watch_conns.values():
+                conn.close()
+            self._watch_conns.clear()
+            self._watch_signature = signature
+            for feed in self.feeds.values():
+                feed.reset()
+            if swapped:
+                return None
+        changes = []
+        for feed in self.feeds.values():
+            conn = self._watch_conns.get(feed.target)
+            if conn is None:
+                conn = self._watch_conns[feed.target] = self._open(feed.target, readonly=True)
+            found = feed.poll(conn.cursor())
+            if found is None:
+                return None
+            changes += found
+        return changes
+
+    async def _apply_changes(self, changes: list | None) -> None:
+        if changes is None:
+            self.invalidations["all"] += 1
+            self._invalidate_question_pools()
+            self.bundles.clear()
+            self.progress.clear()
+            self.leaderboards.loaded_at = 0
+            return
+        families = {"catalog": set(), "progress": set(), "leaderboard": set()}
+        for family, key in changes:
+            if family in families:
+                families[family].add(key)
+        for quiz_id in families["catalog"]:
+            self._invalidate_question_pools(quiz_id)
+            self.bundles.pop(quiz_id, None)
+        if families["progress"]:
+            self.progress.invalidate(families["progress"])
+        if families["leaderboard"]:
+            await self._refresh_leaderboards(families["leaderboard"])
+        for family, keys in families.items():
+            self.invalidations[family] += len(keys)
+
+    async def _refresh_leaderboards(self, user_ids) -> None:
+        """Re-reads the ranking rows of these users into the loaded boards."""
+        by_shard = {}
+        for user_id in user_ids:
+            by_shard.setdefault(self._user_shard(user_id), []).append(user_id)
+        def make_query(ids, shard):
+            def query():
+                with self._connect(readonly=True, shard=shard) as conn:
+                    cur = conn.cursor()
+                    cur.execute(f"""
+                        SELECT l.user_id, u.username, l.subject_id, l.score
+                        FROM leaderboard l
+                        JOIN users u ON u.id = l.user_id
+                        WHERE l.user_id IN ({','.join('?' * len(ids))})
+                    """, ids)
+                    return cur.fetchall()
+            return query
+        async with self._leaderboard_lock:
+            if not self.leaderboards.loaded_at:
+                return  # the next read loads everything
+            results = await asyncio.gather(*(
+                self._run(make_query(ids, shard), readonly=True, shard=shard) for shard, ids in by_shard.items()
+            ))
+            seen = set()
+            for rows in results:
+                for user_id, username, subject_id, score in rows:
+                    self.leaderboards.set(user_id, username, subject_id, score)
+                    seen.add(user_id)
+            if len(seen) < len(user_ids):
+                # rows were deleted, which set() cannot express
+                self.leaderboards.loaded_at = 0
+
+    def prune_cache_changes(self, keep: int = CHANGE_LOG_KEEP) -> dict:
+        """
+        Maintenance job: trims each file's cache_changes to its newest `keep`
+        rows. A worker that falls further behind than that drops all its
+        caches once instead of missing changes.
+        """
+        try:
+            report = {}
+            for name, feed in self.feeds.items():
+                with self._write(feed.target) as conn:
+                    cur = conn.cursor()
+                    cur.execute(f"""
+                        DELETE FROM {feed.schema}cache_changes
+                        WHERE seq <= (SELECT MAX(seq) FROM {feed.schema}cache_changes) - ?
+                    """, (keep,))
+                    report[name] = cur.rowcount
+            return report
+        except Exception as e:
+            print("DB ERROR prune_cache_changes:", e)
+            return False
+
+    def coherence_metrics(self) -> dict:
+        return {
+            "feeds": {name: feed.metrics() for name, feed in self.feeds.items()},
+            "invalidations": dict(self.invalidations),
+        }
+
+    # ------------------------
+    # Leaderboards
+    # ------------------------
+    def _add_leaderboard_score(self, cur, user_id: int, subject_id: int, points: int, now_ts: int) -> list:
+        """
+        Adds `points` to the user's subject and global rows of the ranking
+        table inside the caller's transaction. Returns the new
+        (username, subject_id, score) entries for the in-memory boards.
+        """
+        cur.execute("SELECT username FROM users WHERE id=?", (user_id,))
+        row = cur.fetchone()
+        username = row[0] if row else None
+        entries = []
+        for board in (subject_id, GLOBAL):
+            cur.execute("""
+                INSERT INTO leaderboard (user_id, subject_id, score, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, subject_id) DO UPDATE SET
+                    score=leaderboard.score + excluded.score,
+                    updated_at=excluded.updated_at
+            """, (user_id, board, points, now_ts))
+            cur.execute("SELECT score FROM leaderboard WHERE user_id=? AND subject_id=?", (user_id, board))
+            entries.append((username, board, cur.fetchone()[0]))
+        return entries
+
+    async def get_leaderboard(self, user_id: int, subject_id: int = GLOBAL, limit: int = LEADERBOARD_SIZE) -> dict:
+        """
+        Top `limit` players of a subject board (or the global one) and the
+        caller's own rank, answered from memory. The boards are read from the
+        ranking table once; scores written by other workers are applied by
+        watch_changes.
+        """
+        if not self.leaderboards.loaded_at:
+            async with self._leaderboard_lock:
+                if not self.leaderboards.loaded_at:
+                    await self._load_leaderboards()
+        return self.leaderboards.payload(subject_id, user_id, limit)
+
+    async def _load_leaderboards(self):
+        def make_query(shard):
+            def query():
+                with self._connect(readonly=True, shard=shard) as conn:
+                    cur = conn.cursor()
+                    cur.execute("""
+                        SELECT l.user_id, u.username, l.subject_id, l.score
+                        FROM leaderboard l
+                        JOIN users u ON u.id = l.user_id
+                    """)
+                    return cur.fetchall()
+            return query
+
+        boards = Leaderboards()
+        scores = {}
+        for rows in await self._fan_out(make_query):
+            for user_id, username, subject_id, score in rows:
+                boards.usernames[user_id] = username
+                scores.setdefault(subject_id, {})[user_id] = score
+        for subject_id, board_scores in scores.items():
+            boards.board(subject_id).load(board_scores)
+        boards.loaded_at = time.time()
+        self.leaderboards = boards
+
+    def rebuild_leaderboards(self) -> dict:
+        """
+        Recomputes the ranking table from user_quizzes, shard by shard.
+        Maintenance job; the in-memory boards are reloaded on the next read.
+        """
+        try:
+            rows = 0
+            now_ts = int(datetime.now(timezone.utc).timestamp())
+            for shard in range(self.user_shards):
+                with self._write(shard) as conn:
+                    cur = conn.cursor()
+                    cur.execute("DELETE FROM leaderboard")
+                    cur.execute("""
+                        INSERT INTO leaderboard (user_id, subject_id, score, updated_at)
+                        SELECT uq.user_id, q.subject_id, SUM(uq.score), ?
+                        FROM user_quizzes uq
+                        JOIN quizzes q ON q.id = uq.quiz_id
+                        WHERE uq.completed = 1
+                        GROUP BY uq.user_id, q.subject_id
+                    """, (now_ts,))
+                    cur.execute("""
+                        INSERT INTO leaderboard (user_id, subject_id, score, updated_at)
+                        SELECT user_id, ?, SUM(score), ?
+                        FROM leaderboard
+                        GROUP BY user_id
+                    """, (GLOBAL, now_ts))
+                    cur.execute("SELECT COUNT(*) FROM leaderboard")
+                    rows += cur.fetchone()[0]
+                    conn.commit()
+            self.leaderboards.loaded_at = 0
+            return {"rows": rows}
+        except Exception as e:
+            print("DB ERROR rebuild_leaderboards:", e)
+            return False
+
+    def collect_orphans(self, budget: float = GC_TIME_BUDGET) -> dict:
+        """
+        Incremental garbage collection of rows whose parent is gone (left by
+        deletes before they cascaded, or by a cascade interrupted between
+        files). Walks each table of GC_CHECKS in rowid windows of
+        GC_BATCH_SIZE, one short write transaction per window, for at most
+        `budget` seconds; the next run resumes where this one stopped.
+        Orphaned catalog rows are removed with _delete_cascade's helpers, so
+        their own children go too.
+        Maintenance job; returns what it reclaimed.
+        """
+        steps = [
+            (name, where, condition, shard)
+            for name, where, condition in GC_CHECKS
+            if not (where == "catalog" and self.content_immutable)
+            for shard in (range(self.user_shards) if where == "user" else [None])
+        ]
+        started = time.monotonic()
+        report = {"examined": 0, "deleted": {}, "pass_complete": False}
+        try:
+            while time.monotonic() - started < budget:
+                if self._gc_step >= len(steps):
+                    self._gc_step, self._gc_after = 0, 0
+                    report["pass_complete"] = True
+                    break
+                name, where, condition, shard = steps[self._gc_step]
+                examined, deleted = self._collect_window(name, where, condition, shard)
+                report["examined"] += examined
+                for table, n in deleted.items():
+                    if n:
+                        report["deleted"][table] = report["deleted"].get(table, 0) + n
+                if examined < GC_BATCH_SIZE:
+                    self._gc_step, self._gc_after = self._gc_step + 1, 0
+        except Exception as e:
+            print("DB ERROR collect_orphans:", e)
+            return False
+        if report["deleted"]:
+            self._invalidate_question_pools()
+            print("[GC] reclaimed", report["deleted"])
+        report["seconds"] = round(time.monotonic() - started, 3)
+        return report
+
+    def _collect_window(self, name, where, condition, shard) -> tuple[int, dict]:
+        table = name.split(".")[0]
+        shard = shard if where == "user" else None
+        with self._write(shard) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT t.rowid, {condition} FROM {table} t WHERE t.rowid > ? ORDER BY t.rowid LIMIT ?",
+                (self._gc_after, GC_BATCH_SIZE)
+            )
+            window = cur.fetchall()
+            if not window:
+                return 0, {}
+            orphans = [rowid for rowid, orphan in window if orphan]
+            deleted = {}
+            if name == "user_answers.selected_option_id":
+                cur.executemany(
+                    "UPDATE user_answers SET selected_option_id=NULL WHERE id=?", [(i,) for i in orphans]
+                )
+                deleted["detached_answers"] = cur.rowcount
+            elif table == "question_signatures":
+                cur.executemany("DELETE FROM question_lsh WHERE question_id=?", [(i,) for i in orphans])
+                cur.executemany("DELETE FROM question_signatures WHERE question_id=?", [(i,) for i in orphans])
+                deleted[table] = cur.rowcount
+            elif where == "catalog" and orphans:
+                roots = {"quizzes": "quiz_ids", "questions": "question_ids", "question_options": "option_ids"}
+                plan = self._cascade_plan(cur, **{roots[table]: orphans})
+                if self.user_shards == 1:
+                    deleted.update(self._delete_user_rows(cur, plan))
+                deleted.update(self._delete_catalog_rows(cur, plan))
+            else:
+                cur.executemany(f"DELETE FROM {table} WHERE rowid=?", [(i,) for i in orphans])
+                deleted[table] = cur.rowcount
+            conn.commit()
+        self._gc_after = window[-1][0]
+        return len(window), deleted
+
+    def run_maintenance(self, hours=None, force: bool = False) -> dict:
+        """
+        Keeps every database file healthy: fresh planner statistics
+        (ANALYZE on first run, then PRAGMA optimize), a passive WAL
+        checkpoint that truncates the WAL once it passes WAL_TRUNCATE_BYTES,
+        and incremental_vacuum of free pages. A file created before
+        auto_vacuum was turned on is converted once with a full VACUUM.
+
+        hours: UTC hours the periodic run may work in (None means any). The
+        first run of a process (startup) does the quick steps whatever the
+        hour, but leaves the one-off VACUUM to the window. force=True (the
+        admin trigger) runs everything now.
+        Maintenance job; returns the report, also stored in maintenance_runs.
+        """
+        startup = self._maintenance_runs == 0
+        in_window = force or hours is None or datetime.now(timezone.utc).hour in hours
+        if not (in_window or startup):
+            return {"skipped": "outside the maintenance window"}
+        if not self._maintenance_lock.acquire(blocking=False):
+            return {"skipped": "already running"}
+        try:
+            self._maintenance_runs += 1
+            started_at = time.time()
+            report = {"started_at": started_at, "startup": startup, "files": []}
+            files = [("main", None, "main", self.DBpath)]
+            if self.content_path and not self.content_immutable:
+                files.append(("content", None, "content", self.content_path))
+            if self.user_shards > 1:
+                files += [(f"shard{i}", i, "main", self._paths[i]) for i in range(self.user_shards)]
+            for label, shard, schema, path in files:
+                steps = []
+                with self._file_lock(shard), self._connect(shard=shard) as conn:
+                    self._maintain_file(conn.cursor(), schema, path, in_window, steps)
+                for step in steps:
+                    print(f"[MAINTENANCE] {label} {step['step']}: {step['ms']} ms", step.get("detail", ""))
+                report["files"].append({"file": label, "steps": steps})
+            report["seconds"] = round(time.time() - started_at, 3)
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO maintenance_runs (id, started_at, report) VALUES (1, ?, ?)",
+                    (started_at, json.dumps(report))
+                )
+                conn.commit()
+            return report
+        except Exception as e:
+            print("DB ERROR run_maintenance:", e)
+            return False
+        finally:
+            self._maintenance_lock.release()
+
+    def _maintain_file(self, cur, schema, path, in_window, steps):
+        def timed(name, func):
+            t0 = time.perf_counter()
+            detail = func()
+            step = {"step": name, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+            if isinstance(detail, dict):
+                step["detail"] = detail
+            steps.append(step)
+
+        cur.execute(f"PRAGMA {schema}.analysis_limit={ANALYSIS_LIMIT}")
+        cur.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name='sqlite_stat1'")
+        if cur.fetchone() is None:
+            timed("analyze", lambda: cur.execute(f"ANALYZE {schema}"))
+        else:
+            timed("optimize", lambda: cur.execute(f"PRAGMA {schema}.optimize"))
+
+        def checkpoint():
+            wal = path + "-wal"
+            size = os.path.getsize(wal) if os.path.exists(wal) else 0
+            mode = "TRUNCATE" if size > WAL_TRUNCATE_BYTES else "PASSIVE"
+            busy, frames, done = cur.execute(f"PRAGMA {schema}.wal_checkpoint({mode})").fetchone()
+            return {"mode": mode, "wal_bytes": size, "busy": bool(busy), "frames": frames, "checkpointed": done}
+        timed("checkpoint", checkpoint)
+
+        if cur.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+            if not in_window:
+                steps.append({"step": "vacuum", "ms": 0, "detail": {"deferred": "outside the maintenance window"}})
+                return
+            def migrate():
+                cur.execute(f"PRAGMA {schema}.auto_vacuum=INCREMENTAL")
+                cur.execute(f"VACUUM {schema}")
+                return {"auto_vacuum": cur.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0]}
+            timed("vacuum", migrate)
+
+        def incremental_vacuum():
+            free = cur.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+            if free < VACUUM_MIN_FREE_PAGES:
+                return {"free_pages": free}
+            cur.execute(f"PRAGMA {schema}.incremental_vacuum({VACUUM_MAX_PAGES})").fetchall()
+            left = cur.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+            return {"free_pages": free, "released": free - left}
+        timed("incremental_vacuum", incremental_vacuum)
+
+    def create_backup(self, backup_dir: str, keep: int = backup.BACKUP_KEEP) -> dict:
+        """
+        Hot backup of every database file (db_path, the content file, each
+        user shard) with the SQLite backup API, into a compressed,
+        integrity-checked snapshot under backup_dir; keeps the `keep` newest.
+        Runs alongside live traffic. Maintenance job; returns the manifest.
+        """
+        if not self._backup_lock.acquire(blocking=False):
+            return {"skipped": "already running"}
+        try:
+            sources = [("main", self.DBpath)]
+            if self.content_path:
+                sources.append(("content", self.content_path))
+            if self.user_shards > 1:
+                sources += [(f"shard{i}", self._paths[i]) for i in range(self.user_shards)]
+            manifest = backup.run_backup(sources, backup_dir, keep)
+            self.last_backup = manifest
+            print(f"[BACKUP] {manifest['snapshot']} written in {manifest['seconds']} s")
+            return manifest
+        except Exception as e:
+            print("DB ERROR create_backup:", e)
+            self.last_backup = {"error": str(e), "failed_at": time.time()}
+            return False
+        finally:
+            self._backup_lock.release()
+
+    @property
+    def backup_running(self) -> bool:
+        return self._backup_lock.locked()
+
+    def get_maintenance_report(self) -> dict | None:
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT report FROM maintenance_runs WHERE id = 1").fetchone()
+                return json.loads(row[0]) if row else None
+        except Exception as e:
+            print("DB ERROR get_maintenance_report:", e)
+            return None
+
+    # ------------------------
+    # Live rooms
+    # ------------------------
+    async def get_live_questions(self, quiz_id: int, seed: int | None = None) -> list[dict]:
+        """
+        Questions of a quiz with their options but without the correct
+        answers, in the order a live room pushes them. For a quiz with a
+        sample size, the questions drawn with the room's seed.
+        """
+        drawn = (await self._question_pool(quiz_id)).draw(seed)
+        def query():
+            with self._connect(readonly=True) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT id, question_text, question_type, stars_reward "
+                    "FROM questions WHERE quiz_id=? ORDER BY id",
+                    (quiz_id,)
+                )
+                questions = {
+                    qid: {"id": qid, "type": qtype, "text": text, "answers": {}, "stars": stars}
+                    for qid, text, qtype, stars in cur.fetchall()
+                }
+                cur.execute("""
+                    SELECT o.id, o.question_id, o.option_text
+                    FROM question_options o
+                    JOIN questions q ON q.id = o.question_id
+                    WHERE q.quiz_id=?
+                    ORDER BY o.id
+                """, (quiz_id,))
+                for oid, qid, text in cur.fetchall():
+                    questions[qid]["answers"][str(oid)] = text
+                if drawn is not None:
+                    return [questions[qid] for qid in drawn if qid in questions]
+                return list(questions.values())
+        return await self._run(query, readonly=True)
+
+    async def join_live_attempt(self, user_id: int, quiz_id: int, seed: int, drawn: list[int]) -> None:
+        """
+        Points the user's unfinished attempt at the live room's seed and
+        questions, so submit_answer and finish_quiz accept the room's sampled
+        questions.
+        """
+        if not (await self._question_pool(quiz_id)).sampled:
+            return
+        shard = self._user_shard(user_id)
+        def query():
+            with self._write(shard) as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    INSERT INTO user_quizzes (user_id, quiz_id, seed, drawn) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id, quiz_id) DO UPDATE SET seed=excluded.seed, drawn=excluded.drawn
+                    WHERE completed=0
+                """, (user_id, quiz_id, seed, pack_ids(drawn)))
+                return cur.rowcount > 0
+        async with self.locks.user(user_id):
+            if await self._run(query, shard=shard):
+                self.progress.quiz(user_id, quiz_id, seed=seed, drawn=drawn)
+
+    # ------------------------
+    # Question analytics
+    # ------------------------
+    def apply_question_stats(self, answers) -> None:
+        """
+        Adds a batch of answers from the stats aggregator in one transaction,
+        leaving out those the last recompute already counted (ids up to the
+        shard's stats_marks row). Raises on failure so the aggregator keeps
+        the batch for a retry.
+        """
+        with self._write() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT shard, answer_id FROM stats_marks WHERE shards=?", (self.user_shards,))
+            marks = dict(cur.fetchall())
+            attempts, correct, selections = Counter(), Counter(), Counter()
+            for shard, answer_id, qid, oid, is_correct in answers:
+                if answer_id <= marks.get(shard, 0):
+                    continue
+                attempts[qid] += 1
+                if is_correct:
+                    correct[qid] += 1
+                if oid is not None:
+                    selections[(qid, oid)] += 1
+            cur.executemany("""
+                INSERT INTO question_stats (question_id, attempts, correct)
+                VALUES (?, ?, ?)
+                ON CONFLICT(question_id) DO UPDATE SET
+                    attempts=question_stats.attempts + excluded.attempts,
+                    correct=question_stats.correct + excluded.correct
+            """, [(qid, n, correct[qid]) for qid, n in attempts.items()])
+            cur.executemany("""
+                INSERT INTO option_stats (option_id, question_id, selections)
+                VALUES (?, ?, ?)
+                ON CONFLICT(option_id) DO UPDATE SET
+                    selections=option_stats.selections + excluded.selections
+            """, [(oid, qid, n) for (qid, oid), n in selections.items()])
+
+    async def get_question_stats(self, quiz_id: int) -> list[dict]:
+        """
+        Per-question counters for a quiz:
+        attempts, correct answers and how often each option was picked.
+        Counts written by the aggregator lag by up to a few seconds.
+        """
+        def query():
+            with self._connect(readonly=True) as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT q.id, q.question_text, q.correct_option_id,
+                           COALESCE(s.attempts, 0), COALESCE(s.correct, 0)
+                    FROM questions q
+                    LEFT JOIN question_stats s ON s.question_id = q.id
+                    WHERE q.quiz_id=?
+                """, (quiz_id,))
+                questions = {}
+                for qid, text, correct_id, attempts, correct in cur.fetchall():
+                    questions[qid] = {
+                        "id": qid,
+                        "text": text,
+                        "attempts": attempts,
+                        "correct": correct,
+                        "correct_rate": round(correct / attempts, 3) if attempts else None,
+                        "correct_option_id": correct_id,
+                        "options": []
+                    }
+                cur.execute("""
+                    SELECT o.id, o.question_id, o.option_text, COALESCE(os.selections, 0)
+                    FROM question_options o
+                    JOIN questions q ON q.id = o.question_id
+                    LEFT JOIN option_stats os ON os.option_id = o.id
+                    WHERE q.quiz_id=?
+                """, (quiz_id,))
+                for oid, qid, text, selections in cur.fetchall():
+                    attempts = questions[qid]["attempts"]
+                    questions[qid]["options"].append({
+                        "id": oid,
+                        "text": text,
+                        "selections": selections,
+                        "share": round(selections / attempts, 3) if attempts else None
+                    })
+                return list(questions.values())
+        return await self._run(query, readonly=True)
 
+    async def recompute_question_stats(self) -> dict:
+        """
+        Rebuilds question_stats and option_stats from user_answers
+        (all shards), for backfill or after a manual data fix.
 
+        One write transaction on db_path, which holds off every aggregator
+        flush (of any worker) while it runs: each shard's answers are counted
+        up to the newest id, and that id is stored in stats_marks so later
+        flushes skip the answers already counted here.
+        """
+        def query():
+            with self._write() as conn:
+                cur = conn.cursor()
+                attempts, correct, selections, marks = Counter(), Counter(), {}, {}
+                for shard in range(self.user_shards):
+                    target = self._target(shard)
+                    # with a single shard user_answers is in db_path: read it in this transaction
+                    source = conn if target is None else self._open(target, readonly=True)
+                    try:
+                        src = source.cursor()
+                        src.execute("SELECT COALESCE(MAX(id), 0) FROM user_answers")
+                        marks[shard] = src.fetchone()[0]
+                        src.execute("""
+                            SELECT question_id, selected_option_id, SUM(is_correct), COUNT(*)
+                            FROM user_answers
+                            WHERE id <= ?
+                            GROUP BY question_id, selected_option_id
+                        """, (marks[shard],))
+                        rows = src.fetchall()
+                    finally:
+                        if source is not conn:
+                            source.close()
+                    for qid, oid, n_correct, n in rows:
+                        attempts[qid] += n
+                        correct[qid] += n_correct or 0
+                        if oid is not None:
+                            selections[oid] = (qid, selections.get(oid, (qid, 0))[1] + n)
+                cur.execute("DELETE FROM question_stats")
+                cur.execute("DELETE FROM option_stats")
+                cur.execute("DELETE FROM stats_marks")
+                cur.executemany(
+                    "INSERT INTO question_stats (question_id, attempts, correct) VALUES (?, ?, ?)",
+                    [(qid, n, correct[qid]) for qid, n in attempts.items()]
+                )
+                cur.executemany(
+                    "INSERT INTO option_stats (option_id, question_id, selections) VALUES (?, ?, ?)",
+                    [(oid, qid, n) for oid, (qid, n) in selections.items()]
+                )
+                cur.executemany(
+                    "INSERT INTO stats_marks (shard, answer_id, shards) VALUES (?, ?, ?)",
+                    [(shard, answer_id, self.user_shards) for shard, answer_id in marks.items()]
+                )
+            return {"ok": True, "questions": len(attempts), "options": len(selections)}
+        return await self._run(query)
 
     # ------------------------
     # Periodic refill: every 4 hours refill user stars up to REFILL_TARGET
@@ -999,51 +3068,136 @@ class DatabaseManager:
             """
             For each user: if stars < REFILL_TARGET -> set stars = REFILL_TARGET
             Also update last_star_refill timestamp.
-            Use db_lock to serialize writes.
+            Runs shard by shard, one write transaction each, with a
+            "refill" wallet_ledger row per refilled user.
+            Refilled users get a "refill" event.
             """
             try:
                 now_ts = int(datetime.now(timezone.utc).timestamp())
-                with self.db_lock, sqlite3.connect(self.DBpath, timeout=5) as conn:
-                    cur = conn.cursor()
-                    cur.execute("SELECT id, stars FROM users")
-                    users = cur.fetchall()
-                    for (uid, stars) in users:
-                        if stars < REFILL_TARGET:
-                            cur.execute("UPDATE users SET stars=?, last_star_refill=? WHERE id=?", (REFILL_TARGET, now_ts, uid))
-                    conn.commit()
+                for shard in range(self.user_shards):
+                    refilled = []
+                    with self._write(shard) as conn:
+                        cur = conn.cursor()
+                        # ledger rows first, while the old balances are still there
+                        cur.execute("""
+                            INSERT INTO wallet_ledger (user_id, stars, reason, created_at)
+                            SELECT id, ? - stars, 'refill', ? FROM users WHERE stars < ?
+                            RETURNING user_id, stars
+                        """, (REFILL_TARGET, now_ts, REFILL_TARGET))
+                        for uid, delta in cur.fetchall():
+                            refilled.append((uid, {
+                                "type": "refill",
+                                "stars_delta": delta,
+                                "stars": REFILL_TARGET,
+                            }))
+                        cur.execute(
+                            "UPDATE users SET stars=?, last_star_refill=? WHERE stars < ?",
+                            (REFILL_TARGET, now_ts, REFILL_TARGET)
+                        )
+                        conn.commit()
+                    # not under the users' locks: a write-through of an answer committed
+                    # just before could still land after a set value, so drop them instead
+                    self.progress.invalidate([uid for uid, _ in refilled])
+                    self.events.publish_many(refilled)
                 return True
             except Exception as e:
                 print("DB ERROR refill_stars:", e)
                 return False
 
+    # ------------------------
+    # Scheduler: leader lease and job metrics (called from the scheduler thread)
+    # ------------------------
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Takes or renews the lease `name` for `owner`.
+        Succeeds if the lease is free, expired, or already held by `owner`.
+        """
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    INSERT INTO scheduler_leases (name, owner, expires_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        owner=excluded.owner,
+                        expires_at=excluded.expires_at
+                    WHERE scheduler_leases.owner=excluded.owner
+                       OR scheduler_leases.expires_at < ?
+                """, (name, owner, now + ttl, now))
+                acquired = cur.rowcount > 0
+                conn.commit()
+                return acquired
+        except Exception as e:
+            print("DB ERROR acquire_lease:", e)
+            return False
+
+    def release_lease(self, name: str, owner: str) -> None:
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "DELETE FROM scheduler_leases WHERE name=? AND owner=?",
+                    (name, owner)
+                )
+                conn.commit()
+        except Exception as e:
+            print("DB ERROR release_lease:", e)
+
+    def record_job_run(self, name: str, started_at: float, duration: float, ok: bool, error: str | None) -> None:
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    INSERT INTO scheduler_jobs
+                    (name, last_started_at, last_duration_ms, last_status, last_error, runs, failures)
+                    VALUES (?, ?, ?, ?, ?, 1, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        last_started_at=excluded.last_started_at,
+                        last_duration_ms=excluded.last_duration_ms,
+                        last_status=excluded.last_status,
+                        last_error=excluded.last_error,
+                        runs=scheduler_jobs.runs + 1,
+                        failures=scheduler_jobs.failures + excluded.failures
+                """, (name, started_at, int(duration * 1000), "ok" if ok else "failed", error, 0 if ok else 1))
+                conn.commit()
+        except Exception as e:
+            print("DB ERROR record_job_run:", e)
+
+    def get_job_runs(self) -> list[dict]:
+        try:
+            with self._connect() as conn:
+                cur = conn.cursor()
+                cur.row_factory = sqlite3.Row
+                rows = cur.execute("SELECT * FROM scheduler_jobs").fetchall()
+                return [dict(r) for r in rows]
+        except Exception as e:
+            print("DB ERROR get_job_runs:", e)
+            return []
+
     # ------------------------
     # Write subjects/quizzes/questions/options
     # ------------------------
     async def get_all_subjects(self):
-        loop = asyncio.get_running_loop()
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True) as conn:
                 cur = conn.cursor()
                 cur.execute("SELECT id, title FROM subjects")
                 return cur.fetchall()
-        return await loop.run_in_executor(None, query)
+        return await self.flights.run(("subjects",), lambda: self._run(query, readonly=True))
 
     async def get_quizzes_by_subject(self, subject_id: int):
-        loop = asyncio.get_running_loop()
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True) as conn:
                 cur = conn.cursor()
                 cur.execute(
-                    "SELECT id, title, gems_reward FROM quizzes WHERE subject_id=?",
+                    "SELECT id, title, gems_reward, sample_size FROM quizzes WHERE subject_id=?",
                     (subject_id,)
                 )
                 return cur.fetchall()
-        return await loop.run_in_executor(None, query)
+        return await self.flights.run(("quizzes", subject_id), lambda: self._run(query, readonly=True))
 
     async def get_questions_by_quiz(self, quiz_id: int):
-        loop = asyncio.get_running_loop()
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True) as conn:
                 cur = conn.cursor()
                 cur.execute(
                     "SELECT id, question_text, question_type, stars_reward, correct_option_id "
@@ -1073,22 +3227,473 @@ class DatabaseManager:
                         "correct_option_index": correct_index
                     })
                 return result
-        return await loop.run_in_executor(None, query)
+        return await self.flights.run(("questions", quiz_id), lambda: self._run(query, readonly=True))
+
+    async def search_questions(self, text: str, page: int = 1, page_size: int = SEARCH_PAGE_SIZE) -> dict:
+        """
+        Full-text search over question and option text, best matches first
+        (bm25, question text weighted over options), one page at a time.
+        Matches are wrapped in [ ] in the returned text.
+        """
+        match = _fts_query(text)
+        if not match:
+            return {"ok": True, "total": 0, "results": []}
+        def query():
+            try:
+                with self._connect(readonly=True) as conn:
+                    cur = conn.cursor()
+                    cur.execute("SELECT count(*) FROM question_search WHERE question_search MATCH ?", (match,))
+                    total = cur.fetchone()[0]
+                    cur.execute("""
+                        SELECT s.rowid, q.quiz_id, qu.title,
+                               highlight(question_search, 0, '[', ']'),
+                               snippet(question_search, 1, '[', ']', '...', 12),
+                               bm25(question_search, 2.0, 1.0) AS rank
+                        FROM question_search s
+                        JOIN questions q ON q.id = s.rowid
+                        LEFT JOIN quizzes qu ON qu.id = q.quiz_id
+                        WHERE question_search MATCH ?
+                        ORDER BY rank
+                        LIMIT ? OFFSET ?
+                    """, (match, page_size, (page - 1) * page_size))
+                    results = [
+                        {
+                            "id": qid,
+                            "quiz_id": quiz_id,
+                            "quiz_title": quiz_title,
+                            "text": text,
+                            "options": options,
+                            "score": round(-rank, 4),
+                        }
+                        for qid, quiz_id, quiz_title, text, options, rank in cur.fetchall()
+                    ]
+                    return {"ok": True, "total": total, "results": results}
+            except sqlite3.OperationalError as e:
+                print("DB ERROR search_questions:", e)
+                return {"ok": False, "error": "search_unavailable"}
+        return await self._run(query, readonly=True)
+
+    def _ids_by_external_id(self, cur, table: str, keys) -> dict:
+        keys = list(keys)
+        if not keys:
+            return {}
+        cur.execute(
+            f"SELECT external_id, id FROM {table} WHERE external_id IN ({','.join('?' * len(keys))})",
+            keys
+        )
+        return dict(cur.fetchall())
+
+    def _upsert_by_external_id(self, cur, table: str, rows: dict, adopt_sql: str, insert_sql: str,
+                               update_sql: str) -> dict:
+        """
+        Ids of `rows` ({external_id: named params}) in subjects or quizzes,
+        creating missing ones. The statements take :ext plus the params. A
+        row made by hand (no external_id) with the same title is adopted
+        instead of duplicated.
+        """
+        params = [{"ext": ext, **values} for ext, values in rows.items()]
+        ids = self._ids_by_external_id(cur, table, rows)
+        missing = [p for p in params if p["ext"] not in ids]
+        if missing:
+            cur.executemany(adopt_sql, missing)
+            ids.update(self._ids_by_external_id(cur, table, (p["ext"] for p in missing)))
+            missing = [p for p in missing if p["ext"] not in ids]
+            cur.executemany(insert_sql, missing)
+            ids.update(self._ids_by_external_id(cur, table, (p["ext"] for p in missing)))
+        cur.executemany(update_sql, params)
+        return ids
+
+    async def import_questions(self, rows: list[dict], on_duplicate: str = "flag") -> dict:
+        """
+        Inserts or updates one chunk of parsed import rows (see importer.parse_row)
+        in a single transaction, with executemany per statement kind.
+
+        Questions are matched on external_id: a known one is updated in place
+        (options are rewritten by position, so option ids of answered questions
+        survive), a new one is checked for near-duplicates per on_duplicate,
+        against the bank and against earlier rows of the upload.
+
+        Returns {"ok": True, "inserted", "updated", "flagged", "rejected",
+        "errors"}; the last three list (row index, ...) entries, duplicates
+        as question ids. On a database error the whole chunk is rolled back:
+        {"ok": False, "error": "db_error"}.
+        """
+        if on_duplicate not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate policy '{on_duplicate}'")
+        def query():
+            result = {"ok": True, "inserted": 0, "updated": 0, "flagged": [], "rejected": [], "errors": []}
+            try:
+                with self._connect() as conn:
+                    cur = conn.cursor()
+
+                    # a row repeating an external_id of this chunk is reported, not applied twice
+                    accepted, seen = [], set()
+                    for index, row in enumerate(rows):
+                        if row["external_id"] in seen:
+                            result["errors"].append((index, "external_id repeated in the same chunk"))
+                            continue
+                        seen.add(row["external_id"])
+                        accepted.append((index, row))
+
+                    subjects = self._upsert_by_external_id(
+                        cur, "subjects",
+                        {row["subject_external_id"]: {"title": row["subject"]} for _, row in accepted},
+                        "UPDATE subjects SET external_id=:ext WHERE id = "
+                        "(SELECT MIN(id) FROM subjects WHERE external_id IS NULL AND title=:title)",
+                        "INSERT INTO subjects (title, external_id) VALUES (:title, :ext)",
+                        "UPDATE subjects SET title=:title WHERE external_id=:ext",
+                    )
+                    quizzes = self._upsert_by_external_id(
+                        cur, "quizzes",
+                        {
+                            row["quiz_external_id"]: {
+                                "subject_id": subjects[row["subject_external_id"]],
+                                "title": row["quiz"],
+                                "gems_reward": row["gems_reward"],
+                            }
+                            for _, row in accepted
+                        },
+                        "UPDATE quizzes SET external_id=:ext WHERE id = (SELECT MIN(id) FROM quizzes "
+                        "WHERE external_id IS NULL AND subject_id=:subject_id AND title=:title)",
+                        "INSERT INTO quizzes (subject_id, title, gems_reward, external_id) "
+                        "VALUES (:subject_id, :title, COALESCE(:gems_reward, 0), :ext)",
+                        "UPDATE quizzes SET subject_id=:subject_id, title=:title, "
+                        "gems_reward=COALESCE(:gems_reward, gems_reward) WHERE external_id=:ext",
+                    )
+
+                    ids = self._ids_by_external_id(cur, "questions", seen)
+                    signatures = {}
+                    new_rows, updated_rows, duplicates = [], [], []
+                    upload_buckets = {}  # (band, bucket) -> index of an earlier new row
+                    for index, row in accepted:
+                        sig = signatures[index] = dedup.signature(row["text"], row["options"])
+                        if row["external_id"] in ids:
+                            updated_rows.append((index, row))
+                            continue
+                        if on_duplicate != "allow":
+                            keys = dedup.bands(sig)
+                            in_bank = [qid for qid, _ in self._question_duplicates(cur, sig)]
+                            in_upload = sorted({
+                                upload_buckets[k] for k in keys if k in upload_buckets
+                                if dedup.similarity(sig, signatures[upload_buckets[k]]) >= dedup.DUPLICATE_THRESHOLD
+                            })
+                            if in_bank or in_upload:
+                                if on_duplicate == "reject":
+                                    result["rejected"].append((index, in_bank, in_upload))
+                                    continue
+                                duplicates.append((index, in_bank, in_upload))
+                            for k in keys:
+                                upload_buckets.setdefault(k, index)
+                        new_rows.append((index, row))
+
+                    cur.executemany(
+                        "INSERT INTO questions (quiz_id, question_text, question_type, stars_reward, external_id) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(quizzes[r["quiz_external_id"]], r["text"], r["type"], r["stars"], r["external_id"])
+                         for _, r in new_rows]
+                    )
+                    cur.executemany(
+                        "UPDATE questions SET quiz_id=?, question_text=?, question_type=?, stars_reward=? WHERE id=?",
+                        [(quizzes[r["quiz_external_id"]], r["text"], r["type"], r["stars"], ids[r["external_id"]])
+                         for _, r in updated_rows]
+                    )
+                    ids.update(self._ids_by_external_id(cur, "questions", (r["external_id"] for _, r in new_rows)))
+
+                    # options, rewritten by position
+                    applied = new_rows + updated_rows
+                    question_ids = [ids[r["external_id"]] for _, r in applied]
+                    def current_options():
+                        options = {qid: [] for qid in question_ids}
+                        if question_ids:
+                            cur.execute(
+                                f"SELECT question_id, id FROM question_options "
+                                f"WHERE question_id IN ({','.join('?' * len(question_ids))}) ORDER BY id",
+                                question_ids
+                            )
+                            for qid, oid in cur.fetchall():
+                                options[qid].append(oid)
+                        return options
+                    options = current_options()
+                    renamed, added, removed = [], [], []
+                    for _, row in applied:
+                        qid = ids[row["external_id"]]
+                        old = options[qid]
+                        renamed += [(text, oid) for oid, text in zip(old, row["options"])]
+                        added += [(qid, text) for text in row["options"][len(old):]]
+                        removed += old[len(row["options"]):]
+                    cur.executemany("UPDATE question_options SET option_text=? WHERE id=?", renamed)
+                    cur.executemany("INSERT INTO question_options (question_id, option_text) VALUES (?, ?)", added)
+                    self._remove_options(cur, removed)
+                    options = current_options()
+                    cur.executemany(
+                        "UPDATE questions SET correct_option_id=? WHERE id=?",
+                        [(options[ids[r["external_id"]]][r["correct"]], ids[r["external_id"]]) for _, r in applied]
+                    )
+
+                    # near-duplicate index
+                    cur.executemany(
+                        "INSERT OR REPLACE INTO question_signatures (question_id, signature) VALUES (?, ?)",
+                        [(ids[r["external_id"]], dedup.to_blob(signatures[i])) for i, r in applied]
+                    )
+                    cur.executemany(
+                        "DELETE FROM question_lsh WHERE question_id=?",
+                        [(ids[r["external_id"]],) for _, r in updated_rows]
+                    )
+                    cur.executemany(
+                        "INSERT INTO question_lsh (band, bucket, question_id) VALUES (?, ?, ?)",
+                        [(band, bucket, ids[r["external_id"]])
+                         for i, r in applied for band, bucket in dedup.bands(signatures[i])]
+                    )
+                    conn.commit()
+
+                    # duplicates within the upload point at the ids their earlier rows got
+                    def as_ids(in_bank, in_upload):
+                        return in_bank + [ids[rows[other]["external_id"]] for other in in_upload]
+                    result["flagged"] = [(i, as_ids(b, u)) for i, b, u in duplicates]
+                    result["rejected"] = [(i, as_ids(b, u)) for i, b, u in result["rejected"]]
+                    result["inserted"] = len(new_rows)
+                    result["updated"] = len(updated_rows)
+                    return result
+            except Exception as e:
+                print("DB ERROR import_questions:", e)
+                return {"ok": False, "error": "db_error"}
+        result = await self._run(query)
+        self._invalidate_question_pools()
+        return result
+
+    async def get_duplicate_clusters(self, limit: int = 50) -> list[dict]:
+        """
+        Groups of near-duplicate questions already in the bank, largest first.
+        Candidate pairs come from shared LSH buckets and are kept when their
+        estimated similarity reaches DUPLICATE_THRESHOLD.
+        """
+        def query():
+            with self._connect(readonly=True) as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT group_concat(question_id)
+                    FROM question_lsh
+                    GROUP BY band, bucket
+                    HAVING count(*) > 1
+                """)
+                groups = {tuple(sorted(int(i) for i in row[0].split(","))) for row in cur.fetchall()}
+                ids = {qid for group in groups for qid in group}
+                if not ids:
+                    return []
+                signatures = {}
+                for chunk in range(0, len(ids), 500):
+                    part = list(ids)[chunk:chunk + 500]
+                    cur.execute(
+                        f"SELECT question_id, signature FROM question_signatures "
+                        f"WHERE question_id IN ({','.join('?' * len(part))})", part
+                    )
+                    signatures.update((qid, dedup.from_blob(blob)) for qid, blob in cur.fetchall())
+
+                # union-find over the verified pairs
+                parent = {}
+                def find(x):
+                    while parent.get(x, x) != x:
+                        x = parent[x]
+                    return x
+                checked = set()
+                linked = set()
+                for group in groups:
+                    for i, a in enumerate(group):
+                        for b in group[i + 1:]:
+                            if (a, b) in checked or a not in signatures or b not in signatures:
+                                continue
+                            checked.add((a, b))
+                            if dedup.similarity(signatures[a], signatures[b]) >= dedup.DUPLICATE_THRESHOLD:
+                                parent[find(a)] = find(b)
+                                linked.update((a, b))
+
+                clusters = {}
+                for qid in linked:
+                    clusters.setdefault(find(qid), []).append(qid)
+                largest = sorted(clusters.values(), key=lambda c: (-len(c), min(c)))[:limit]
+                described = self._describe_questions(cur, [qid for c in largest for qid in c])
+                return [
+                    {"size": len(c), "questions": [described[qid] for qid in sorted(c) if qid in described]}
+                    for c in largest
+                ]
+        return await self._run(query, readonly=True)
+
+    async def export_columns(self, table: str) -> list[str]:
+        """
+        Column names of an export, in order. Questions are exported in the
+        import format (see importer.parse_row), with one optionN column per
+        option of the question that has the most.
+        """
+        if table in EXPORT_USER_TABLES:
+            return list(EXPORT_USER_TABLES[table][0])
+
+        def query():
+            with self._connect(readonly=True) as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM question_options GROUP BY question_id)
+                """)
+                return cur.fetchone()[0] or 0
+
+        options = await self._run(query, readonly=True)
+        return (["id", "external_id", "subject_external_id", "subject", "quiz_external_id", "quiz",
+                 "question", "type"]
+                + [f"option{i}" for i in range(1, options + 1)]
+                + ["correct", "stars"])
+
+    async def export_rows(self, table: str, subject_id: int | None = None, quiz_id: int | None = None,
+                          since: int | None = None, until: int | None = None,
+                          batch_size: int = EXPORT_BATCH_SIZE):
+        """
+        Async generator of row batches (lists of dicts) of an export table,
+        for streaming dumps of any size.
+
+        Every batch is its own short read on the read pool, continuing after
+        the last key of the previous one (keyset pagination), so memory stays
+        at one batch and no read transaction is held open for the whole dump.
+        Filters map to index ranges: quiz_id on idx_questions_quiz and the
+        (quiz_id, time) indexes, since/until (unix seconds, until exclusive)
+        on the time indexes of the user tables; a subject is walked quiz by
+        quiz. User tables are read shard by shard.
+        """
+        quiz_ids = [None]
+        if subject_id is not None:
+            quizzes = await self.get_quizzes_by_subject(subject_id)
+            quiz_ids = [q[0] for q in quizzes if quiz_id is None or q[0] == quiz_id]
+        elif quiz_id is not None:
+            quiz_ids = [quiz_id]
+
+        if table == "questions":
+            for qid in quiz_ids:
+                async for batch in self._export_scan(
+                    None, self._export_question_page,
+                    "q.quiz_id = ?" if qid is not None else "1",
+                    (qid,) if qid is not None else (), batch_size
+                ):
+                    yield batch
+            return
+
+        columns, time_column = EXPORT_USER_TABLES[table]
+        select = f"SELECT {', '.join(columns)} FROM {table}"
+        for shard in range(self.user_shards):
+            for qid in quiz_ids:
+                where, params = [], []
+                if qid is not None:
+                    where.append("quiz_id = ?")
+                    params.append(qid)
+                if since is not None:
+                    where.append(f"{time_column} >= ?")
+                    params.append(since)
+                if until is not None:
+                    where.append(f"{time_column} < ?")
+                    params.append(until)
+                if not where:
+                    scans = [("1", "id")]
+                elif since is not None or until is not None:
+                    scans = [(" AND ".join(where), time_column)]
+                else:
+                    # quiz only: rows without a timestamp first, then the rest in time order
+                    scans = [(f"{where[0]} AND {time_column} IS NULL", "id"),
+                             (f"{where[0]} AND {time_column} IS NOT NULL", time_column)]
+                for scan_where, order in scans:
+                    page = self._export_user_page(select, columns, order)
+                    async for batch in self._export_scan(shard, page, scan_where, params, batch_size):
+                        yield batch
+
+    async def _export_scan(self, shard, page, where, params, batch_size):
+        after = None
+        while True:
+            rows, after = await self._run(
+                lambda: page(shard, where, params, after, batch_size), readonly=True, shard=shard
+            )
+            if rows:
+                yield rows
+            if len(rows) < batch_size:
+                return
+
+    def _export_user_page(self, select, columns, order):
+        """One keyset page of a user table, ordered by id or by (order, id)."""
+        def page(shard, where, params, after, limit):
+            with self._connect(readonly=True, shard=shard) as conn:
+                cur = conn.cursor()
+                if order == "id":
+                    keyset, keys = ("id > ?", (after,)) if after is not None else ("1", ())
+                    order_by = "id"
+                else:
+                    keyset, keys = (f"({order}, id) > (?, ?)", after) if after is not None else ("1", ())
+                    order_by = f"{order}, id"
+                cur.execute(
+                    f"{select} WHERE {where} AND {keyset} ORDER BY {order_by} LIMIT ?",
+                    (*params, *keys, limit)
+                )
+                rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+            if not rows:
+                return rows, after
+            last = rows[-1]
+            return rows, last["id"] if order == "id" else (last[order], last["id"])
+        return page
+
+    def _export_question_page(self, shard, where, params, after, limit):
+        """One page of questions in id order, with options and the correct index."""
+        with self._connect(readonly=True) as conn:
+            cur = conn.cursor()
+            keyset, keys = ("q.id > ?", (after,)) if after is not None else ("1", ())
+            cur.execute(f"""
+                SELECT q.id, q.external_id, s.external_id, s.title, z.external_id, z.title,
+                       q.question_text, q.question_type, q.correct_option_id, q.stars_reward
+                FROM questions q
+                JOIN quizzes z ON z.id = q.quiz_id
+                JOIN subjects s ON s.id = z.subject_id
+                WHERE {where} AND {keyset}
+                ORDER BY q.id
+                LIMIT ?
+            """, (*params, *keys, limit))
+            questions = cur.fetchall()
+            if not questions:
+                return [], after
+            options = {}
+            ids = [q[0] for q in questions]
+            cur.execute(f"""
+                SELECT question_id, id, option_text FROM question_options
+                WHERE question_id IN ({','.join('?' * len(ids))})
+                ORDER BY question_id, id
+            """, ids)
+            for question_id, option_id, text in cur.fetchall():
+                options.setdefault(question_id, []).append((option_id, text))
+
+        rows = []
+        for qid, ext, subject_ext, subject, quiz_ext, quiz, text, qtype, correct_id, stars in questions:
+            opts = options.get(qid, [])
+            option_ids = [o[0] for o in opts]
+            rows.append({
+                "id": qid,
+                "external_id": ext,
+                "subject_external_id": subject_ext,
+                "subject": subject,
+                "quiz_external_id": quiz_ext,
+                "quiz": quiz,
+                "question": text,
+                "type": qtype,
+                "options": [o[1] for o in opts],
+                "correct": option_ids.index(correct_id) if correct_id in option_ids else None,
+                "stars": stars,
+            })
+        return rows, questions[-1][0]
 
     async def add_subject(self, title: str) -> int:
-        loop = asyncio.get_running_loop()
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute("INSERT INTO subjects (title) VALUES (?)", (title,))
                 conn.commit()
                 return cur.lastrowid
-        return await loop.run_in_executor(None, query)
+        subject_id = await self._run(query)
+        self.flights.forget()
+        return subject_id
 
     async def update_subject(self, subject_id: int, title: str) -> bool:
-        loop = asyncio.get_running_loop()
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute(
                     "UPDATE subjects SET title=? WHERE id=?",
@@ -1096,46 +3701,80 @@ class DatabaseManager:
                 )
                 conn.commit()
                 return cur.rowcount > 0
-        return await loop.run_in_executor(None, query)
+        updated = await self._run(query)
+        self.flights.forget()
+        return updated
 
-    async def add_quiz(self, subject_id: int, title: str, gems_reward: int) -> int:
-        loop = asyncio.get_running_loop()
+    async def add_quiz(self, subject_id: int, title: str, gems_reward: int, sample_size: int = 0) -> int | None:
+        """Returns the new quiz id, or None if the subject does not exist."""
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
+                # checked in the statement itself: foreign keys are only enforced in single-file mode
                 cur.execute(
-                    "INSERT INTO quizzes (subject_id, title, gems_reward) VALUES (?, ?, ?)",
-                    (subject_id, title, gems_reward)
+                    "INSERT INTO quizzes (subject_id, title, gems_reward, sample_size) "
+                    "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM subjects WHERE id=?)",
+                    (subject_id, title, gems_reward, sample_size, subject_id)
                 )
+                if cur.rowcount == 0:
+                    return None
                 conn.commit()
                 return cur.lastrowid
-        return await loop.run_in_executor(None, query)
+        quiz_id = await self._run(query)
+        self.flights.forget()
+        return quiz_id
 
-    async def update_quiz(self, quiz_id: int, title: str, gems_reward: int) -> bool:
-        loop = asyncio.get_running_loop()
+    async def update_quiz(self, quiz_id: int, title: str, gems_reward: int, sample_size: int | None = None) -> bool:
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
                 cur.execute(
-                    "UPDATE quizzes SET title=?, gems_reward=? WHERE id=?",
-                    (title, gems_reward, quiz_id)
+                    "UPDATE quizzes SET title=?, gems_reward=?, sample_size=COALESCE(?, sample_size) WHERE id=?",
+                    (title, gems_reward, sample_size, quiz_id)
                 )
                 conn.commit()
                 return cur.rowcount > 0
-        return await loop.run_in_executor(None, query)
+        updated = await self._run(query)
+        self._invalidate_question_pools(quiz_id)
+        return updated
 
     async def add_question(self, quiz_id: int, question_text: str, qtype: str,
                            options: list, correct_option_index: int,
-                           stars_reward: int) -> int:
-        loop = asyncio.get_running_loop()
+                           stars_reward: int, on_duplicate: str = "flag") -> dict:
+        """
+        Adds a question and its options.
+
+        Near-duplicates of questions already in the bank (any quiz) are
+        looked up by MinHash/LSH first. on_duplicate:
+            "flag"   - add it anyway and list the duplicates in the result
+            "reject" - do not add it: {"ok": False, "error": "duplicate", ...}
+            "allow"  - add it without looking
+        Returns {"ok": True, "id": int, "duplicates": [...]}, or
+        {"ok": False, "error": "quiz_not_found"}.
+        """
+        if on_duplicate not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate policy '{on_duplicate}'")
+        sig = dedup.signature(question_text, options)
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
+                duplicates = []
+                if on_duplicate != "allow":
+                    found = self._question_duplicates(cur, sig)
+                    described = self._describe_questions(cur, [qid for qid, _ in found])
+                    duplicates = [
+                        {**described[qid], "similarity": round(score, 2)}
+                        for qid, score in found if qid in described
+                    ]
+                    if duplicates and on_duplicate == "reject":
+                        return {"ok": False, "error": "duplicate", "duplicates": duplicates}
                 cur.execute(
                     "INSERT INTO questions (quiz_id, question_text, question_type, stars_reward) "
-                    "VALUES (?, ?, ?, ?)",
-                    (quiz_id, question_text, qtype, stars_reward)
+                    "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM quizzes WHERE id=?)",
+                    (quiz_id, question_text, qtype, stars_reward, quiz_id)
                 )
+                if cur.rowcount == 0:
+                    return {"ok": False, "error": "quiz_not_found"}
                 question_id = cur.lastrowid
                 option_ids = []
                 for opt in options:
@@ -1149,14 +3788,17 @@ class DatabaseManager:
                         "UPDATE questions SET correct_option_id=? WHERE id=?",
                         (option_ids[correct_option_index], question_id)
                     )
+                self._index_question(cur, question_id, sig)
                 conn.commit()
-                return question_id
-        return await loop.run_in_executor(None, query)
+                return {"ok": True, "id": question_id, "duplicates": duplicates}
+        result = await self._run(query)
+        if result["ok"]:
+            self._invalidate_question_pools(quiz_id)
+        return result
 
     async def get_question_by_id(self, question_id: int):
-        loop = asyncio.get_running_loop()
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True) as conn:
                 cur = conn.cursor()
                 cur.execute(
                     "SELECT id, quiz_id, question_text, question_type, stars_reward, correct_option_id "
@@ -1189,7 +3831,7 @@ class DatabaseManager:
                     "options": options,
                     "correct_option_index": correct_index
                 }
-        return await loop.run_in_executor(None, query)
+        return await self._run(query, readonly=True)
     
     async def update_question(
         self,
@@ -1200,10 +3842,8 @@ class DatabaseManager:
         correct_option_index: int,
         stars_reward: int
     ) -> bool:
-        loop = asyncio.get_running_loop()
-
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect() as conn:
                 cur = conn.cursor()
 
                 cur.execute(
@@ -1213,90 +3853,227 @@ class DatabaseManager:
                 if cur.rowcount == 0:
                     return False  
 
-                
-                cur.execute("DELETE FROM question_options WHERE question_id=?", (question_id,))
-
-                correct_option_id = None
-                for idx, opt_text in enumerate(options):
+                # rewritten by position, so answers keep pointing at their option
+                cur.execute("SELECT id FROM question_options WHERE question_id=? ORDER BY id", (question_id,))
+                option_ids = [row[0] for row in cur.fetchall()]
+                cur.executemany(
+                    "UPDATE question_options SET option_text=? WHERE id=?",
+                    list(zip(options, option_ids))
+                )
+                self._remove_options(cur, option_ids[len(options):])
+                del option_ids[len(options):]
+                for opt_text in options[len(option_ids):]:
                     cur.execute(
                         "INSERT INTO question_options (question_id, option_text) VALUES (?, ?)",
                         (question_id, opt_text)
                     )
-                    option_id = cur.lastrowid
-                    if idx == correct_option_index:
-                        correct_option_id = option_id
+                    option_ids.append(cur.lastrowid)
 
-                
+                correct_option_id = None
+                if 0 <= correct_option_index < len(option_ids):
+                    correct_option_id = option_ids[correct_option_index]
                 if correct_option_id is not None:
                     cur.execute(
                         "UPDATE questions SET correct_option_id=? WHERE id=?",
                         (correct_option_id, question_id)
                     )
 
+                self._index_question(cur, question_id, dedup.signature(question_text, options))
                 conn.commit()
                 return True
 
-        return await loop.run_in_executor(None, query)
+        updated = await self._run(query)
+        self.flights.forget()
+        return updated
 
 
     # ================= Subjects =================
     async def delete_subject(self, subject_id: int) -> bool:
-        loop = asyncio.get_running_loop()
-
-        def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
-                cur = conn.cursor()
-                cur.execute("DELETE FROM subjects WHERE id=?", (subject_id,))
-                conn.commit()
-                return cur.rowcount > 0
-
-        return await loop.run_in_executor(None, query)
+        deleted = await self._delete_cascade(subject_ids=[subject_id])
+        return deleted["subjects"] > 0
 
 
     # ================= Quizzes =================
     async def delete_quiz(self, quiz_id: int) -> bool:
-        await self.delete_questions_by_quiz(quiz_id)
-        loop = asyncio.get_running_loop()
-
-        def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
-                cur = conn.cursor()
-                cur.execute("DELETE FROM quizzes WHERE id=?", (quiz_id,))
-                conn.commit()
-                return cur.rowcount > 0
-
-        return await loop.run_in_executor(None, query)
+        deleted = await self._delete_cascade(quiz_ids=[quiz_id])
+        return deleted["quizzes"] > 0
 
 
     # ================= Questions =================
     async def delete_question(self, question_id: int) -> bool:
-        loop = asyncio.get_running_loop()
-
-        def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
-                cur = conn.cursor()
-                cur.execute("DELETE FROM questions WHERE id=?", (question_id,))
-                conn.commit()
-                return cur.rowcount > 0
-
-        return await loop.run_in_executor(None, query)
+        deleted = await self._delete_cascade(question_ids=[question_id])
+        return deleted["questions"] > 0
 
 
     async def delete_questions_by_quiz(self, quiz_id: int):
-        loop = asyncio.get_running_loop()
-
         def query():
-            with sqlite3.connect(self.DBpath, timeout=5) as conn:
+            with self._connect(readonly=True) as conn:
                 cur = conn.cursor()
-                cur.execute("DELETE FROM questions WHERE quiz_id=?", (quiz_id,))
-                conn.commit()
-                return True
-
-        return await loop.run_in_executor(None, query)
+                cur.execute("SELECT id FROM questions WHERE quiz_id=?", (quiz_id,))
+                return [row[0] for row in cur.fetchall()]
 
+        await self._delete_cascade(question_ids=await self._run(query, readonly=True))
+        return True
 
+    # ================= Cascading deletes =================
+    async def _delete_cascade(self, subject_ids=(), quiz_ids=(), question_ids=()) -> dict:
+        """
+        Deletes catalog rows with everything under them: quizzes, questions,
+        options, their stats and dedup rows, and the answers, attempts and
+        subject leaderboard rows of users. Returns deleted rows per table.
+
+        With all tables in one file this is one transaction, children first so
+        the foreign keys hold. With split or sharded files the catalog goes
+        first, then each shard; anything a failure leaves behind is an orphan
+        for collect_orphans.
+        """
+        def query():
+            try:
+                with self._connect() as conn:
+                    cur = conn.cursor()
+                    plan = self._cascade_plan(cur, subject_ids, quiz_ids, question_ids)
+                    deleted = {}
+                    if self.user_shards == 1:
+                        deleted.update(self._delete_user_rows(cur, plan))
+                    deleted.update(self._delete_catalog_rows(cur, plan))
+                    conn.commit()
+                    return plan, deleted
+            except Exception as e:
+                print("DB ERROR delete_cascade:", e)
+                return None, {"subjects": 0, "quizzes": 0, "questions": 0}
+
+        plan, deleted = await self._run(query)
+        if plan is not None and self.user_shards > 1:
+            def make_query(shard):
+                def query():
+                    with self._connect(shard=shard) as conn:
+                        cur = conn.cursor()
+                        counts = self._delete_user_rows(cur, plan)
+                        conn.commit()
+                        return counts
+                return query
+            for counts in await self._fan_out(make_query, readonly=False):
+                for table, n in counts.items():
+                    deleted[table] = deleted.get(table, 0) + n
+        self._invalidate_question_pools()
+        return deleted
+
+    def _cascade_plan(self, cur, subject_ids=(), quiz_ids=(), question_ids=(), option_ids=()) -> dict:
+        """Ids a delete takes with it, with the quiz of each question (answers are found by quiz)."""
+        quizzes = set(quiz_ids)
+        for subject_id in subject_ids:
+            cur.execute("SELECT id FROM quizzes WHERE subject_id=?", (subject_id,))
+            quizzes.update(row[0] for row in cur.fetchall())
+        questions = {}  # question id -> quiz id
+        for quiz_id in quizzes:
+            cur.execute("SELECT id FROM questions WHERE quiz_id=?", (quiz_id,))
+            questions.update((row[0], quiz_id) for row in cur.fetchall())
+        for question_id in question_ids:
+            if question_id not in questions:
+                cur.execute("SELECT quiz_id FROM questions WHERE id=?", (question_id,))
+                row = cur.fetchone()
+                if row:
+                    questions[question_id] = row[0]
+        options = set(option_ids)
+        for question_id in questions:
+            cur.execute("SELECT id FROM question_options WHERE question_id=?", (question_id,))
+            options.update(row[0] for row in cur.fetchall())
+        return {
+            "subjects": list(subject_ids),
+            "quizzes": list(quizzes),
+            "questions": questions,
+            "options": list(options),
+            "loose_options": list(option_ids),  # options whose question stays
+        }
 
+    def _delete_user_rows(self, cur, plan) -> dict:
+        quizzes = [(quiz_id,) for quiz_id in plan["quizzes"]]
+        deleted = {}
+        cur.executemany("DELETE FROM user_answers WHERE quiz_id=?", quizzes)
+        answers = cur.rowcount
+        cur.executemany(
+            "DELETE FROM user_answers WHERE quiz_id=? AND question_id=?",
+            [(quiz_id, question_id) for question_id, quiz_id in plan["questions"].items()
+             if quiz_id not in plan["quizzes"]]
+        )
+        deleted["user_answers"] = answers + cur.rowcount
+        cur.executemany("DELETE FROM user_quizzes WHERE quiz_id=?", quizzes)
+        deleted["user_quizzes"] = cur.rowcount
+        cur.executemany("DELETE FROM leaderboard WHERE subject_id=?", [(s,) for s in plan["subjects"]])
+        deleted["leaderboard"] = cur.rowcount
+        deleted["detached_answers"] = self._detach_answers(cur, plan["loose_options"])
+        return deleted
+
+    def _delete_catalog_rows(self, cur, plan) -> dict:
+        options = [(option_id,) for option_id in plan["options"]]
+        questions = [(question_id,) for question_id in plan["questions"]]
+        deleted = {}
+        cur.executemany("DELETE FROM option_stats WHERE option_id=?", options)
+        cur.executemany("DELETE FROM question_options WHERE id=?", options)
+        deleted["question_options"] = cur.rowcount
+        cur.executemany("DELETE FROM question_stats WHERE question_id=?", questions)
+        # search and dedup rows go with the question (triggers)
+        cur.executemany("DELETE FROM questions WHERE id=?", questions)
+        deleted["questions"] = cur.rowcount
+        cur.executemany("DELETE FROM quizzes WHERE id=?", [(q,) for q in plan["quizzes"]])
+        deleted["quizzes"] = cur.rowcount
+        cur.executemany("DELETE FROM subjects WHERE id=?", [(s,) for s in plan["subjects"]])
+        deleted["subjects"] = cur.rowcount
+        return deleted
+
+    def _detach_answers(self, cur, option_ids) -> int:
+        """
+        Clears selected_option_id of answers that picked one of these options.
+        There is no index on the column; it is only called when options are
+        dropped from a question that stays, which is rare.
+        """
+        detached = 0
+        option_ids = list(option_ids)
+        for chunk in range(0, len(option_ids), 500):
+            part = option_ids[chunk:chunk + 500]
+            cur.execute(
+                f"UPDATE user_answers SET selected_option_id=NULL "
+                f"WHERE selected_option_id IN ({','.join('?' * len(part))})", part
+            )
+            detached += cur.rowcount
+        return detached
 
+    def _remove_options(self, cur, option_ids) -> None:
+        """
+        Deletes options of a question that stays. With the user tables in
+        this file their answers are detached first; on shards the dangling
+        references are cleared by collect_orphans.
+        """
+        if not option_ids:
+            return
+        if self.user_shards == 1:
+            self._detach_answers(cur, option_ids)
+        cur.executemany("DELETE FROM option_stats WHERE option_id=?", [(o,) for o in option_ids])
+        cur.executemany("DELETE FROM question_options WHERE id=?", [(o,) for o in option_ids])
+
+
+def swap_content_db(content_path: str, new_path: str) -> None:
+    """
+    Installs a catalog file that was rebuilt offline.
+
+    The new file is checked and switched to a rollback journal (so it is a
+    single self-contained file), then renamed over content_path atomically.
+    Running workers notice the new inode and reopen their connections.
+    Meant for content_immutable deployments, where the live file has no WAL.
+    """
+    if os.path.exists(content_path + "-wal"):
+        raise RuntimeError(f"'{content_path}' is in WAL mode, stop writers before swapping it")
+    with sqlite3.connect(new_path, timeout=5) as conn:
+        cur = conn.cursor()
+        cur.execute("PRAGMA quick_check")
+        if cur.fetchone()[0] != "ok":
+            raise ValueError(f"'{new_path}' failed PRAGMA quick_check")
+        for table in CATALOG_TABLES:
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+            if not cur.fetchone():
+                raise ValueError(f"'{new_path}' has no '{table}' table")
+        cur.execute("PRAGMA journal_mode=DELETE")
+    os.replace(new_path, content_path)
 
 
 def seed_initial_data(db_path):
@@ -0,0 +1,67 @@
+import random
+import re
+import unicodedata
+import zlib
+from array import array
+
+SHINGLE_SIZE = 4  # characters per shingle
+NUM_HASHES = 64
+BANDS = 16  # LSH bands of NUM_HASHES // BANDS rows each
+ROWS = NUM_HASHES // BANDS
+DUPLICATE_THRESHOLD = 0.8  # estimated Jaccard similarity that counts as a near-duplicate
+
+_MASK64 = (1 << 64) - 1
+# multiply-shift hash functions h -> ((a*h + b) mod 2^64) >> 32 with odd a; the
+# coefficients are fixed so signatures stored by one process match another's
+_rnd = random.Random(0x51A7)
+_PERMUTATIONS = [(_rnd.getrandbits(64) | 1, _rnd.getrandbits(64)) for _ in range(NUM_HASHES)]
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Case, accents, punctuation and spacing removed."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def shingles(question_text: str, options: list[str]) -> set[int]:
+    """
+    Hashed character shingles of the question and its options. Options are
+    sorted first, so reordering them does not make a question look new.
+    """
+    text = normalize(question_text) + " | " + " | ".join(sorted(normalize(o) for o in options))
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode())}
+    return {zlib.crc32(text[i:i + SHINGLE_SIZE].encode()) for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(question_text: str, options: list[str]) -> array:
+    hashes = list(shingles(question_text, options))
+    return array("I", (
+        min([(a * h + b) & _MASK64 for h in hashes]) >> 32
+        for a, b in _PERMUTATIONS
+    ))
+
+
+def bands(sig: array) -> list[tuple[int, int]]:
+    """(band, bucket) keys; two questions sharing any of them are candidates."""
+    return [
+        (band, zlib.crc32(sig[band * ROWS:(band + 1) * ROWS].tobytes()))
+        for band in range(BANDS)
+    ]
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_HASHES
+
+
+def to_blob(sig: array) -> bytes:
+    return sig.tobytes()
+
+
+def from_blob(blob: bytes) -> array:
+    sig = array("I")
+    sig.frombytes(blob)
+    return sig
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+EVENT_QUEUE_SIZE = 32  # events buffered per subscriber before it has to resync
+HEARTBEAT_INTERVAL = 15  # seconds between keep-alive comments on an idle stream
+
+
+class Subscription:
+    __slots__ = ("user_id", "queue", "lagged")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self.lagged = False
+
+
+class EventBus:
+    """
+    In-process pub/sub of per-user events (wallet and progress deltas).
+
+    Each subscriber owns a bounded queue. A subscriber that falls behind
+    does not grow memory: its queue is emptied and replaced by a single
+    "resync" event telling the client to re-fetch /home-data once.
+
+    publish() may be called from the event loop or from another thread
+    (the scheduler jobs); calls from other threads are handed to the loop.
+    Events only reach subscribers connected to this worker.
+    """
+    def __init__(self):
+        self.subscribers = {}
+        self.published = 0
+        self.resyncs = 0
+        self._loop = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        sub = Subscription(user_id)
+        self.subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self.subscribers.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self.subscribers[sub.user_id]
+
+    def publish(self, user_id: int, event: dict) -> None:
+        self.publish_many([(user_id, event)])
+
+    def publish_many(self, events: list) -> None:
+        """events: (user_id, event) pairs. Users without a subscriber are skipped."""
+        events = [(user_id, event) for user_id, event in events if user_id in self.subscribers]
+        if not events or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._deliver(events)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._deliver, events)
+
+    def _deliver(self, events: list) -> None:
+        for user_id, event in events:
+            data = json.dumps(event)
+            for sub in self.subscribers.get(user_id, ()):
+                self.published += 1
+                if sub.lagged:
+                    continue
+                try:
+                    sub.queue.put_nowait((event["type"], data))
+                except asyncio.QueueFull:
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    sub.queue.put_nowait(("resync", "{}"))
+                    sub.lagged = True
+                    self.resyncs += 1
+
+    async def stream(self, sub: Subscription, first: dict | None = None):
+        """
+        Yields the subscription as text/event-stream frames until the client
+        goes away; the subscription is dropped when the generator closes.
+        """
+        try:
+            if first is not None:
+                yield f"event: {first['type']}\ndata: {json.dumps(first)}\n\n"
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(sub.queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if kind == "resync":
+                    sub.lagged = False
+                yield f"event: {kind}\ndata: {data}\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+    def metrics(self) -> dict:
+        return {
+            "users": len(self.subscribers),
+            "subscriptions": sum(len(s) for s in self.subscribers.values()),
+            "published": self.published,
+            "resyncs": self.resyncs,
+        }
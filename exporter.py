@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+import zlib
+
+FORMATS = ("jsonl", "csv")
+MEDIA_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _csv_rows(rows: list[dict], columns: list[str]):
+    """Rows as CSV cells; a question's options list is spread over option1, option2, ..."""
+    for row in rows:
+        if "options" in row:
+            row = dict(row)
+            for i, option in enumerate(row.pop("options"), 1):
+                row[f"option{i}"] = option
+        yield [row.get(column) for column in columns]
+
+
+def encode_batch(rows: list[dict], fmt: str, columns: list[str]) -> bytes:
+    if fmt == "jsonl":
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode()
+    out = io.StringIO()
+    csv.writer(out).writerows(_csv_rows(rows, columns))
+    return out.getvalue().encode()
+
+
+async def stream(batches, fmt: str, columns: list[str], compress: bool = False):
+    """
+    Encodes an async iterator of row batches (DatabaseManager.export_rows)
+    as JSONL or CSV bytes, gzip-compressed on the fly when asked. Only the
+    current batch is held in memory.
+    """
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip container
+
+    def encode(data: bytes) -> bytes:
+        return gzip.compress(data) if gzip else data
+
+    if fmt == "csv":
+        out = io.StringIO()
+        csv.writer(out).writerow(columns)
+        yield encode(out.getvalue().encode())
+    async for rows in batches:
+        chunk = encode(encode_batch(rows, fmt, columns))
+        if chunk:
+            yield chunk
+    if gzip:
+        yield gzip.flush()
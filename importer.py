@@ -0,0 +1,251 @@
+import codecs
+import csv
+import json
+import time
+import uuid
+from collections import OrderedDict
+
+IMPORT_CHUNK_SIZE = 500  # rows per executemany transaction
+MAX_REPORTED_ERRORS = 1000  # per job; later errors are only counted
+RECENT_JOBS = 20
+FORMATS = ("jsonl", "csv")
+
+
+def parse_row(record: dict) -> dict:
+    """
+    Validates one uploaded question. Raises ValueError with a message for
+    the error report.
+
+    Fields (JSONL keys / CSV header):
+        external_id            stable id of the question, required
+        subject, quiz          titles
+        subject_external_id    optional, defaults to the subject title
+        quiz_external_id       optional, defaults to "<subject_external_id>/<quiz>"
+        gems_reward            optional, for the quiz
+        question               question text
+        type                   "mcq" (default) or "ts"
+        options                JSON list, or CSV columns option1, option2, ...
+        correct                index of the correct option, from 0
+        stars                  optional stars reward, default 1
+    """
+    def text(key, required=True):
+        value = record.get(key)
+        value = str(value).strip() if value is not None else ""
+        if required and not value:
+            raise ValueError(f"missing '{key}'")
+        return value or None
+
+    def integer(key, default=None):
+        value = record.get(key)
+        if value in (None, ""):
+            return default
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{key}' must be an integer")
+
+    options = record.get("options")
+    if options is None:
+        options = [v for k, v in sorted(
+            ((k, v) for k, v in record.items() if k and k.startswith("option") and k[6:].isdigit()),
+            key=lambda kv: int(kv[0][6:])
+        ) if v not in (None, "")]
+    if not isinstance(options, list) or len(options) < 2:
+        raise ValueError("at least two options are required")
+    options = [str(o) for o in options]
+
+    qtype = text("type", required=False) or "mcq"
+    if qtype not in ("mcq", "ts"):
+        raise ValueError(f"unknown question type '{qtype}'")
+    correct = integer("correct")
+    if correct is None or not 0 <= correct < len(options):
+        raise ValueError("'correct' is not an option index")
+
+    subject = text("subject")
+    quiz = text("quiz")
+    subject_ext = text("subject_external_id", required=False) or subject
+    return {
+        "external_id": text("external_id"),
+        "subject": subject,
+        "subject_external_id": subject_ext,
+        "quiz": quiz,
+        "quiz_external_id": text("quiz_external_id", required=False) or f"{subject_ext}/{quiz}",
+        "gems_reward": integer("gems_reward"),
+        "text": text("question"),
+        "type": qtype,
+        "options": options,
+        "correct": correct,
+        "stars": integer("stars", 1),
+    }
+
+
+async def iter_lines(stream):
+    """Decoded lines of a byte stream, without holding more than one line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in stream:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def iter_records(stream, fmt: str):
+    """
+    (line number, record dict or ValueError) for each JSONL line or CSV row.
+    A CSV record may span lines when a quoted field contains newlines.
+    """
+    number = 0
+    if fmt == "jsonl":
+        async for line in iter_lines(stream):
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                yield number, record
+            except ValueError as e:
+                yield number, ValueError(f"invalid JSON: {e}")
+        return
+
+    header = None
+    buffered, start = "", 0
+    async for line in iter_lines(stream):
+        number += 1
+        if not buffered:
+            start = number
+        buffered += line
+        if buffered.count('"') % 2:
+            continue  # inside a quoted field
+        record, buffered = buffered, ""
+        if not record.strip():
+            continue
+        row = next(csv.reader([record]))
+        if header is None:
+            header = [h.strip() for h in row]
+            continue
+        yield start, dict(zip(header, row))
+    if buffered:
+        yield start, ValueError("unterminated quoted field")
+
+
+class ImportJob:
+    """Progress and outcome of one upload, readable while it runs."""
+    def __init__(self, admin_id: int, fmt: str, on_duplicate: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.admin_id = admin_id
+        self.format = fmt
+        self.on_duplicate = on_duplicate
+        self.status = "running"
+        self.started_at = time.time()
+        self.finished_at = None
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.flagged = 0
+        self.error_count = 0
+        self.errors = []
+        self.duplicates = []  # flagged rows, capped like errors
+
+    def error(self, line: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def record(self, lines: list[int], result: dict) -> None:
+        """Adds the outcome of one chunk (DatabaseManager.import_questions)."""
+        if not result["ok"]:
+            for line in lines:
+                self.error(line, result["error"])
+            return
+        self.inserted += result["inserted"]
+        self.updated += result["updated"]
+        for index, question_ids in result["rejected"]:
+            self.rejected += 1
+            self.error(lines[index], f"near-duplicate of question {question_ids[0]}")
+        for index, message in result["errors"]:
+            self.error(lines[index], message)
+        for index, question_ids in result["flagged"]:
+            self.flagged += 1
+            if len(self.duplicates) < MAX_REPORTED_ERRORS:
+                self.duplicates.append({"line": lines[index], "question_ids": question_ids})
+
+    def finish(self, status: str = "done") -> None:
+        self.status = status
+        self.finished_at = time.time()
+
+    def summary(self) -> dict:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "status": self.status,
+            "format": self.format,
+            "on_duplicate": self.on_duplicate,
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected_duplicates": self.rejected,
+            "flagged_duplicates": self.flagged,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "duplicates": self.duplicates,
+            "seconds": round(end - self.started_at, 2),
+        }
+
+
+class ImportJobs:
+    """Running and recent imports of this worker."""
+    def __init__(self):
+        self.jobs = OrderedDict()
+
+    def start(self, admin_id: int, fmt: str, on_duplicate: str) -> ImportJob:
+        job = ImportJob(admin_id, fmt, on_duplicate)
+        self.jobs[job.id] = job
+        while len(self.jobs) > RECENT_JOBS:
+            self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> ImportJob | None:
+        return self.jobs.get(job_id)
+
+
+async def run_import(db, jobs: ImportJobs, admin_id: int, stream, fmt: str, on_duplicate: str) -> ImportJob:
+    """
+    Parses the upload as it arrives and hands IMPORT_CHUNK_SIZE valid rows
+    at a time to db.import_questions, one transaction per chunk.
+    """
+    job = jobs.start(admin_id, fmt, on_duplicate)
+    lines, rows = [], []
+
+    async def flush():
+        if rows:
+            job.record(lines, await db.import_questions(rows, on_duplicate))
+            lines.clear()
+            rows.clear()
+
+    try:
+        async for line, record in iter_records(stream, fmt):
+            job.rows += 1
+            if isinstance(record, ValueError):
+                job.error(line, str(record))
+                continue
+            try:
+                rows.append(parse_row(record))
+                lines.append(line)
+            except ValueError as e:
+                job.error(line, str(e))
+            if len(rows) >= IMPORT_CHUNK_SIZE:
+                await flush()
+        await flush()
+        job.finish()
+    except BaseException:
+        job.finish("failed")
+        raise
+    return job
@@ -0,0 +1,75 @@
+from bisect import bisect_left, insort
+
+GLOBAL = 0  # subject_id used for the global board
+
+
+class Leaderboard:
+    """
+    Scores of one board kept as a sorted list of (-score, user_id) keys.
+    Rank lookup is a binary search; top-K is a slice.
+    """
+    __slots__ = ("_scores", "_keys")
+
+    def __init__(self):
+        self._scores = {}
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, scores: dict) -> None:
+        self._scores = dict(scores)
+        self._keys = sorted((-score, user_id) for user_id, score in self._scores.items())
+
+    def set(self, user_id: int, score: int) -> None:
+        old = self._scores.get(user_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+        self._scores[user_id] = score
+        insort(self._keys, (-score, user_id))
+
+    def score(self, user_id: int) -> int | None:
+        return self._scores.get(user_id)
+
+    def rank(self, user_id: int) -> int | None:
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self._keys, (-score, user_id)) + 1
+
+    def top(self, k: int) -> list[tuple[int, int]]:
+        return [(user_id, -neg) for neg, user_id in self._keys[:k]]
+
+
+class Leaderboards:
+    """
+    All boards of one worker: the global one and one per subject,
+    plus the usernames shown next to the scores.
+    """
+    def __init__(self):
+        self.boards = {}
+        self.usernames = {}
+        self.loaded_at = 0.0
+
+    def board(self, subject_id: int) -> Leaderboard:
+        board = self.boards.get(subject_id)
+        if board is None:
+            board = self.boards[subject_id] = Leaderboard()
+        return board
+
+    def set(self, user_id: int, username: str, subject_id: int, score: int) -> None:
+        self.usernames[user_id] = username
+        self.board(subject_id).set(user_id, score)
+
+    def payload(self, subject_id: int, user_id: int, limit: int) -> dict:
+        board = self.boards.get(subject_id) or Leaderboard()
+        top = [
+            {"rank": i + 1, "user_id": uid, "username": self.usernames.get(uid), "score": score}
+            for i, (uid, score) in enumerate(board.top(limit))
+        ]
+        return {
+            "subject_id": None if subject_id == GLOBAL else subject_id,
+            "players": len(board),
+            "top": top,
+            "me": {"rank": board.rank(user_id), "score": board.score(user_id) or 0},
+        }
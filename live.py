@@ -0,0 +1,268 @@
+import asyncio
+import heapq
+import json
+import secrets
+from string import ascii_uppercase, digits
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from sampling import new_seed
+
+ROOM_CODE_LENGTH = 6
+SEND_QUEUE_SIZE = 64  # messages buffered per socket before it counts as too slow
+SCOREBOARD_INTERVAL = 0.5  # seconds; scoreboard changes are batched per tick
+SCOREBOARD_SIZE = 10
+ROOM_JOIN_TIMEOUT = 10 * 60  # seconds a new room waits for its first connection
+
+
+class Participant:
+    __slots__ = ("user_id", "username", "ws", "queue", "writer", "score", "answered")
+
+    def __init__(self, user_id, username, ws):
+        self.user_id = user_id
+        self.username = username
+        self.ws = ws
+        self.queue = asyncio.Queue(SEND_QUEUE_SIZE)
+        self.writer = None
+        self.score = 0
+        self.answered = set()
+
+
+class LiveRoom:
+    """
+    One live session of a quiz: a host pushes questions in lockstep, players
+    answer them and everyone receives the scoreboard.
+
+    Every broadcast is serialized once and the same string is queued to
+    each socket; a writer task per socket drains its queue, so one slow
+    client never holds up the others. A client whose queue fills up is
+    disconnected.
+    """
+    def __init__(self, code, host_id, quiz_id, seed, questions):
+        self.code = code
+        self.host_id = host_id
+        self.quiz_id = quiz_id
+        self.seed = seed  # draws the questions of quizzes with a sample size
+        self.questions = questions
+        self.participants = {}
+        self.index = -1
+        self.state = "lobby"
+        self.dropped = 0
+        self.joined = 0  # connections so far
+        self._dirty = False
+        self._ticker = asyncio.create_task(self._scoreboard_loop())
+
+    @property
+    def current(self):
+        if 0 <= self.index < len(self.questions):
+            return self.questions[self.index]
+        return None
+
+    # ---------- sending ----------
+    def broadcast(self, message: dict) -> None:
+        data = json.dumps(message)
+        for p in list(self.participants.values()):
+            self._enqueue(p, data)
+
+    def send(self, p: Participant, message: dict) -> None:
+        self._enqueue(p, json.dumps(message))
+
+    def _enqueue(self, p: Participant, data: str) -> None:
+        try:
+            p.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # too slow to keep up: drop it instead of buffering without bound
+            self.dropped += 1
+            self.leave(p)
+            asyncio.create_task(p.ws.close(code=1013))
+
+    async def _writer(self, p: Participant) -> None:
+        try:
+            while True:
+                data = await p.queue.get()
+                if data is None:
+                    return
+                await p.ws.send_text(data)
+        except Exception:
+            self.leave(p)
+
+    # ---------- membership ----------
+    def join(self, p: Participant) -> None:
+        old = self.participants.get(p.user_id)
+        if old is not None:
+            # reconnect: keep the score, replace the socket
+            p.score, p.answered = old.score, old.answered
+            self.leave(old)
+        self.participants[p.user_id] = p
+        self.joined += 1
+        p.writer = asyncio.create_task(self._writer(p))
+        self._dirty = True
+
+    def leave(self, p: Participant) -> None:
+        if self.participants.get(p.user_id) is p:
+            del self.participants[p.user_id]
+            self._dirty = True
+        try:
+            p.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            if p.writer:
+                p.writer.cancel()
+
+    # ---------- scoreboard ----------
+    def scoreboard(self) -> dict:
+        players = [p for p in self.participants.values() if p.user_id != self.host_id]
+        top = heapq.nlargest(SCOREBOARD_SIZE, players, key=lambda p: (p.score, -p.user_id))
+        current = self.current
+        return {
+            "type": "scoreboard",
+            "participants": len(players),
+            "answered": sum(1 for p in players if current and current["id"] in p.answered),
+            "top": [{"user_id": p.user_id, "username": p.username, "score": p.score} for p in top],
+        }
+
+    async def _scoreboard_loop(self):
+        while self.state != "closed":
+            await asyncio.sleep(SCOREBOARD_INTERVAL)
+            if self._dirty:
+                self._dirty = False
+                self.broadcast(self.scoreboard())
+
+    def close(self):
+        self.state = "closed"
+        self._ticker.cancel()
+        for p in list(self.participants.values()):
+            self.leave(p)
+
+
+class LiveRooms:
+    """
+    Registry of the live rooms of this worker, plus the message handling.
+    Rooms live in memory, so a deployment with several workers needs
+    sticky routing for /live/* (the room is on the worker that created it).
+    A room is closed when its last connection leaves, whatever its state,
+    or after ROOM_JOIN_TIMEOUT if nobody ever connects.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.rooms = {}
+
+    async def create(self, host_id: int, quiz_id: int) -> LiveRoom | None:
+        seed = new_seed()
+        questions = await self.db.get_live_questions(quiz_id, seed)
+        if not questions:
+            return None
+        code = "".join(secrets.choice(ascii_uppercase + digits) for _ in range(ROOM_CODE_LENGTH))
+        while code in self.rooms:
+            code = "".join(secrets.choice(ascii_uppercase + digits) for _ in range(ROOM_CODE_LENGTH))
+        room = self.rooms[code] = LiveRoom(code, host_id, quiz_id, seed, questions)
+        asyncio.get_running_loop().call_later(ROOM_JOIN_TIMEOUT, self._expire, room)
+        return room
+
+    def _close(self, room: LiveRoom) -> None:
+        room.close()
+        if self.rooms.get(room.code) is room:
+            del self.rooms[room.code]
+
+    def _expire(self, room: LiveRoom) -> None:
+        # nobody connected in time (once somebody has, the last one to leave closes it)
+        if not room.participants and room.state == "lobby" and not room.joined:
+            self._close(room)
+
+    def metrics(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "connections": sum(len(r.participants) for r in self.rooms.values()),
+            "dropped_slow_clients": sum(r.dropped for r in self.rooms.values()),
+        }
+
+    async def serve(self, ws: WebSocket, room: LiveRoom, user_id: int, username: str) -> None:
+        p = Participant(user_id, username, ws)
+        is_host = user_id == room.host_id
+        if not is_host:
+            await self.db.join_live_attempt(user_id, room.quiz_id, room.seed, [q["id"] for q in room.questions])
+        if room.state == "closed":
+            # emptied and closed while this connection was being set up
+            await ws.close(code=1008)
+            return
+        room.join(p)
+        room.send(p, {
+            "type": "joined",
+            "room": room.code,
+            "quiz_id": room.quiz_id,
+            "host": is_host,
+            "state": room.state,
+            "total": len(room.questions),
+        })
+        if room.current:
+            room.send(p, self._question_message(room))
+        try:
+            while True:
+                try:
+                    message = json.loads(await ws.receive_text())
+                except ValueError:
+                    room.send(p, {"type": "error", "error": "invalid_json"})
+                    continue
+                kind = message.get("type") if isinstance(message, dict) else None
+                if is_host and kind == "next":
+                    self._next_question(room)
+                elif is_host and kind == "end":
+                    await self._finish(room)
+                elif kind == "answer":
+                    await self._answer(room, p, message)
+                else:
+                    room.send(p, {"type": "error", "error": "unknown_message"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            room.leave(p)
+            if not room.participants:
+                self._close(room)
+
+    def _question_message(self, room: LiveRoom) -> dict:
+        return {"type": "question", "index": room.index, "total": len(room.questions), "question": room.current}
+
+    def _next_question(self, room: LiveRoom) -> None:
+        if room.state == "finished":
+            return
+        room.index += 1
+        if room.current is None:
+            room.index = len(room.questions)
+            room.broadcast({"type": "no_more_questions"})
+            return
+        room.state = "question"
+        room.broadcast(self._question_message(room))
+        room._dirty = True
+
+    async def _answer(self, room: LiveRoom, p: Participant, message: dict) -> None:
+        current = room.current
+        if room.state != "question" or current is None or message.get("question_id") != current["id"]:
+            room.send(p, {"type": "answer_result", "ok": False, "error": "not_current_question"})
+            return
+        if current["id"] in p.answered:
+            room.send(p, {"type": "answer_result", "ok": False, "error": "already_answered"})
+            return
+        try:
+            option_id = int(message.get("option_id"))
+        except (TypeError, ValueError):
+            room.send(p, {"type": "answer_result", "ok": False, "error": "invalid_option"})
+            return
+        p.answered.add(current["id"])
+        result = await self.db.submit_answer(p.user_id, room.quiz_id, current["id"], option_id)
+        if result.get("error") == "invalid_option":
+            p.answered.discard(current["id"])  # nothing was recorded, the player may answer again
+        if result.get("ok") and result.get("is_correct"):
+            p.score += current["stars"]
+        room.send(p, {"type": "answer_result", "question_id": current["id"], **result})
+        room._dirty = True
+
+    async def _finish(self, room: LiveRoom) -> None:
+        if room.state == "finished":
+            return
+        room.state = "finished"
+        players = [p for p in room.participants.values() if p.answered]
+        results = await asyncio.gather(*(self.db.finish_quiz(p.user_id, room.quiz_id) for p in players))
+        for p, result in zip(players, results):
+            room.send(p, {"type": "result", **result})
+        final = room.scoreboard()
+        final["type"] = "finished"
+        room.broadcast(final)
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+import zlib
+
+LOCK_STRIPES = 1024  # user locks; two users share one with probability 1/LOCK_STRIPES
+ASYNC_POLL_MIN = 0.0005  # seconds between tries of a contended lock from the event loop
+ASYNC_POLL_MAX = 0.005
+CONTENDED_WAIT = 0.001  # a BEGIN IMMEDIATE slower than this waited for another writer
+
+
+class LockStats:
+    __slots__ = ("acquired", "contended", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.acquired = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float, contended: bool) -> None:
+        self.acquired += 1
+        if contended:
+            self.contended += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def as_dict(self) -> dict:
+        return {
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_ms_total": round(self.wait_total * 1000, 1),
+            "wait_ms_max": round(self.wait_max * 1000, 1),
+            "wait_ms_avg": round(self.wait_total * 1000 / self.contended, 3) if self.contended else 0.0,
+        }
+
+
+class Held:
+    """
+    One lock of the manager, usable as `with` from a thread or `async with`
+    from the event loop. The async form never blocks the loop: a contended
+    lock is retried after short sleeps.
+    """
+    __slots__ = ("lock", "stats")
+
+    def __init__(self, lock: threading.Lock, stats: LockStats):
+        self.lock = lock
+        self.stats = stats
+
+    def __enter__(self):
+        if self.lock.acquire(blocking=False):
+            self.stats.record(0.0, False)
+            return self
+        started = time.perf_counter()
+        self.lock.acquire()
+        self.stats.record(time.perf_counter() - started, True)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+    async def __aenter__(self):
+        if self.lock.acquire(blocking=False):
+            self.stats.record(0.0, False)
+            return self
+        started = time.perf_counter()
+        delay = ASYNC_POLL_MIN
+        while True:
+            await asyncio.sleep(delay)
+            if self.lock.acquire(blocking=False):
+                break
+            delay = min(delay * 2, ASYNC_POLL_MAX)
+        self.stats.record(time.perf_counter() - started, True)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.lock.release()
+
+
+class LockManager:
+    """
+    Locks of a DatabaseManager, with wait metrics.
+
+    user(key): striped locks for operations on one user's rows, keyed by
+    user id (or email before the account has an id). Operations of
+    different users almost never wait for each other here, and waiting
+    from the event loop does not hold a pool thread.
+
+    file(name): the short global section of one database file, held only
+    around a write transaction. SQLite allows one writer per file anyway;
+    queueing on this lock hands the file over as soon as the previous
+    transaction ends, where waiting in SQLite's busy handler would sleep.
+
+    sqlite_wait(name, seconds): time BEGIN IMMEDIATE waited for the file's
+    write lock, i.e. for writers of other worker processes.
+    """
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self.stripes = [threading.Lock() for _ in range(stripes)]
+        self.files = {}
+        self.stats = {"user": LockStats()}
+        self._create_lock = threading.Lock()
+
+    def user(self, key) -> Held:
+        if isinstance(key, str):
+            key = zlib.crc32(key.lower().encode())
+        return Held(self.stripes[key % len(self.stripes)], self.stats["user"])
+
+    def file(self, name: str) -> Held:
+        held = self.files.get(name)
+        if held is None:
+            with self._create_lock:
+                held = self.files.get(name)
+                if held is None:
+                    held = self.files[name] = Held(threading.Lock(), self._stats(f"file:{name}"))
+        return held
+
+    def sqlite_wait(self, name: str, wait: float) -> None:
+        self._stats(f"sqlite:{name}").record(wait, wait > CONTENDED_WAIT)
+
+    def _stats(self, name: str) -> LockStats:
+        stats = self.stats.get(name)
+        return stats if stats is not None else self.stats.setdefault(name, LockStats())
+
+    def metrics(self) -> dict:
+        return {name: stats.as_dict() for name, stats in list(self.stats.items())}
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+PROGRESS_CACHE_SIZE = 20_000  # users kept; the least recently used is dropped first
+PROGRESS_TTL = 300  # seconds an entry is trusted; a backstop, other workers' changes are dropped by invalidate()
+
+
+class QuizProgress:
+    """The user's user_quizzes row for one quiz."""
+    __slots__ = ("completed", "score", "score_percent", "seed", "drawn")
+
+    def __init__(self, completed: int = 0, score: int = 0, score_percent: int = 0, seed: int | None = None,
+                 drawn: list[int] | None = None):
+        self.completed = completed
+        self.score = score
+        self.score_percent = score_percent
+        self.seed = seed
+        self.drawn = drawn  # question ids of a sampled attempt, fixed when it started
+
+
+class Progress:
+    """Wallet and per-quiz progress of one user, as /home-data and /quiz/{id} read them."""
+    __slots__ = ("username", "stars", "gems", "quizzes", "loaded_at")
+
+    def __init__(self, username: str, stars: int, gems: int, quizzes: dict, loaded_at: float):
+        self.username = username
+        self.stars = stars
+        self.gems = gems
+        self.quizzes = quizzes  # quiz id -> QuizProgress
+        self.loaded_at = loaded_at
+
+
+class ProgressCache:
+    """
+    Bounded LRU of Progress by user id, kept current write-through by the
+    operations that change it. Updates for users not in the cache are
+    ignored; their next read loads them. Changes made by other workers are
+    dropped with invalidate(); a load that started before that is not
+    stored.
+
+    Safe to update from the scheduler thread (the refill job).
+    """
+    def __init__(self, size: int = PROGRESS_CACHE_SIZE, ttl: float = PROGRESS_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.invalidated = {}  # user id -> when it was last invalidated
+        self.cleared_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Progress | None:
+        with self._lock:
+            progress = self.entries.get(user_id)
+            if progress is not None and time.monotonic() - progress.loaded_at < self.ttl:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return progress
+            if progress is not None:
+                del self.entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id: int, progress: Progress) -> None:
+        """progress.loaded_at must be taken before its rows were read."""
+        with self._lock:
+            if max(self.cleared_at, self.invalidated.get(user_id, 0.0)) >= progress.loaded_at:
+                return
+            self.entries[user_id] = progress
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def wallet(self, user_id: int, stars: int | None = None, gems: int | None = None) -> None:
+        with self._lock:
+            progress = self.entries.get(user_id)
+            if progress is None:
+                return
+            if stars is not None:
+                progress.stars = stars
+            if gems is not None:
+                progress.gems = gems
+
+    def quiz(self, user_id: int, quiz_id: int, **fields) -> None:
+        """Sets fields of the user's QuizProgress, creating it like the row's INSERT would."""
+        with self._lock:
+            progress = self.entries.get(user_id)
+            if progress is None:
+                return
+            quiz = progress.quizzes.get(quiz_id)
+            if quiz is None:
+                quiz = progress.quizzes[quiz_id] = QuizProgress()
+            for name, value in fields.items():
+                setattr(quiz, name, value)
+
+    def drop(self, user_id: int) -> None:
+        with self._lock:
+            self.entries.pop(user_id, None)
+
+    def invalidate(self, user_ids) -> None:
+        """
+        Drops users whose rows were changed outside their lock (by another
+        worker or a batch job); loads that started earlier are not cached.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self.invalidated) > self.size:
+                # no load runs for ttl seconds, so older marks no longer matter
+                self.invalidated = {k: t for k, t in self.invalidated.items() if now - t < self.ttl}
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+                self.invalidated[user_id] = now
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.invalidated.clear()
+            self.cleared_at = time.monotonic()
+
+    def metrics(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "users": len(self.entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
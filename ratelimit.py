@@ -0,0 +1,126 @@
+import json
+import math
+import time
+from collections import OrderedDict
+
+from starlette.routing import compile_path
+
+MAX_BUCKETS = 100_000  # per rule; the least recently seen client is evicted beyond this
+
+
+class Rule:
+    """
+    A token bucket per client for one route: `burst` requests at once, refilled
+    at `rate` requests per second. `per` is "user" (falls back to the client
+    IP for anonymous requests) or "ip".
+    """
+    __slots__ = ("name", "method", "regex", "rate", "burst", "per", "idle", "buckets",
+                 "allowed", "throttled")
+
+    def __init__(self, method: str, path: str, rate: float, burst: int, per: str = "user"):
+        if per not in ("user", "ip"):
+            raise ValueError(f"Unknown rate limit key '{per}'")
+        self.name = f"{method} {path}"
+        self.method = method
+        self.regex = compile_path(path)[0]
+        self.rate = rate
+        self.burst = burst
+        self.per = per
+        # an untouched bucket is full again after this long, so it can be forgotten
+        self.idle = burst / rate
+        # key -> [tokens, last_seen], ordered by last_seen
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+
+    def take(self, key, now: float) -> float:
+        """Spends one token for `key`. Returns 0 if allowed, else seconds to wait."""
+        buckets = self.buckets
+        # idle buckets sit at the front; drop a couple per call so eviction stays O(1)
+        for _ in range(2):
+            if not buckets:
+                break
+            oldest = next(iter(buckets.values()))
+            if now - oldest[1] < self.idle and len(buckets) < MAX_BUCKETS:
+                break
+            buckets.popitem(last=False)
+
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            buckets.move_to_end(key)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+        self.throttled += 1
+        return (1 - bucket[0]) / self.rate
+
+
+class RateLimiter:
+    """
+    In-memory rate limits of one worker, looked up by method and path.
+    """
+    def __init__(self, rules: list[Rule]):
+        self.rules = rules
+
+    def match(self, method: str, path: str) -> Rule | None:
+        for rule in self.rules:
+            if rule.method == method and rule.regex.match(path):
+                return rule
+        return None
+
+    def metrics(self) -> dict:
+        return {
+            rule.name: {
+                "rate": rule.rate,
+                "burst": rule.burst,
+                "per": rule.per,
+                "clients": len(rule.buckets),
+                "allowed": rule.allowed,
+                "throttled": rule.throttled,
+            }
+            for rule in self.rules
+        }
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware answering 429 with Retry-After when a client's bucket
+    for the requested route is empty. `identify(scope)` returns the user id
+    of an authenticated request or None.
+    """
+    def __init__(self, app, limiter: RateLimiter, identify):
+        self.app = app
+        self.limiter = limiter
+        self.identify = identify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rule = self.limiter.match(scope["method"], scope["path"])
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        user_id = self.identify(scope) if rule.per == "user" else None
+        client = scope.get("client")
+        key = ("user", user_id) if user_id is not None else ("ip", client[0] if client else None)
+        wait = rule.take(key, time.monotonic())
+        if not wait:
+            return await self.app(scope, receive, send)
+
+        body = json.dumps({"detail": "Too many requests"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
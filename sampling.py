@@ -0,0 +1,93 @@
+import secrets
+from array import array
+
+MASK64 = (1 << 64) - 1
+
+
+def new_seed() -> int:
+    # 63 bits so it fits a signed SQLite INTEGER
+    return secrets.randbits(63)
+
+
+class _SplitMix64:
+    """
+    Small seeded generator (SplitMix64). Used instead of random.Random so the
+    questions drawn for a stored seed never change with the Python version.
+    """
+    __slots__ = ("state",)
+
+    def __init__(self, seed: int):
+        self.state = seed & MASK64
+
+    def below(self, n: int) -> int:
+        self.state = (self.state + 0x9E3779B97F4A7C15) & MASK64
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return (z ^ (z >> 31)) % n
+
+
+def sample(ids, k: int, seed: int) -> list[int]:
+    """
+    K of `ids` drawn without replacement in a seeded random order, in O(K)
+    time and memory (Floyd's algorithm, then a Fisher-Yates shuffle of the K
+    picks). The same ids, k and seed always give the same list.
+    """
+    n = len(ids)
+    if k >= n:
+        return list(ids)
+    rng = _SplitMix64(seed)
+    picked = []
+    seen = set()
+    for j in range(n - k, n):
+        t = rng.below(j + 1)
+        if t in seen:
+            t = j
+        seen.add(t)
+        picked.append(t)
+    for i in range(k - 1, 0, -1):
+        j = rng.below(i + 1)
+        picked[i], picked[j] = picked[j], picked[i]
+    return [ids[i] for i in picked]
+
+
+class QuestionPool:
+    """
+    Question ids of one quiz as a compact array, plus how many of them an
+    attempt draws (0 means every question, in the stored order).
+    """
+    __slots__ = ("ids", "sample_size", "loaded_at")
+
+    def __init__(self, ids, sample_size: int, loaded_at: float):
+        self.ids = array("q", ids)
+        self.sample_size = sample_size
+        self.loaded_at = loaded_at
+
+    @property
+    def sampled(self) -> bool:
+        return 0 < self.sample_size < len(self.ids)
+
+    def draw(self, seed: int | None) -> list[int] | None:
+        """The question ids of the attempt with this seed, or None for all questions."""
+        if not self.sampled or seed is None:
+            return None
+        return sample(self.ids, self.sample_size, seed)
+
+    def attempt(self, seed: int | None, drawn: list[int] | None) -> list[int] | None:
+        """
+        The question ids of a stored attempt: the ones drawn when it started,
+        so adding or removing questions later does not change them. Attempts
+        stored without that list are drawn from this pool.
+        """
+        if drawn is not None:
+            return drawn
+        return self.draw(seed)
+
+
+def pack_ids(ids: list[int] | None) -> str | None:
+    # user_quizzes.drawn: the drawn question ids as "12,5,40"
+    return None if ids is None else ",".join(map(str, ids))
+
+
+def unpack_ids(text: str | None) -> list[int] | None:
+    return None if text is None else [int(i) for i in text.split(",") if i]
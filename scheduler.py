@@ -0,0 +1,142 @@
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+LEASE_NAME = "scheduler"
+LEASE_TTL = 30  # seconds a leader keeps the lease without renewing it
+TICK_INTERVAL = 5  # seconds between lease renewals / due checks
+DEFAULT_JITTER = 0.05  # fraction of the interval added at random to each run
+
+
+class Job:
+    """
+    A periodic job registered on the scheduler.
+    The function is synchronous and runs in its own daemon thread.
+    """
+    def __init__(self, name, func, interval, jitter=DEFAULT_JITTER, run_at_start=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self.next_run_at = None
+        self.running = False
+        self.overruns = 0
+        self.last_result = None
+
+    def schedule_after(self, last_started_at):
+        if not last_started_at:
+            self.next_run_at = time.time()
+            return
+        spread = random.uniform(0, self.interval * self.jitter)
+        self.next_run_at = last_started_at + self.interval + spread
+
+
+class Scheduler:
+    """
+    Runs registered periodic jobs in exactly one process.
+
+    Every worker starts a scheduler, but only the one holding the
+    `scheduler_leases` row runs jobs. The leader renews its lease on each
+    tick; if it dies the lease expires after LEASE_TTL seconds and another
+    worker takes over. Last-run metrics are stored in `scheduler_jobs` so a
+    new leader does not re-run jobs that already ran.
+    """
+    def __init__(self, db, lease_name=LEASE_NAME, lease_ttl=LEASE_TTL, tick=TICK_INTERVAL):
+        self.db = db
+        self.lease_name = lease_name
+        self.lease_ttl = lease_ttl
+        self.tick = tick
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.jobs = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name, func, interval, jitter=DEFAULT_JITTER, run_at_start=False):
+        """run_at_start: also run the job as soon as this worker becomes leader."""
+        self.jobs[name] = Job(name, func, interval, jitter, run_at_start)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.is_leader:
+            self.db.release_lease(self.lease_name, self.owner)
+            self.is_leader = False
+
+    def _loop(self):
+        while not self._stop.is_set():
+            leader = self.db.acquire_lease(self.lease_name, self.owner, self.lease_ttl)
+            if leader and not self.is_leader:
+                print(f"[SCHEDULER] {self.owner} is now the leader")
+                self._load_schedule()
+            elif not leader and self.is_leader:
+                print(f"[SCHEDULER] {self.owner} lost the lease")
+            self.is_leader = leader
+
+            if leader:
+                now = time.time()
+                for job in self.jobs.values():
+                    if job.next_run_at is None or now < job.next_run_at:
+                        continue
+                    if job.running:
+                        # overrun: the previous run is still going, skip this slot
+                        job.overruns += 1
+                        job.schedule_after(now)
+                        continue
+                    self._start_job(job)
+
+            self._stop.wait(self.tick)
+
+    def _load_schedule(self):
+        runs = {r["name"]: r for r in self.db.get_job_runs()}
+        for job in self.jobs.values():
+            last = runs.get(job.name)
+            last_started_at = last["last_started_at"] if last else None
+            job.schedule_after(None if job.run_at_start else last_started_at)
+
+    def _start_job(self, job):
+        started_at = time.time()
+        job.running = True
+        job.schedule_after(started_at)
+
+        def run():
+            ok = True
+            error = None
+            try:
+                job.last_result = job.func()
+                if job.last_result is False:
+                    ok = False
+            except Exception as e:
+                ok = False
+                error = str(e)
+                print(f"[SCHEDULER] job '{job.name}' failed:", e)
+            finally:
+                job.running = False
+                self.db.record_job_run(job.name, started_at, time.time() - started_at, ok, error)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def metrics(self) -> dict:
+        runs = {r["name"]: r for r in self.db.get_job_runs()}
+        jobs = []
+        for job in self.jobs.values():
+            entry = {
+                "name": job.name,
+                "interval": job.interval,
+                "running": job.running,
+                "overruns": job.overruns,
+                "last_result": job.last_result,
+                "next_run_at": job.next_run_at if self.is_leader else None,
+            }
+            entry.update({k: v for k, v in runs.get(job.name, {}).items() if k != "name"})
+            jobs.append(entry)
+        return {"owner": self.owner, "leader": self.is_leader, "jobs": jobs}
@@ -1,15 +1,26 @@
-from fastapi import FastAPI, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse
+import time
+STARTED_AT = time.perf_counter()  # startup time is measured from the first import
+import asyncio
+import json
+from fastapi import FastAPI, Form, HTTPException, Depends, WebSocket, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from datetime import datetime, timedelta, timezone
 import jwt
-import threading
-import time
 import os
+import threading
+from urllib.parse import parse_qs
 from dotenv import load_dotenv
-from database_manager import DatabaseManager
+from database_manager import DatabaseManager, EXPORT_TABLES, DUPLICATE_POLICIES
+from scheduler import Scheduler
+from live import LiveRooms
+from ratelimit import RateLimiter, RateLimitMiddleware, Rule
+import importer
+import backup
+import exporter
+import bundle
 
 load_dotenv()
 # -------------------------
@@ -20,12 +31,60 @@ ADMIN_KEY = os.environ.get("ADMIN_KEY") #this for admin to set as admin any acco
 
 ALGORITHM = "HS256"
 REFILL_INTERVAL = 4 * 60 * 60  # 4 hours
+LEADERBOARD_REBUILD_INTERVAL = 24 * 60 * 60  # daily
+ORPHAN_GC_INTERVAL = 15 * 60  # each run works for at most a couple of seconds
+WALLET_COMPACT_INTERVAL = 24 * 60 * 60  # daily
+CHANGE_LOG_PRUNE_INTERVAL = 60  # keeps the cache_changes logs short
+MAINTENANCE_INTERVAL = 60 * 60  # hourly check, works only inside the window
+# UTC hours "start-end" (end exclusive) for ANALYZE/checkpoint/vacuum work
+MAINTENANCE_WINDOW = os.environ.get("MAINTENANCE_WINDOW", "2-5")
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "7"))  # snapshots kept
+BACKUP_INTERVAL = int(os.environ.get("BACKUP_INTERVAL", str(24 * 60 * 60)))  # seconds, 0 disables
+DB_BACKEND = os.environ.get("DB_BACKEND", "executor")  # "executor" or "driver"
+CONTENT_DB_PATH = os.environ.get("CONTENT_DB_PATH")  # optional separate catalog file
+CONTENT_IMMUTABLE = os.environ.get("CONTENT_IMMUTABLE") == "1"
+USER_SHARDS = int(os.environ.get("USER_SHARDS", "1"))  # split user state over N files
+SYNC_MAX_BODY = 64 * 1024  # bytes; room for the most answers one sync accepts
+# token buckets per client: Rule(method, path, requests per second, burst, per "user" or "ip")
+RATE_LIMITS = [
+    # each of these can send an email through tools.generate_and_send_code
+    Rule("POST", "/register", rate=1 / 60, burst=3, per="ip"),
+    Rule("POST", "/verify", rate=1 / 10, burst=5, per="ip"),
+    Rule("POST", "/login", rate=1 / 6, burst=10, per="ip"),
+    Rule("GET", "/home-data", rate=2, burst=10),
+    Rule("GET", "/quiz/{quiz_id}", rate=2, burst=10),
+    Rule("PUT", "/quiz/{quiz_id}", rate=1, burst=5),
+    Rule("POST", "/submit-answer", rate=5, burst=20),
+    Rule("POST", "/finish-quiz", rate=1, burst=5),
+    Rule("POST", "/buy-stars/{package_name}", rate=1, burst=5),
+    Rule("GET", "/events", rate=1 / 5, burst=5),
+    Rule("POST", "/live/rooms", rate=1 / 10, burst=3),
+]
 # -------------------------
 # INITIALIZE APP & DATABASE
 # -------------------------
 app = FastAPI()
-DATABASE = DatabaseManager()
-
+DATABASE = DatabaseManager(
+    backend=DB_BACKEND,
+    content_db_path=CONTENT_DB_PATH,
+    content_immutable=CONTENT_IMMUTABLE,
+    user_shards=USER_SHARDS,
+)
+SCHEDULER = Scheduler(DATABASE)
+LIVE = LiveRooms(DATABASE)
+RATE_LIMITER = RateLimiter(RATE_LIMITS)
+IMPORTS = importer.ImportJobs()
+STARTUP = dict(DATABASE.startup)  # init_db, then warm-up timings
+WARM_UP = None
+CACHE_WATCH = None
+
+# added before CORS so throttled responses still carry the CORS headers
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=RATE_LIMITER,
+    identify=lambda scope: token_user_id(scope),
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -35,6 +94,8 @@ app.add_middleware(
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+# EventSource cannot send headers, so /events also takes ?token=
+oauth2_optional = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
 
 # -------------------------
 # MODELS
@@ -46,23 +107,36 @@ class UserIdentity(BaseModel):
 # -------------------------
 # BACKGROUND TASKS
 # -------------------------
-def start_star_refill_scheduler():
+def start_scheduler():
     """
-    Periodically refill user stars up to REFILL_TARGET every 4 hours.
-    Runs in a daemon thread.
+    Register the periodic jobs and start the scheduler.
+    Every worker starts one, but only the lease holder runs the jobs.
     """
-    def job():
-        while True:
-            DATABASE.refill_stars_up_to_target()
-            time.sleep(REFILL_INTERVAL)
-
-    t = threading.Thread(target=job, daemon=True)
-    t.start()
+    # refill user stars up to REFILL_TARGET every 4 hours
+    SCHEDULER.register("refill", DATABASE.refill_stars_up_to_target, REFILL_INTERVAL)
+    # recompute the ranking table from user_quizzes
+    SCHEDULER.register("leaderboard", DATABASE.rebuild_leaderboards, LEADERBOARD_REBUILD_INTERVAL)
+    # remove rows whose quiz/question/option is gone, a few windows per run
+    SCHEDULER.register("orphans", DATABASE.collect_orphans, ORPHAN_GC_INTERVAL)
+    # fold old wallet ledger rows into snapshots and check the cached balances
+    SCHEDULER.register("wallet", DATABASE.compact_wallets, WALLET_COMPACT_INTERVAL)
+    # trim the change logs the workers' cache coherence reads
+    SCHEDULER.register("cache_changes", DATABASE.prune_cache_changes, CHANGE_LOG_PRUNE_INTERVAL)
+    # statistics, WAL checkpoints and vacuum; also once when this worker becomes leader
+    start, end = (int(h) for h in MAINTENANCE_WINDOW.split("-"))
+    hours = {h % 24 for h in range(start, end if end > start else end + 24)}
+    SCHEDULER.register(
+        "maintenance", lambda: DATABASE.run_maintenance(hours), MAINTENANCE_INTERVAL, run_at_start=True
+    )
+    # online snapshots of every database file
+    if BACKUP_INTERVAL:
+        SCHEDULER.register("backup", lambda: DATABASE.create_backup(BACKUP_DIR, BACKUP_KEEP), BACKUP_INTERVAL)
+    SCHEDULER.start()
 
 # -------------------------
 # AUTHENTICATION HELPERS
 # -------------------------
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserIdentity:
+async def authenticate_token(token: str) -> UserIdentity:
     """
     Decode JWT token, verify that the user exists and is active, and return UserIdentity.
     Raises HTTPException if the token is invalid or the user is inactive.
@@ -89,6 +163,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserIdentity:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def token_user_id(scope) -> int | None:
+    """
+    User id from the bearer token (or ?token=) of a raw request, for the rate
+    limiter. Only the signature is checked; no database lookup.
+    """
+    token = None
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            token = value[7:].decode()
+            break
+    if token is None and b"token=" in scope.get("query_string", b""):
+        token = parse_qs(scope["query_string"].decode()).get("token", [None])[0]
+    if not token:
+        return None
+    try:
+        return int(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"])
+    except (jwt.PyJWTError, KeyError, ValueError):
+        return None
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserIdentity:
+    return await authenticate_token(token)
     
 async def require_admin(user: UserIdentity = Depends(get_current_user)):
     if not await DATABASE.is_admin(user.id):
@@ -100,7 +198,54 @@ async def require_admin(user: UserIdentity = Depends(get_current_user)):
 # -------------------------
 @app.on_event("startup")
 def startup_event():
-    start_star_refill_scheduler()
+    start_scheduler()
+
+
+@app.on_event("startup")
+async def start_cache_watch():
+    # every worker follows the writes of the others, to drop what they changed from its caches
+    global CACHE_WATCH
+    CACHE_WATCH = asyncio.create_task(DATABASE.watch_changes())
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # runs in the background: the worker accepts connections, /ready says 503 until it is done
+    global WARM_UP
+    WARM_UP = asyncio.create_task(warm_up())
+
+
+async def warm_up():
+    try:
+        STARTUP["warm_up_ms"] = await DATABASE.warm_up()
+    except Exception as e:
+        # a cold cache is slower, not broken
+        print("[STARTUP] warm-up failed:", e)
+        DATABASE.ready = True
+    STARTUP["ready_ms"] = round((time.perf_counter() - STARTED_AT) * 1000, 1)
+    print(f"[STARTUP] ready in {STARTUP['ready_ms']} ms "
+          f"(schema {STARTUP['schema']}, init_db {STARTUP['init_db_ms']} ms)")
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 503 until the startup warm-up has finished, then 200
+    with the startup timings (ms).
+    """
+    if not DATABASE.ready:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True, "startup": STARTUP}
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    if CACHE_WATCH is not None:
+        CACHE_WATCH.cancel()
+    # hand the lease over right away instead of waiting for it to expire
+    SCHEDULER.stop()
+    # write out answer counters still waiting for the next batch
+    DATABASE.question_stats.flush()
 
 
 # -------------------------
@@ -243,6 +388,55 @@ async def get_quiz_data(quiz_id: int, user: UserIdentity = Depends(get_current_u
     return await DATABASE.get_quiz_payload(quiz_id, user.id)
 
 
+# -------------------------
+# OFFLINE QUIZ BUNDLE
+# -------------------------
+@app.get("/quiz/{quiz_id}/bundle")
+async def get_quiz_bundle(quiz_id: int, user: UserIdentity = Depends(get_current_user)):
+    """
+    The quiz and the user's progress in it as one MessagePack document, for
+    playing offline. See DatabaseManager.get_quiz_bundle for the layout.
+    """
+    data = await DATABASE.get_quiz_bundle(quiz_id, user.id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    return Response(content=data, media_type=bundle.MEDIA_TYPE)
+
+
+@app.post("/quiz/{quiz_id}/sync")
+async def sync_quiz_answers(quiz_id: int, request: Request, user: UserIdentity = Depends(get_current_user)):
+    """
+    Submit the answers given offline in one go. The body is a list of
+    [question_id, selected_option_id] pairs (or {"answers": [...]}) as
+    MessagePack (Content-Type: application/msgpack) or JSON. Each answer is
+    checked like POST /submit-answer, in one transaction.
+    """
+    # the size is checked while reading, before anything is parsed
+    too_large = HTTPException(status_code=413, detail=f"At most {SYNC_MAX_BODY} bytes per sync")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > SYNC_MAX_BODY:
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > SYNC_MAX_BODY:
+            raise too_large
+    try:
+        if "msgpack" in request.headers.get("content-type", ""):
+            answers = bundle.unpackb(bytes(body), max_depth=3)  # {"answers": [[q, o], ...]}
+        else:
+            answers = json.loads(body)
+        if isinstance(answers, dict):
+            answers = answers["answers"]
+        answers = [(int(question_id), int(option_id)) for question_id, option_id in answers]
+    except (ValueError, TypeError, KeyError, RecursionError):
+        raise HTTPException(status_code=400, detail="Expected a list of [question_id, selected_option_id]")
+    result = await DATABASE.sync_answers(user.id, quiz_id, answers)
+    if not result["ok"] and result["error"] == "too_many_answers":
+        raise HTTPException(status_code=413, detail=f"At most {result['limit']} answers per sync")
+    return result
+
+
 # -------------------------
 # RESET FAILED QUIZ (FOR PENDING OR FAILED QUIZZES)
 # -------------------------
@@ -296,10 +490,108 @@ async def finish_quiz_api(
     )
     return result
 
+# -------------------------
+# LEADERBOARDS
+# -------------------------
+@app.get("/leaderboard")
+async def global_leaderboard(limit: int = 10, user: UserIdentity = Depends(get_current_user)):
+    """
+    Top players over all subjects and the caller's own rank.
+    """
+    limit = max(1, min(limit, 100))
+    return {"ok": True, **await DATABASE.get_leaderboard(user.id, limit=limit)}
+
+
+@app.get("/leaderboard/{subject_id}")
+async def subject_leaderboard(subject_id: int, limit: int = 10, user: UserIdentity = Depends(get_current_user)):
+    """
+    Top players of one subject and the caller's own rank.
+    """
+    limit = max(1, min(limit, 100))
+    return {"ok": True, **await DATABASE.get_leaderboard(user.id, subject_id, limit)}
+
+
 @app.post("/buy-stars/{package_name}")
 async def buy_stars_route(package_name: str, user: UserIdentity = Depends(get_current_user)):
     return await DATABASE.buy_star_package(user.id, package_name)
 
+
+@app.get("/wallet")
+async def wallet_route(
+    before: int | None = None,
+    limit: int = 50,
+    user: UserIdentity = Depends(get_current_user),
+):
+    """
+    The user's stars/gems and every change to them (reason, amount, reference), newest first.
+    Page with before=<next_before of the previous page>; limit is at most 200.
+    """
+    limit = max(1, min(limit, 200))
+    result = await DATABASE.get_wallet_history(user.id, before, limit)
+    if not result["ok"]:
+        raise HTTPException(status_code=404 if result["error"] == "user_not_found" else 500, detail=result["error"])
+    return result
+
+# -------------------------
+# LIVE UPDATES (SSE)
+# -------------------------
+@app.get("/events")
+async def user_events(token: str = "", header_token: str | None = Depends(oauth2_optional)):
+    """
+    Server-Sent Events stream of the caller's wallet and progress changes.
+    Starts with a "wallet" snapshot, then pushes "answer", "quiz_finished",
+    "quiz_reset", "purchase" and "refill" deltas. A "resync" event means
+    some deltas were dropped and /home-data should be fetched once.
+    """
+    user = await authenticate_token(token or header_token or "")
+    # subscribe before reading the snapshot so no change falls in between
+    sub = DATABASE.events.subscribe(user.id)
+    try:
+        wallet = await DATABASE.get_wallet(user.id)
+    except Exception:
+        DATABASE.events.unsubscribe(sub)
+        raise
+    return StreamingResponse(
+        DATABASE.events.stream(sub, {"type": "wallet", **(wallet or {})}),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# -------------------------
+# LIVE GROUP SESSIONS
+# -------------------------
+@app.post("/live/rooms")
+async def create_live_room(quiz_id: int = Form(...), user: UserIdentity = Depends(get_current_user)):
+    """
+    Open a live room for a quiz. The caller becomes its host.
+    Players join with the returned code over the /live/{code} WebSocket.
+    """
+    room = await LIVE.create(user.id, quiz_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail="Quiz not found or has no questions")
+    return {"ok": True, "code": room.code, "quiz_id": quiz_id}
+
+
+@app.websocket("/live/{code}")
+async def live_room_socket(ws: WebSocket, code: str, token: str = ""):
+    """
+    Live session socket; authenticate with ?token=<access token>.
+    Host sends {"type": "next"} / {"type": "end"}; players send
+    {"type": "answer", "question_id": ..., "option_id": ...}.
+    """
+    try:
+        user = await authenticate_token(token)
+    except HTTPException:
+        await ws.close(code=1008)
+        return
+    room = LIVE.rooms.get(code)
+    if room is None or room.state == "closed":
+        await ws.close(code=1008)
+        return
+    await ws.accept()
+    await LIVE.serve(ws, room, user.id, user.username)
+
+
 # ============================
 # ADMIN ROUTES (AUTH REQUIRED)
 # ============================
@@ -313,6 +605,84 @@ async def get_subjects(admin_key:str = Form(...), email:str = Form(...), user: U
         return {"ok":False, "message":f"vaild admin key"}
     return {"ok":False, "message":f"'{email}' is not found"}
 
+# -------- Scheduler --------
+
+@app.get("/admin/scheduler")
+def get_scheduler_metrics(user: UserIdentity = Depends(require_admin)):
+    return {"ok": True, **SCHEDULER.metrics()}
+
+# -------- Maintenance --------
+
+@app.post("/admin/maintenance")
+def run_maintenance(user: UserIdentity = Depends(require_admin)):
+    """
+    Runs the database maintenance now (all steps, whatever the hour) and returns its report.
+    """
+    report = DATABASE.run_maintenance(force=True)
+    if report is False:
+        raise HTTPException(status_code=500, detail="Maintenance failed")
+    return {"ok": True, "report": report}
+
+
+@app.get("/admin/maintenance")
+def get_maintenance_report(user: UserIdentity = Depends(require_admin)):
+    """
+    Report of the last maintenance run of any worker: per file and step, its duration in ms.
+    """
+    return {"ok": True, "report": DATABASE.get_maintenance_report()}
+
+# -------- Backups --------
+
+@app.post("/admin/backup", status_code=202)
+def start_backup(user: UserIdentity = Depends(require_admin)):
+    """
+    Starts a hot backup in the background; follow it with GET /admin/backups.
+    """
+    if DATABASE.backup_running:
+        raise HTTPException(status_code=409, detail="A backup is already running")
+    threading.Thread(target=DATABASE.create_backup, args=(BACKUP_DIR, BACKUP_KEEP), daemon=True).start()
+    return {"ok": True, "started": True}
+
+
+@app.get("/admin/backups")
+def list_backups(user: UserIdentity = Depends(require_admin)):
+    """
+    Snapshots on disk, newest first, with the state of this worker's last backup.
+    """
+    return {
+        "ok": True,
+        "running": DATABASE.backup_running,
+        "last": DATABASE.last_backup,
+        "snapshots": backup.list_snapshots(BACKUP_DIR),
+    }
+
+# -------- Rate limits --------
+
+@app.get("/admin/rate-limits")
+def get_rate_limit_metrics(user: UserIdentity = Depends(require_admin)):
+    return {"ok": True, "rules": RATE_LIMITER.metrics()}
+
+# -------- Locks --------
+
+@app.get("/admin/locks")
+def get_lock_metrics(user: UserIdentity = Depends(require_admin)):
+    """
+    Wait times of this worker: the per-user locks, and each file's SQLite write lock.
+    """
+    return {"ok": True, "locks": DATABASE.locks.metrics()}
+
+# -------- Caches --------
+
+@app.get("/admin/caches")
+def get_cache_metrics(user: UserIdentity = Depends(require_admin)):
+    """
+    Size and hit rate of this worker's in-memory caches, what the
+    coherence watch dropped from them after other workers' writes, and how
+    many catalog reads joined an identical one already in flight.
+    """
+    return {"ok": True, "progress": DATABASE.progress.metrics(), "coherence": DATABASE.coherence_metrics(),
+            "coalesced": DATABASE.flights.metrics()}
+
 # -------- Subjects --------
 
 @app.get("/admin/subjects")
@@ -356,7 +726,7 @@ async def get_quizzes_by_subject(
         "ok": True,
         "subject_id": subject_id,
         "quizzes": [
-            {"id": q[0], "title": q[1], "gems_reward": q[2]}
+            {"id": q[0], "title": q[1], "gems_reward": q[2], "sample_size": q[3]}
             for q in quizzes
         ]
     }
@@ -367,15 +737,25 @@ async def create_quiz(
     subject_id: int = Form(...),
     title: str = Form(...),
     gems_reward: int = Form(0),
+    sample_size: int = Form(0),
     user: UserIdentity = Depends(require_admin)
 ):
-    quiz_id = await DATABASE.add_quiz(subject_id, title, gems_reward)
+    """
+    sample_size > 0 makes each attempt draw that many random questions
+    from the quiz instead of serving all of them.
+    """
+    if sample_size < 0:
+        raise HTTPException(status_code=400, detail="sample_size must be 0 or more")
+    quiz_id = await DATABASE.add_quiz(subject_id, title, gems_reward, sample_size)
+    if quiz_id is None:
+        raise HTTPException(status_code=404, detail="Subject not found")
     return {
         "ok": True,
         "id": quiz_id,
         "subject_id": subject_id,
         "title": title,
-        "gems_reward": gems_reward
+        "gems_reward": gems_reward,
+        "sample_size": sample_size
     }
 
 
@@ -384,16 +764,20 @@ async def update_quiz(
     quiz_id: int,
     title: str = Form(...),
     gems_reward: int = Form(...),
+    sample_size: int | None = Form(None),
     user: UserIdentity = Depends(require_admin)
 ):
-    updated = await DATABASE.update_quiz(quiz_id, title, gems_reward)
+    if sample_size is not None and sample_size < 0:
+        raise HTTPException(status_code=400, detail="sample_size must be 0 or more")
+    updated = await DATABASE.update_quiz(quiz_id, title, gems_reward, sample_size)
     if not updated:
         raise HTTPException(status_code=404, detail="Quiz not found")
     return {
         "ok": True,
         "id": quiz_id,
         "title": title,
-        "gems_reward": gems_reward
+        "gems_reward": gems_reward,
+        "sample_size": sample_size
     }
 
 
@@ -408,6 +792,148 @@ async def get_quiz_questions(
     return {"ok": True, "quiz_id": quiz_id, "questions": questions}
 
 
+@app.get("/admin/quiz_questions/{quiz_id}/stats")
+async def get_quiz_question_stats(
+    quiz_id: int,
+    user: UserIdentity = Depends(require_admin)
+):
+    """
+    Attempts, correct rate and option pick counts for every question of a quiz.
+    """
+    stats = await DATABASE.get_question_stats(quiz_id)
+    return {"ok": True, "quiz_id": quiz_id, "questions": stats}
+
+
+@app.post("/admin/stats/recompute")
+async def recompute_question_stats(user: UserIdentity = Depends(require_admin)):
+    """
+    Rebuild the per-question counters from all recorded answers.
+    """
+    return await DATABASE.recompute_question_stats()
+
+
+@app.get("/admin/search")
+async def search_questions(
+    q: str,
+    page: int = 1,
+    page_size: int = 20,
+    user: UserIdentity = Depends(require_admin)
+):
+    """
+    Full-text search over all questions and their options.
+    All words must match; end a word with * for a prefix match (e.g. newt*).
+    """
+    page = max(1, page)
+    page_size = max(1, min(page_size, 100))
+    result = await DATABASE.search_questions(q, page, page_size)
+    if not result["ok"]:
+        raise HTTPException(status_code=503, detail="Search is not available")
+    return {"query": q, "page": page, "page_size": page_size, **result}
+
+
+@app.post("/admin/import")
+async def import_questions(
+    request: Request,
+    format: str | None = None,
+    on_duplicate: str = "flag",
+    user: UserIdentity = Depends(require_admin)
+):
+    """
+    Bulk import of questions from a JSONL or CSV request body (send the file
+    as the raw body, e.g. curl --data-binary @bank.jsonl). The body is parsed
+    as it arrives and written in chunks, one transaction each.
+
+    format: "jsonl" or "csv"; guessed from Content-Type when left out.
+    on_duplicate: "flag", "reject" or "allow", as for POST /admin/questions.
+    Rows are matched on external_id, so uploading the same file again updates
+    the questions instead of adding them twice. See importer.parse_row for
+    the fields.
+
+    The request returns once the whole body is imported, with the job's
+    summary. The body is read by this request, so the job cannot outlive
+    it; while it runs, GET /admin/imports on the same worker (jobs are kept
+    per worker) lists it with its progress so far.
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "jsonl"
+    if format not in importer.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be jsonl or csv")
+    if on_duplicate not in DUPLICATE_POLICIES:
+        raise HTTPException(status_code=400, detail="Invalid on_duplicate")
+    job = await importer.run_import(DATABASE, IMPORTS, user.id, request.stream(), format, on_duplicate)
+    return {"ok": True, **job.summary()}
+
+
+@app.get("/admin/import/{job_id}")
+async def get_import_progress(job_id: str, user: UserIdentity = Depends(require_admin)):
+    """A finished (or still running) import of this worker, with its error lists."""
+    job = IMPORTS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return {"ok": True, **job.summary()}
+
+
+@app.get("/admin/imports")
+async def list_imports(user: UserIdentity = Depends(require_admin)):
+    """
+    Running and recent imports of this worker, newest last, without the error lists.
+    """
+    return {
+        "ok": True,
+        "imports": [
+            {k: v for k, v in job.summary().items() if k not in ("errors", "duplicates")}
+            for job in IMPORTS.jobs.values()
+        ]
+    }
+
+
+@app.get("/admin/duplicates")
+async def get_duplicate_clusters(limit: int = 50, user: UserIdentity = Depends(require_admin)):
+    """
+    Clusters of near-duplicate questions already in the bank, largest first.
+    """
+    limit = max(1, min(limit, 500))
+    return {"ok": True, "clusters": await DATABASE.get_duplicate_clusters(limit)}
+
+
+@app.get("/admin/export")
+async def export_table(
+    table: str = "questions",
+    format: str = "jsonl",
+    gzip: bool = False,
+    subject_id: int | None = None,
+    quiz_id: int | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    user: UserIdentity = Depends(require_admin)
+):
+    """
+    Streams a dump of the question bank or of the user results.
+
+    table: "questions" (import format, so the file can be uploaded again to
+    POST /admin/import), "user_answers" or "user_quizzes".
+    format: "jsonl" or "csv"; gzip=true compresses the stream.
+    subject_id / quiz_id: only rows of that subject or quiz.
+    since / until: unix seconds, answered_at or completed_at in [since, until)
+    (user tables only).
+    """
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail="Unknown table")
+    if format not in exporter.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be jsonl or csv")
+    if table == "questions" and (since is not None or until is not None):
+        raise HTTPException(status_code=400, detail="since/until only apply to user tables")
+
+    columns = await DATABASE.export_columns(table)
+    batches = DATABASE.export_rows(table, subject_id, quiz_id, since, until)
+    filename = f"{table}-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        exporter.stream(batches, format, columns, compress=gzip),
+        media_type="application/gzip" if gzip else exporter.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # REQUIRED for Edit Question
 @app.get("/admin/questions/{question_id}")
 async def get_single_question(
@@ -428,17 +954,30 @@ async def create_question(
     options: list[str] = Form(...),
     correct_option_index: int = Form(...),
     stars_reward: int = Form(1),
+    on_duplicate: str = Form("flag"),
     user: UserIdentity = Depends(require_admin)
 ):
-    question_id = await DATABASE.add_question(
+    """
+    on_duplicate: "flag" (default) adds the question and lists near-duplicates
+    already in the bank, "reject" refuses it with 409 if there are any,
+    "allow" skips the check.
+    """
+    if on_duplicate not in DUPLICATE_POLICIES:
+        raise HTTPException(status_code=400, detail="Invalid on_duplicate")
+    result = await DATABASE.add_question(
         quiz_id,
         question_text,
         qtype,
         options,
         correct_option_index,
-        stars_reward
+        stars_reward,
+        on_duplicate
     )
-    return {"ok": True, "id": question_id, "quiz_id": quiz_id}
+    if not result["ok"]:
+        if result["error"] == "quiz_not_found":
+            raise HTTPException(status_code=404, detail="Quiz not found")
+        return JSONResponse(status_code=409, content={"detail": "Near-duplicate question", **result})
+    return {"ok": True, "id": result["id"], "quiz_id": quiz_id, "duplicates": result["duplicates"]}
 
 
 @app.put("/admin/questions/{question_id}")
@@ -456,6 +995,7 @@ async def update_question(
     updated = await DATABASE.update_question(
         question_id,
         question_text,
+        question_type,
         options,
         correct_option_index,
         stars_reward
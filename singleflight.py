@@ -0,0 +1,50 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent reads: while a read for a key is running,
+    other callers of the same key await its result instead of starting their
+    own. Nothing is kept once it finishes; a writer calls forget() so reads
+    started after its write do not join one that began before it.
+
+    The read runs as its own task: a caller that goes away (client
+    disconnected) does not cancel it for the others. Results are shared,
+    so callers must not mutate them. Event loop only.
+    """
+    def __init__(self):
+        self.inflight = {}
+        self.stats = {}  # name -> [calls, coalesced]
+
+    async def run(self, key: tuple, make):
+        """
+        key: (name, *args) of the read; name groups the metrics.
+        make: returns the awaitable that performs the read.
+        """
+        stats = self.stats.get(key[0])
+        if stats is None:
+            stats = self.stats[key[0]] = [0, 0]
+        stats[0] += 1
+        task = self.inflight.get(key)
+        if task is not None:
+            stats[1] += 1
+        else:
+            task = self.inflight[key] = asyncio.ensure_future(make())
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task) -> None:
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even when every caller went away
+
+    def forget(self) -> None:
+        """Reads started from now on do not join the ones in flight."""
+        self.inflight.clear()
+
+    def metrics(self) -> dict:
+        return {
+            name: {"calls": calls, "coalesced": coalesced}
+            for name, (calls, coalesced) in self.stats.items()
+        }
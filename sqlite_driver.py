@@ -0,0 +1,74 @@
+import asyncio
+import itertools
+import queue
+import threading
+
+
+class DriverThread:
+    """
+    A dedicated thread that runs database closures one after another.
+
+    Closures submitted while the thread is busy are queued and executed
+    back to back as one pipeline, and their results are handed back to the
+    event loop with a single wake-up per batch instead of one per call.
+    Connections opened inside the closures stay bound to this thread, so
+    they are reused across calls.
+    """
+    def __init__(self, name: str):
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((loop, fut, fn))
+        return fut
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            done = {}
+            for loop, fut, fn in batch:
+                try:
+                    outcome = (fut, fn(), None)
+                except BaseException as e:
+                    outcome = (fut, None, e)
+                done.setdefault(loop, []).append(outcome)
+
+            for loop, outcomes in done.items():
+                loop.call_soon_threadsafe(_resolve, outcomes)
+
+
+def _resolve(outcomes):
+    for fut, result, error in outcomes:
+        if fut.cancelled():
+            continue
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+
+class DriverPool:
+    """
+    A fixed set of driver threads; each call goes to the least busy one.
+    """
+    def __init__(self, size: int, name: str = "sqlite-driver"):
+        self.threads = [DriverThread(f"{name}-{i}") for i in range(size)]
+        self._rr = itertools.cycle(self.threads)
+
+    def submit(self, fn) -> asyncio.Future:
+        driver = next(self._rr)
+        if driver.pending():
+            driver = min(self.threads, key=DriverThread.pending)
+        return driver.submit(fn)